@@ -0,0 +1,307 @@
+# -*- coding: utf8 -*-
+"""
+A load testing harness for the message dispatch pipeline, run with ``helga bench``. Recorded
+channel logs or synthetic chat traffic are replayed through a real IRC client, connected to an
+in-memory transport rather than a server, so every message takes the same path as live traffic:
+``privmsg``, :meth:`~helga.plugins.Registry.preprocess`, :meth:`~helga.plugins.Registry.process`
+and ``msg``. Results are JSON, so runs can be saved and compared to catch regressions.
+
+Settings must be configured before this module is imported, since it loads plugins.
+"""
+import gc
+import json
+import os
+import platform
+import random
+import time
+
+from collections import defaultdict
+
+try:
+    from twisted.internet.testing import StringTransport
+except ImportError:  # pragma: no cover, Twisted before 19.7
+    from twisted.test.proto_helpers import StringTransport
+
+import helga
+
+from helga import log, settings
+from helga.benchmarks import compare_value, percentile
+from helga.comm import irc
+from helga.plugins import registry
+from helga.util.encodings import from_unicode
+
+
+logger = log.getLogger(__name__)
+
+#: The result fields compared by :func:`compare`, and whether a higher value is better
+COMPARED_FIELDS = (
+    ('messages_per_second', True),
+    ('latency_p50_ms', False),
+    ('latency_p90_ms', False),
+    ('latency_p99_ms', False),
+    ('allocations_per_message', False),
+)
+
+#: Chatter making up most synthetic traffic
+SYNTHETIC_CHATTER = (
+    u'has anyone looked at the build yet?',
+    u'lunch in ten minutes',
+    u'I think the deploy is stuck again',
+    u'see https://example.com/issues/123 for details',
+    u'☃ it snowed overnight',
+    u'ok',
+)
+
+#: Commands making up the rest of synthetic traffic, formatted with the bot nick
+SYNTHETIC_COMMANDS = (
+    u'{nick} ping',
+    u'{nick} help',
+    u'{char}ping',
+    u'{char}version',
+    u'{nick}: how are you?',
+)
+
+
+def synthetic_traffic(count, channels=(u'#bench',), nicks=20, seed=0):
+    """
+    Generates a repeatable list of chat messages: mostly chatter, with a fifth of the messages
+    bot commands, and one in twenty a private message
+
+    :param count: the number of messages
+    :param channels: the channels messages are sent on
+    :param nicks: the number of distinct nicks sending messages
+    :param seed: the random seed, the same seed always gives the same traffic
+    :returns: a list of (channel, nick, message) tuples, where channel is None for private messages
+    """
+    rand = random.Random(seed)
+    traffic = []
+
+    for _ in xrange(count):
+        nick = u'user{0}'.format(rand.randrange(nicks))
+        if rand.random() < 0.2:
+            message = rand.choice(SYNTHETIC_COMMANDS).format(
+                nick=settings.NICK, char=getattr(settings, 'COMMAND_PREFIX_CHAR', '!'))
+        else:
+            message = rand.choice(SYNTHETIC_CHATTER)
+
+        channel = None if rand.random() < 0.05 else rand.choice(channels)
+        traffic.append((channel, nick, message))
+
+    return traffic
+
+
+def recorded_traffic(paths):
+    """
+    Reads chat messages to replay from channel log files, in any format the channel logger
+    writes. The channel of each file is the name of the directory containing it, as in
+    :data:`~helga.settings.CHANNEL_LOGGING_DIR`. Messages sent by the bot are skipped.
+
+    :param paths: a list of channel log file paths
+    :returns: a list of (channel, nick, message) tuples
+    """
+    traffic = []
+
+    for path in paths:
+        channel = os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+        if path.endswith('.log'):
+            with open(path, 'rb') as fp:
+                messages = map(log.record_message, log.read_records(fp))
+        else:
+            with log.open_channel_log(path) as fp:
+                messages = list(log.parse_messages(fp))
+
+        traffic.extend((channel, message['nick'], message['message'])
+                       for message in messages
+                       if message['nick'] and message['nick'] != settings.NICK)
+
+    return traffic
+
+
+class BenchClient(irc.Client):
+    """
+    An IRC client writing to an in-memory transport, which counts and discards what it sends
+    """
+
+    def __init__(self):
+        irc.Client.__init__(self)
+
+        # Sending must not be deferred to a reactor that is not running
+        self.lineRate = None
+        self.makeConnection(StringTransport())
+        self.transport.clear()
+        self.responses = 0
+
+    def msg(self, channel, message):
+        irc.Client.msg(self, channel, message)
+        self.responses += 1
+
+    def replay(self, channel, nick, message):
+        """
+        Dispatch a message exactly as if it had been received from the IRC server
+
+        :param channel: the channel the message was sent on, or None for a private message
+        :param nick: the nick sending the message
+        :param message: the message contents
+        """
+        user = from_unicode(u'{0}!~{0}@bench.invalid'.format(nick))
+        self.privmsg(user, from_unicode(channel or self.nickname), from_unicode(message))
+        self.transport.clear()
+
+
+def load_plugins(plugins=None):
+    """
+    Load plugins for a benchmark run
+
+    :param plugins: a list of plugin names to load and enable on every channel, or None to load
+                    and enable plugins as configured by settings
+    """
+    if plugins is not None:
+        registry.whitelist_plugins = set(plugins)
+        registry.blacklist_plugins = set()
+        registry.enabled_plugins = defaultdict(lambda: frozenset(plugins))
+
+    registry.load()
+
+    missing = set(plugins or ()) - registry.all_plugins
+    if missing:
+        logger.warning('Plugins not installed: %s', ', '.join(sorted(missing)))
+
+
+def run(traffic, plugins=None, warmup=100):
+    """
+    Replay traffic through the dispatch pipeline, measuring throughput, per-message latency and
+    allocations. Channel logging is disabled for the run, so that replayed traffic is not logged, and
+    so is message suppression (see :mod:`helga.suppress`), plugin rate limiting and plugin response
+    caching, so that replayed messages all reach plugins and run them.
+    Allocations are counted in a second, untimed pass, as the net number of container objects each
+    message leaves allocated including garbage cycles, which is what drives garbage collection.
+
+    :param traffic: a list of (channel, nick, message) tuples, see :func:`synthetic_traffic`
+    :param plugins: a list of plugin names to enable, or None to use the configured plugins
+    :param warmup: the number of messages replayed before measuring, to fill caches
+    :returns: a dictionary of results
+    """
+    settings.CHANNEL_LOGGING = False
+    settings.MESSAGE_DEDUP_WINDOW = 0
+    settings.BOT_LOOP_LENGTH = 0
+    settings.PLUGIN_RATE_LIMITS = {}
+    load_plugins(plugins)
+
+    for plugin in registry.registered_names:
+        plugin.cache = None
+
+    client = BenchClient()
+
+    for channel, nick, message in traffic[:warmup]:
+        client.replay(channel, nick, message)
+
+    client.responses = 0
+    latencies = []
+    started = time.time()
+
+    for channel, nick, message in traffic:
+        start = time.time()
+        client.replay(channel, nick, message)
+        latencies.append(time.time() - start)
+
+    elapsed = time.time() - started
+    responses = client.responses
+
+    # Count allocations with garbage collection disabled, since it frees objects uncounted
+    gc.collect()
+    gc.disable()
+    try:
+        allocations = 0
+        for channel, nick, message in traffic:
+            before = gc.get_count()[0]
+            client.replay(channel, nick, message)
+            allocations += max(0, gc.get_count()[0] - before)
+    finally:
+        gc.enable()
+        gc.collect()
+
+    latencies.sort()
+    count = len(traffic)
+
+    return {
+        'helga_version': helga.__version__,
+        'python_version': platform.python_version(),
+        'timestamp': int(started),
+        'backend': 'irc',
+        'plugins': sorted(name for name in registry.all_plugins if plugins is None or name in plugins),
+        'messages': count,
+        'responses': responses,
+        'seconds': elapsed,
+        'messages_per_second': count / elapsed if elapsed else None,
+        'latency_p50_ms': percentile(latencies, 50) * 1000 if count else None,
+        'latency_p90_ms': percentile(latencies, 90) * 1000 if count else None,
+        'latency_p99_ms': percentile(latencies, 99) * 1000 if count else None,
+        'latency_max_ms': latencies[-1] * 1000 if count else None,
+        'allocations_per_message': float(allocations) / count if count else None,
+    }
+
+
+def compare(baseline, results, tolerance=10):
+    """
+    Compares benchmark results with a baseline run
+
+    :param baseline: a dictionary of results from a previous run, see :func:`run`
+    :param results: a dictionary of results from this run
+    :param tolerance: the percentage a result may be worse than the baseline before it is a regression
+    :returns: a two-tuple of a list of lines describing each compared result, and a list of the
+              names of the results that regressed
+    """
+    lines, regressions = [], []
+
+    for field, higher_is_better in COMPARED_FIELDS:
+        old, new = baseline.get(field), results.get(field)
+        if not old or new is None:
+            continue
+
+        change, regressed = compare_value(old, new, tolerance, higher_is_better)
+        if regressed:
+            regressions.append(field)
+
+        lines.append('{0:<26} {1:>12.3f} {2:>12.3f} {3:>+8.1f}%{4}'.format(
+            field, old, new, change, '  REGRESSION' if regressed else ''))
+
+    return lines, regressions
+
+
+def main(args):
+    """
+    Run the ``helga bench`` command
+
+    :param args: parsed command line arguments, see :func:`helga.bin.helga.bench_parser`
+    :returns: the process exit status, 1 if a result regressed compared to a baseline
+    """
+    if args.logs:
+        traffic = recorded_traffic(args.logs)
+    else:
+        traffic = synthetic_traffic(args.messages, seed=args.seed)
+
+    plugins = None
+    if args.plugins is not None:
+        plugins = [name.strip() for name in args.plugins.split(',') if name.strip()]
+
+    results = run(traffic, plugins=plugins, warmup=args.warmup)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    print(output)
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as fp:
+        baseline = json.load(fp)
+
+    lines, regressions = compare(baseline, results, tolerance=args.tolerance)
+    print('{0:<26} {1:>12} {2:>12} {3:>9}'.format('', 'baseline', 'current', 'change'))
+    for line in lines:
+        print(line)
+
+    return 1 if regressions else 0
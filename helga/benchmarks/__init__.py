@@ -0,0 +1,331 @@
+"""
+Microbenchmarks of helga's hot paths: command parsing and matching, plugin prioritization,
+string encoding, chat backend message parsing, channel log paging and webhook route dispatch.
+Run them with::
+
+    $ python -m helga.benchmarks --output=before.json
+    $ python -m helga.benchmarks --compare=before.json
+
+Each benchmark is warmed up, then timed over several repetitions of enough calls to take a
+measurable time. Results are saved as JSON and can be compared with a saved baseline, in which
+case the exit status is 1 if any benchmark is slower by more than a tolerance.
+
+Benchmarks are functions decorated with :func:`benchmark` in the modules of this package. A benchmark
+function sets up whatever it needs and returns the callable to time. If it needs to clean up
+afterwards, it can instead be a generator that yields the callable once, and cleans up after.
+
+Memory benchmarks, decorated with :func:`memory_benchmark`, instead check that long-lived state stays
+bounded. A memory benchmark function runs a workload, such as a simulated month of chat traffic, and
+returns the size in bytes of the state it checks, sampled over the course of the workload. Its peak
+size is compared with a baseline rather than its time.
+"""
+from __future__ import absolute_import
+
+import argparse
+import collections
+import gc
+import importlib
+import json
+import os
+import platform
+import re
+import sys
+import time
+import timeit
+import types
+
+import helga
+
+from helga import metrics, settings
+
+
+#: The modules of this package defining benchmarks
+MODULES = ('comm', 'encodings', 'logger', 'plugins', 'webhooks')
+
+#: Registered benchmark functions, by name
+BENCHMARKS = collections.OrderedDict()
+
+#: Registered memory benchmark functions, by name
+MEMORY_BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name):
+    """
+    Decorator registering a benchmark function. Benchmark names are prefixed with the name
+    of the module defining them, i.e. ``plugins.command_parse``
+
+    :param name: the name of the benchmark
+    """
+    def register(fn):
+        module = fn.__module__.rsplit('.', 1)[-1]
+        BENCHMARKS['{0}.{1}'.format(module, name)] = fn
+        return fn
+    return register
+
+
+def memory_benchmark(name):
+    """
+    Decorator registering a memory benchmark function, named as for :func:`benchmark`. The function
+    should return a list of sizes in bytes sampled while it runs, see :func:`deep_size`.
+
+    :param name: the name of the benchmark
+    """
+    def register(fn):
+        module = fn.__module__.rsplit('.', 1)[-1]
+        MEMORY_BENCHMARKS['{0}.{1}'.format(module, name)] = fn
+        return fn
+    return register
+
+
+def deep_size(obj):
+    """
+    Returns the approximate number of bytes held by an object and everything it refers to, like
+    the sizes ``tracemalloc`` reports on later versions of python. Classes, modules and functions
+    are not counted, nor anything only reachable from them, since they are shared.
+
+    :param obj: the object to measure
+    """
+    shared = (type, types.ClassType, types.ModuleType, types.FunctionType, types.MethodType,
+              types.BuiltinFunctionType)
+    seen, stack, size = set(), [obj], 0
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, shared):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+
+    return size
+
+
+def measure_memory(fn):
+    """
+    Run a memory benchmark
+
+    :param fn: a memory benchmark function
+    :returns: a dictionary of the first, last and peak sizes in bytes the benchmark sampled, the
+              number of samples, and the growth of the resident memory of this process while it ran
+    """
+    gc.collect()
+    rss = metrics.process_rss()
+    samples = fn()
+    gc.collect()
+
+    return {
+        'first_bytes': samples[0],
+        'last_bytes': samples[-1],
+        'peak_bytes': max(samples),
+        'samples': len(samples),
+        'rss_growth_bytes': metrics.process_rss() - rss,
+    }
+
+
+def load():
+    """
+    Import every benchmark module, registering its benchmarks. Settings must be configured first,
+    since benchmarks import plugins.
+    """
+    for module in MODULES:
+        importlib.import_module('{0}.{1}'.format(__name__, module))
+
+
+def measure(fn, warmup=0.1, repeat=5, min_time=0.1):
+    """
+    Time a callable. It is first called repeatedly for ``warmup`` seconds, which also estimates how
+    many calls take ``min_time`` seconds. Each repetition then times that many calls, with garbage
+    collection disabled as ``timeit`` does.
+
+    :param fn: the callable to time
+    :param warmup: the number of seconds to call the callable before timing it
+    :param repeat: the number of timed repetitions
+    :param min_time: the minimum number of seconds each repetition should take
+    :returns: a dictionary of the best and median nanoseconds per call over all repetitions,
+              and the number of calls in each repetition
+    """
+    timer = timeit.default_timer
+    calls, start = 0, timer()
+    while True:
+        fn()
+        calls += 1
+        elapsed = timer() - start
+        if elapsed >= warmup:
+            break
+
+    number = max(1, int(min_time * calls / elapsed)) if elapsed else calls
+    times = []
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in xrange(repeat):
+            start = timer()
+            for _ in xrange(number):
+                fn()
+            times.append((timer() - start) / number)
+    finally:
+        if enabled:
+            gc.enable()
+
+    times.sort()
+    return {
+        'best_ns': times[0] * 1e9,
+        'median_ns': percentile(times, 50) * 1e9,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def percentile(values, percent):
+    """
+    Returns a percentile of a sorted list of values, or None if the list is empty
+
+    :param values: a sorted list of numbers
+    :param percent: the percentile, from 0 to 100
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def compare_value(old, new, tolerance=10, higher_is_better=False):
+    """
+    Compares a result with its baseline value
+
+    :param old: the baseline value
+    :param new: the value from this run
+    :param tolerance: the percentage the value may be worse than the baseline before it is a regression
+    :param higher_is_better: True if a higher value is better, such as a throughput, rather than a time
+    :returns: a two-tuple of the percentage change from the baseline, and whether it is a regression
+    """
+    change = (new - old) * 100.0 / old
+    return change, (-change if higher_is_better else change) > tolerance
+
+
+def run_benchmark(fn, **kwargs):
+    """
+    Set up and measure a single benchmark, cleaning up after if it is a generator
+
+    :param fn: a benchmark function
+    :param kwargs: keyword arguments for :func:`measure`
+    """
+    setup = fn()
+    if not hasattr(setup, 'next'):
+        return measure(setup, **kwargs)
+
+    try:
+        return measure(next(setup), **kwargs)
+    finally:
+        setup.close()
+
+
+def run(pattern=None, **kwargs):
+    """
+    Run benchmarks
+
+    :param pattern: an optional regular expression, only benchmarks with names it matches are run
+    :param kwargs: keyword arguments for :func:`measure`
+    :returns: a report dictionary of version information, and results by benchmark name
+    """
+    results = collections.OrderedDict()
+    for name, fn in BENCHMARKS.items():
+        if pattern is None or re.search(pattern, name):
+            results[name] = run_benchmark(fn, **kwargs)
+
+    for name, fn in MEMORY_BENCHMARKS.items():
+        if pattern is None or re.search(pattern, name):
+            results[name] = measure_memory(fn)
+
+    return {
+        'helga_version': helga.__version__,
+        'python_version': platform.python_version(),
+        'timestamp': int(time.time()),
+        'benchmarks': results,
+    }
+
+
+def compare(baseline, report, tolerance=10):
+    """
+    Compares the median time of each benchmark, or the peak size of each memory benchmark, with
+    a baseline report
+
+    :param baseline: a report from a previous run, see :func:`run`
+    :param report: a report from this run
+    :param tolerance: the percentage a benchmark may be slower than the baseline before it is a regression
+    :returns: a two-tuple of a list of lines describing each benchmark, and a list of the names of
+              the benchmarks that regressed
+    """
+    lines, regressions = [], []
+    old_results = baseline.get('benchmarks', {})
+
+    for name, result in report['benchmarks'].items():
+        field, unit = ('median_ns', 'ns') if 'median_ns' in result else ('peak_bytes', 'B')
+        new = result[field]
+        old = old_results.get(name, {}).get(field)
+
+        if not old:
+            lines.append('{0:<40} {1:>12} {2:>12.0f} {3}'.format(name, '-', new, unit))
+            continue
+
+        change, regressed = compare_value(old, new, tolerance)
+        if regressed:
+            regressions.append(name)
+
+        lines.append('{0:<40} {1:>12.0f} {2:>12.0f} {3:<2} {4:>+8.1f}%{5}'.format(
+            name, old, new, unit, change, '  REGRESSION' if regressed else ''))
+
+    return lines, regressions
+
+
+def main(argv=None):
+    """
+    Run benchmarks from the command line
+
+    :param argv: the command line arguments, defaulting to ``sys.argv``
+    :returns: the process exit status, 1 if a benchmark regressed compared to a baseline
+    """
+    parser = argparse.ArgumentParser(prog='python -m helga.benchmarks',
+                                     description='Microbenchmarks of helga hot paths')
+    parser.add_argument('--settings', help=(
+        'Custom helga settings overrides, as for the helga command. This can also be set via the '
+        'HELGA_SETTINGS environment variable.'
+    ))
+    parser.add_argument('--filter', help='A regular expression, only matching benchmarks are run')
+    parser.add_argument('--warmup', type=float, default=0.1,
+                        help='Seconds to run each benchmark before timing it (default: 0.1)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='The number of timed repetitions of each benchmark (default: 5)')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='The minimum number of seconds of each repetition (default: 0.1)')
+    parser.add_argument('--output', help='A file to save the JSON report to')
+    parser.add_argument('--compare', metavar='BASELINE', help=(
+        'A JSON report of a previous run to compare with. The exit status is 1 if any benchmark '
+        'is slower by more than the tolerance.'
+    ))
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help='The percentage a benchmark may be slower than the baseline (default: 10)')
+    args = parser.parse_args(argv)
+
+    settings.configure(args.settings or os.environ.get('HELGA_SETTINGS', ''))
+    settings.LOG_LEVEL = 'WARNING'
+    load()
+
+    report = run(args.filter, warmup=args.warmup, repeat=args.repeat, min_time=args.min_time)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+            fp.write('\n')
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+
+    lines, regressions = compare(baseline, report, tolerance=args.tolerance)
+    print('{0:<40} {1:>12} {2:>12} {3:>12}'.format('median time per call, or peak size', 'baseline', 'current',
+                                                    'change'))
+    for line in lines:
+        print(line)
+
+    return 1 if regressions else 0
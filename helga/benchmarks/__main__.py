@@ -0,0 +1,8 @@
+from __future__ import absolute_import
+
+import sys
+
+from helga.benchmarks import main
+
+
+sys.exit(main())
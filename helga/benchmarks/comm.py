@@ -0,0 +1,114 @@
+"""
+Benchmarks of chat backend message parsing, which happens for every message received or sent,
+and of the memory chat clients hold for tracking the last message of every user
+"""
+from __future__ import absolute_import
+
+import random
+
+from twisted.words.xish import domish
+
+from helga import settings
+from helga.benchmarks import benchmark, deep_size, memory_benchmark
+from helga.comm import base, slack, xmpp
+
+
+#: The number of simulated days of chat traffic in :func:`last_message_month`
+DAYS = 30
+
+#: The number of simulated messages per day
+MESSAGES_PER_DAY = 2000
+
+
+class StoppedLoopingCall(object):
+    """
+    Stands in for the looping calls the Slack client refreshes users and channels with
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def start(self, interval, now=True):
+        pass
+
+
+def slack_client():
+    """
+    Returns a Slack client with a few hundred known users and channels, without connecting
+    to Slack or starting its refresh tasks
+    """
+    users = [{'id': 'U{0:08d}'.format(i), 'name': 'user{0}'.format(i), 'is_bot': False}
+             for i in xrange(300)]
+    channels = [{'id': 'C{0:08d}'.format(i), 'name': 'channel{0}'.format(i)} for i in xrange(100)]
+
+    # The client overrides this setting with its own nick
+    prefix = getattr(settings, 'COMMAND_PREFIX_BOTNICK', None)
+    looping_call = slack.task.LoopingCall
+    slack.task.LoopingCall = StoppedLoopingCall
+    try:
+        return slack.Client({'self': {'name': 'helga'}, 'users': users, 'channels': channels})
+    finally:
+        slack.task.LoopingCall = looping_call
+        settings.COMMAND_PREFIX_BOTNICK = prefix
+
+
+@benchmark('slack_parse_incoming_message')
+def slack_parse_incoming_message():
+    client = slack_client()
+    message = u'<@U00000042> can you look at <#C00000007|channel7>? <@U00000299|user299> says it is broken'
+    return lambda: client._parse_incoming_message(message)
+
+
+@benchmark('slack_sanitize')
+def slack_sanitize():
+    client = slack_client()
+    return lambda: client._sanitize(u'if a < b && b > c then <reply> is "ok" -> done')
+
+
+@benchmark('xmpp_parse')
+def xmpp_parse():
+    server = settings.SERVER
+    settings.SERVER = {'HOST': 'example.com', 'USERNAME': 'helga', 'PASSWORD': 'password'}
+    try:
+        client = xmpp.Client(xmpp.Factory())
+    finally:
+        settings.SERVER = server
+
+    element = domish.Element((None, 'message'))
+    element['from'] = 'bots@conference.example.com/alice'
+    element['type'] = 'groupchat'
+    element.addElement('body', content=u'helga deploy web-frontend to production')
+
+    def parse():
+        client.parse_channel(element)
+        client.parse_nick(element)
+        client.parse_message(element)
+
+    return parse
+
+
+@memory_benchmark('last_message_month')
+def last_message_month():
+    """
+    Tracks the last message of every user over a simulated month of traffic, as chat clients do,
+    sampling the size of the tracked messages at the end of each day. New channels and nicks keep
+    appearing, and half of the traffic is on one busy channel, so with the limits
+    :data:`~helga.settings.LAST_MESSAGE_MAX_CHANNELS` and :data:`~helga.settings.LAST_MESSAGE_MAX_NICKS`
+    the size should level off rather than grow with the number of days.
+    """
+    rand = random.Random(0)
+    client = base.BaseClient()
+    samples = []
+
+    for day in xrange(DAYS):
+        for _ in xrange(MESSAGES_PER_DAY):
+            if rand.random() < 0.5:
+                channel = u'#busy'
+            else:
+                channel = u'#channel{0}'.format(day * 80 + rand.randrange(100))
+            nick = u'user{0}'.format(day * 200 + rand.randrange(400))
+            client.last_message[channel][nick] = u'message from {0} on day {1}'.format(nick, day)
+
+        samples.append(deep_size(client.last_message))
+
+    return samples
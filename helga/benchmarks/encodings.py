@@ -0,0 +1,35 @@
+# -*- coding: utf8 -*-
+"""
+Benchmarks of string encoding helpers, which wrap most chat client methods
+"""
+from __future__ import absolute_import
+
+from helga.benchmarks import benchmark
+from helga.util.encodings import from_unicode, from_unicode_args, to_unicode, to_unicode_args
+
+
+MESSAGE = u'☃ the deploy is stuck again, see https://example.com/issues/123'
+
+
+@benchmark('to_unicode')
+def to_unicode_bytes():
+    message = MESSAGE.encode('utf-8')
+    return lambda: to_unicode(message)
+
+
+@benchmark('from_unicode')
+def from_unicode_unicode():
+    return lambda: from_unicode(MESSAGE)
+
+
+@benchmark('to_unicode_args')
+def to_unicode_args_bytes():
+    fn = to_unicode_args(lambda channel, nick, message: message)
+    message = MESSAGE.encode('utf-8')
+    return lambda: fn('#bots', 'alice', message)
+
+
+@benchmark('from_unicode_args')
+def from_unicode_args_unicode():
+    fn = from_unicode_args(lambda channel, message: message)
+    return lambda: fn(u'#bots', MESSAGE)
@@ -0,0 +1,36 @@
+"""
+Benchmarks of reading a page of a channel log, as the logger webhook does for every page view
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from helga import settings
+from helga.benchmarks import benchmark
+from helga.webhooks.logger import ChannelLog
+
+
+#: The number of messages in the benchmarked channel log
+LOG_SIZE = 20000
+
+
+@benchmark('channel_log_messages')
+def channel_log_messages():
+    log_dir = tempfile.mkdtemp()
+    channel_dir = os.path.join(log_dir, '#bots')
+    os.mkdir(channel_dir)
+
+    with open(os.path.join(channel_dir, '2016-01-01.txt'), 'w') as fp:
+        for i in xrange(LOG_SIZE):
+            fp.write('{0:02d}:{1:02d}:{2:02d} - user{3} - message number {4}\n'.format(
+                i // 3600 % 24, i // 60 % 60, i % 60, i % 20, i))
+
+    saved, settings.CHANNEL_LOGGING_DIR = settings.CHANNEL_LOGGING_DIR, log_dir
+    try:
+        # A page from the middle of the log. The log index is built once and then reused
+        yield lambda: ChannelLog('bots', '2016-01-01', offset=LOG_SIZE // 2, limit=500).messages()
+    finally:
+        settings.CHANNEL_LOGGING_DIR = saved
+        shutil.rmtree(log_dir)
@@ -0,0 +1,43 @@
+"""
+Benchmarks of plugin command parsing, matching and prioritization, which happen for every
+enabled plugin on every message
+"""
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from helga.benchmarks import benchmark
+from helga.plugins import Command, Match, registry
+
+
+@benchmark('command_parse')
+def command_parse():
+    plugin = Command('deploy', aliases=['ship', 'release'])
+    return lambda: plugin.parse('helga', u'helga deploy web-frontend to production')
+
+
+@benchmark('command_parse_miss')
+def command_parse_miss():
+    plugin = Command('deploy', aliases=['ship', 'release'])
+    return lambda: plugin.parse('helga', u'has anyone looked at the build yet?')
+
+
+@benchmark('match_match')
+def match_match():
+    plugin = Match(r'(\w+)\+\+')
+    return lambda: plugin.match(u'thanks for fixing the build, alice++')
+
+
+@benchmark('registry_prioritized')
+def registry_prioritized():
+    saved = registry.plugins, registry.enabled_plugins
+
+    # Fifty plugins of mixed priority, as on a busy channel
+    registry.plugins = dict(('plugin{0}'.format(i), Command('cmd{0}'.format(i), priority=i % 3 * 25))
+                            for i in xrange(50))
+    registry.enabled_plugins = defaultdict(lambda: frozenset(registry.plugins))
+
+    try:
+        yield lambda: registry.prioritized('#bots')
+    finally:
+        registry.plugins, registry.enabled_plugins = saved
@@ -0,0 +1,53 @@
+"""
+Benchmarks of webhook route dispatch, as the number of registered routes grows
+"""
+from __future__ import absolute_import
+
+from helga.benchmarks import benchmark
+from helga.plugins.webhooks import WebhookRoot
+
+
+class Request(object):
+    """
+    The parts of a request route dispatch uses. Twisted's request test helpers accumulate
+    headers on every render, so they would slow down with every call.
+    """
+    method = 'GET'
+
+    def __init__(self, path):
+        self.path = path
+
+    def setHeader(self, name, value):
+        pass
+
+    def setResponseCode(self, code):
+        pass
+
+
+def dispatch(routes):
+    """
+    Returns a callable rendering a request for the last of a number of registered routes
+
+    :param routes: the number of routes to register
+    """
+    root = WebhookRoot()
+    for i in xrange(routes):
+        root.add_route(lambda request, client, id: id, r'/service{0}/(?P<id>\d+)/?$'.format(i), ['GET'])
+
+    request = Request('/service{0}/42'.format(routes - 1))
+    return lambda: root.render(request)
+
+
+@benchmark('render_10_routes')
+def render_10_routes():
+    return dispatch(10)
+
+
+@benchmark('render_100_routes')
+def render_100_routes():
+    return dispatch(100)
+
+
+@benchmark('render_1000_routes')
+def render_1000_routes():
+    return dispatch(1000)
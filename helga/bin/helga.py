@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import argparse
 import os
+import sys
 
 import smokesignal
 
@@ -24,6 +25,21 @@ def run():
     backend = _get_backend(settings.SERVER.get('TYPE', 'irc'))
     smokesignal.emit('started')
 
+    num_workers = getattr(settings, 'WORKER_PROCESSES', 0)
+    if num_workers:
+        from helga import workers
+        workers.start(num_workers)
+
+    # Measure how long anything blocks the reactor, see the metrics webhook. This is imported
+    # here since its logger must not be created before settings are configured
+    from helga.lag import start_lag_monitor
+    start_lag_monitor(clock=reactor)
+
+    if settings.CHANNEL_LOGGING:
+        # Scan the channel log directory once, rather than whenever the logger web pages are viewed
+        from helga.log import get_channel_log_catalog
+        get_channel_log_catalog()
+
     factory = backend.Factory()
 
     if settings.SERVER.get('TYPE', False) == 'slack':
@@ -40,17 +56,76 @@ def run():
     reactor.run()
 
 
-def main():
-    """
-    Main entry point for the helga console script
-    """
-    parser = argparse.ArgumentParser(description='The helga IRC bot')
+def add_settings_argument(parser):
     parser.add_argument('--settings', help=(
         'Custom helga settings overrides. This should be an importable python module '
         'like "foo.bar.baz" or a path to a settings file like "path/to/settings.py". '
         'This can also be set via the HELGA_SETTINGS environment variable, however '
         'this flag takes precedence.'
     ))
+
+
+def bench_parser():
+    """
+    Returns the argument parser of the ``helga bench`` command (see :mod:`helga.bench`)
+    """
+    parser = argparse.ArgumentParser(prog='helga bench', description=(
+        'Replay chat traffic through the helga message dispatch pipeline and report throughput, '
+        'latency and allocations as JSON'
+    ))
+    add_settings_argument(parser)
+    parser.add_argument('logs', nargs='*', metavar='LOG', help=(
+        'Channel log files to replay, in a directory named for their channel. If none are given, '
+        'synthetic traffic is replayed.'
+    ))
+    parser.add_argument('--messages', type=int, default=10000,
+                        help='The number of synthetic messages to replay (default: 10000)')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed of synthetic traffic')
+    parser.add_argument('--plugins', help=(
+        'A comma separated list of plugins to enable on every channel. By default, plugins are '
+        'loaded and enabled as configured by settings.'
+    ))
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='The number of messages replayed before measuring (default: 100)')
+    parser.add_argument('--output', help='A file to save the JSON results to')
+    parser.add_argument('--compare', metavar='BASELINE', help=(
+        'A JSON results file of a previous run to compare with. The exit status is 1 if any '
+        'result is worse by more than the tolerance.'
+    ))
+    parser.add_argument('--tolerance', type=float, default=10,
+                        help='The percentage a result may be worse than the baseline (default: 10)')
+    parser.add_argument('--log-level', default='WARNING', help=(
+        'The log level during the run, overriding the LOG_LEVEL setting so that logging does not '
+        'dominate the results (default: WARNING)'
+    ))
+    return parser
+
+
+def run_bench(argv):
+    """
+    Run the ``helga bench`` command
+
+    :param argv: the command line arguments following 'bench'
+    """
+    args = bench_parser().parse_args(argv)
+    settings.configure(args.settings or os.environ.get('HELGA_SETTINGS', ''))
+    settings.LOG_LEVEL = args.log_level.upper()
+
+    # Plugins must not be imported before settings are configured
+    from helga import bench
+    sys.exit(bench.main(args))
+
+
+def main():
+    """
+    Main entry point for the helga console script. ``helga bench`` runs the dispatch pipeline
+    benchmark instead of the bot (see :mod:`helga.bench`).
+    """
+    if sys.argv[1:2] == ['bench']:
+        return run_bench(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description='The helga IRC bot')
+    add_settings_argument(parser)
     args = parser.parse_args()
 
     settings_file = os.environ.get('HELGA_SETTINGS', '')
@@ -59,4 +134,7 @@ def main():
         settings_file = args.settings
 
     settings.configure(settings_file)
+
+    # Worker processes load the same settings from the environment
+    os.environ['HELGA_SETTINGS'] = settings_file
     run()
@@ -0,0 +1,27 @@
+"""
+Entry point for plugin worker processes (see :mod:`helga.workers`). Worker processes
+are spawned by the main helga process and are not meant to be run directly.
+"""
+from __future__ import absolute_import
+
+import os
+
+from helga import settings
+
+
+def main():  # pragma: no cover
+    """
+    Configure settings from the ``HELGA_SETTINGS`` environment variable, which the main
+    helga process passes along, and run the worker
+    """
+    settings_file = os.environ.get('HELGA_SETTINGS', '')
+    if settings_file:
+        settings.configure(settings_file)
+
+    # Plugins must not be imported before settings are configured
+    from helga import workers
+    workers.run()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
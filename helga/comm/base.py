@@ -1,10 +1,41 @@
 """
 Base implementations for comm clients
 """
+import time
 
-from collections import defaultdict
+from collections import deque
+from itertools import islice
 
 from helga import settings
+from helga.util.lru import LRUDict
+
+
+class HistoryRecord(object):
+    """
+    A compact record of a single chat message kept in a client's channel history
+    (see :meth:`BaseClient.recent_messages`)
+
+    .. attribute:: time
+
+        The unix timestamp at which the message was seen
+
+    .. attribute:: nick
+
+        The nick of the user that sent the message
+
+    .. attribute:: message
+
+        The message contents
+    """
+    __slots__ = ('time', 'nick', 'message')
+
+    def __init__(self, time, nick, message):
+        self.time = time
+        self.nick = nick
+        self.message = message
+
+    def __repr__(self):
+        return '<HistoryRecord {0} {1}: {2!r}>'.format(self.time, self.nick, self.message)
 
 
 class BaseClient(object):
@@ -23,7 +54,7 @@ class BaseClient(object):
         A set containing all of the configured operators (setting :data:`~helga.settings.OPERATORS`)
 
     .. attribute:: last_message
-        :annotation: = dict()
+        :annotation: = LRUDict()
 
         A channel keyed dictionary containing dictionaries of nick -> message of the last messages
         the bot has seen a user send on a given channel. For instance, if in the channel ``#foo``::
@@ -34,10 +65,30 @@ class BaseClient(object):
 
             self.last_message['#foo']['sduncan'] = 'test'
 
+        Both dictionaries are a :class:`helga.util.lru.LRUDict`, so only the most recently active
+        channels and nicks are kept (see settings :data:`~helga.settings.LAST_MESSAGE_MAX_CHANNELS`,
+        :data:`~helga.settings.LAST_MESSAGE_MAX_NICKS` and :data:`~helga.settings.LAST_MESSAGE_TTL`)
+
+    .. attribute:: history
+        :annotation: = LRUDict()
+
+        A channel keyed dictionary of fixed size ring buffers holding a :class:`HistoryRecord`
+        for each of the most recent messages on a channel, including those sent by the bot in
+        response. The size of each buffer is configured with the setting
+        :data:`~helga.settings.CHANNEL_HISTORY_SIZE`. Plugins should generally use
+        :meth:`recent_messages` rather than access this directly.
+
     .. attribute:: channel_loggers
         :annotation: = dict()
 
         A dictionary of known channel loggers, keyed off the channel name
+
+    .. attribute:: workers
+        :annotation: = None
+
+        A :class:`helga.workers.WorkerPool` to which incoming messages are dispatched if helga
+        is configured to run plugins in worker processes (setting
+        :data:`~helga.settings.WORKER_PROCESSES`). None if plugins run in this process.
     """
 
     def __init__(self):
@@ -46,7 +97,70 @@ class BaseClient(object):
 
         # Things to keep track of
         self.channels = set()
-        self.last_message = defaultdict(dict)  # Dict of x[channel][nick]
+        self.last_message = LRUDict(maxlen=getattr(settings, 'LAST_MESSAGE_MAX_CHANNELS', None),
+                                    ttl=getattr(settings, 'LAST_MESSAGE_TTL', None),
+                                    default_factory=self._last_message_channel)  # Dict of x[channel][nick]
+        self.history = LRUDict(maxlen=getattr(settings, 'LAST_MESSAGE_MAX_CHANNELS', None),
+                               ttl=getattr(settings, 'LAST_MESSAGE_TTL', None),
+                               default_factory=self._history_channel)  # Dict of x[channel] -> deque
         self.channel_loggers = {}
 
+        # Set by a worker pool on signon, if configured
+        self.workers = None
+
+    def _last_message_channel(self):
+        """
+        Creates the bounded nick -> message dictionary of :attr:`last_message` for a channel
+        """
+        return LRUDict(maxlen=getattr(settings, 'LAST_MESSAGE_MAX_NICKS', None),
+                       ttl=getattr(settings, 'LAST_MESSAGE_TTL', None))
+
+    def _history_channel(self):
+        """
+        Creates the fixed size ring buffer of :attr:`history` for a channel
+        """
+        return deque(maxlen=getattr(settings, 'CHANNEL_HISTORY_SIZE', 100))
+
+    def record_message(self, channel, nick, message):
+        """
+        Records a message in the channel history. Nothing is recorded if the setting
+        :data:`~helga.settings.CHANNEL_HISTORY_SIZE` is zero or None.
+
+        :param channel: the channel on which the message was sent
+        :param nick: the nick of the user sending the message
+        :param message: the message contents
+        """
+        if not getattr(settings, 'CHANNEL_HISTORY_SIZE', 100):
+            return
+        self.history[channel].append(HistoryRecord(time.time(), nick, message))
+
+    def is_public_channel(self, channel):
+        """
+        Checks if a given channel is public or not. A channel is public if it starts with '#',
+        otherwise it is a private conversation, such as a direct message on Slack
+
+        :param channel: the channel name to check
+        """
+        return channel.startswith('#')
+
+    def recent_messages(self, channel, nick=None, limit=None):
+        """
+        Gets the most recent messages seen on a channel, newest first. For example, to find
+        the last thing a user said on a channel::
+
+            for record in client.recent_messages('#foo', nick='sduncan', limit=1):
+                print record.message
+
+        :param channel: the channel name
+        :param nick: optionally, only messages sent by this nick are returned
+        :param limit: optionally, the maximum number of messages to return
+        :returns: a list of :class:`HistoryRecord`, newest first
+        """
+        records = reversed(self.history.get(channel) or ())
+
+        if nick is not None:
+            records = (record for record in records if record.nick == nick)
+
+        return list(islice(records, limit))
+
     # TODO: fill in the base methods so we can do appropriate tracking
@@ -8,7 +8,7 @@ import smokesignal
 from twisted.internet import protocol, reactor
 from twisted.words.protocols import irc
 
-from helga import settings, log
+from helga import log, metrics, settings
 from helga.comm.base import BaseClient
 from helga.plugins import registry
 from helga.util import encodings
@@ -48,6 +48,7 @@ class Factory(protocol.ClientFactory):
         # FIXME: Max retries
         if getattr(settings, 'AUTO_RECONNECT', True):
             delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+            metrics.reconnects.inc(backend='irc')
             reactor.callLater(delay, connector.connect)
         else:
             raise reason
@@ -63,6 +64,7 @@ class Factory(protocol.ClientFactory):
         # FIXME: Max retries
         if getattr(settings, 'AUTO_RECONNECT', True):
             delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+            metrics.reconnects.inc(backend='irc')
             reactor.callLater(delay, connector.connect)
         else:
             reactor.stop()
@@ -111,6 +113,9 @@ class Client(irc.IRCClient, BaseClient):
         self.lineRate = getattr(settings, 'RATE_LIMIT', None)
         self._use_sasl = settings.SERVER.get('SASL', False)
 
+        # Messages are queued by twisted when rate limited (setting RATE_LIMIT)
+        metrics.outbound_queue_length.set_function(lambda: len(self._queue or ()), backend='irc')
+
     def get_channel_logger(self, channel):
         """
         Gets a channel logger, keeping track of previously requested ones.
@@ -248,6 +253,15 @@ class Client(irc.IRCClient, BaseClient):
         else:
             channel = user
 
+        metrics.messages_received.inc(backend='irc', channel=metrics.channel_label(channel, is_public))
+
+        # Plugins run in worker processes, responses are handled when they arrive
+        if self.workers is not None:
+            d = self.workers.dispatch(channel, user, message, self.nickname)
+            d.addCallback(lambda result: self.respond(is_public, *result))
+            d.addErrback(lambda failure: logger.error('Worker dispatch failed: %s', failure))
+            return
+
         # Some things should go first
         try:
             channel, user, message = registry.preprocess(self, channel, user, message)
@@ -256,16 +270,35 @@ class Client(irc.IRCClient, BaseClient):
 
         # if not message.has_response:
         responses = registry.process(self, channel, user, message)
+        self.respond(is_public, channel, user, message, responses)
+
+    def respond(self, is_public, channel, user, message, responses):
+        """
+        Sends any plugin responses for a processed message back over IRC, logging them if
+        the message occurred on a public channel, and tracks the last message of the user. The
+        message is recorded in the channel history here, after plugins have processed it, so the
+        history plugins see does not yet include the message they are processing.
+
+        :param is_public: True if the message occurred on a public channel
+        :param channel: the channel from which the message came, after preprocessing
+        :param user: the nick of the user sending the message, after preprocessing
+        :param message: the message contents, after preprocessing, or None if it was suppressed
+        :param responses: a list of plugin response strings
+        """
+        if message is not None:
+            self.record_message(channel, user, message)
 
         if responses:
             message = u'\n'.join(responses)
             self.msg(channel, message)
+            self.record_message(channel, self.nickname, message)
 
             if is_public:
                 self.log_channel_message(channel, self.nickname, message)
 
         # Update last message
-        self.last_message[channel][user] = message
+        if message is not None:
+            self.last_message[channel][user] = message
 
     """
     Handle IRC "/me" messages the same as regular IRC messages.
@@ -304,6 +337,8 @@ class Client(irc.IRCClient, BaseClient):
         :param message: The message to send
         """
         logger.debug('[-->] %s - %s', channel, message)
+        metrics.messages_sent.inc(backend='irc',
+                                  channel=metrics.channel_label(channel, self.is_public_channel(channel)))
         irc.IRCClient.msg(self, channel, message)
 
     def on_invite(self, inviter, invitee, channel):
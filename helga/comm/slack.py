@@ -25,7 +25,7 @@ from twisted.internet import reactor, task
 from autobahn.twisted.websocket import WebSocketClientFactory
 from autobahn.twisted.websocket import WebSocketClientProtocol
 
-from helga import settings, log
+from helga import log, metrics, settings
 from helga.comm.base import BaseClient
 from helga.plugins import registry
 
@@ -83,6 +83,7 @@ class Factory(WebSocketClientFactory):
         # FIXME: Max retries
         if getattr(settings, 'AUTO_RECONNECT', True):
             delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+            metrics.reconnects.inc(backend='slack')
             reactor.callLater(delay, connector.connect)
         else:
             raise reason
@@ -248,6 +249,14 @@ class Client(WebSocketClientProtocol, BaseClient):
 
         # Log the incoming message
         # logger.debug('[<--] %s/%s - %s', channel, user, message)
+        metrics.messages_received.inc(backend='slack', channel=metrics.channel_label(channel, bool(channel)))
+
+        # Plugins run in worker processes, responses are handled when they arrive
+        if self.workers is not None:
+            d = self.workers.dispatch(channel, user, message, self.nickname)
+            d.addCallback(lambda result: self.respond(*result))
+            d.addErrback(lambda failure: logger.error('Worker dispatch failed: %s', failure))
+            return
 
         # Some things should go first
         try:
@@ -255,13 +264,29 @@ class Client(WebSocketClientProtocol, BaseClient):
         except (TypeError, ValueError):
             pass
 
-        # Update last message
-        self.last_message[channel][user] = message
-
         responses = registry.process(self, channel, user, message)
+        return self.respond(channel, user, message, responses)
+
+    def respond(self, channel, user, message, responses):
+        """
+        Sends any plugin responses for a processed message back over Slack, and tracks
+        the last message of the user. The message is recorded in the channel history here,
+        after plugins have processed it, so the history plugins see does not yet include the
+        message they are processing.
+
+        :param channel: the channel from which the message came, after preprocessing
+        :param user: the nick of the user sending the message, after preprocessing
+        :param message: the message contents, after preprocessing, or None if it was suppressed
+        :param responses: a list of plugin response strings
+        """
+        if message is not None:
+            self.last_message[channel][user] = message
+            self.record_message(channel, user, message)
 
         if responses:
-            return self.msg(channel, u'\n'.join(responses))
+            message = u'\n'.join(responses)
+            self.record_message(channel, self.nickname, message)
+            return self.msg(channel, message)
 
     def me(self, channel, message):
         """
@@ -292,6 +317,8 @@ class Client(WebSocketClientProtocol, BaseClient):
         message = self._sanitize(message)
 
         logger.debug('[-->] %s - %s', channel, message)
+        metrics.messages_sent.inc(backend='slack',
+                                  channel=metrics.channel_label(channel, channel.startswith('#')))
 
         if channel.startswith('#'):
             return self._send_message(channel, message)
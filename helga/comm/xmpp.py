@@ -10,7 +10,7 @@ from twisted.words.protocols.jabber import client, jid, xmlstream
 
 import smokesignal
 
-from helga import log, settings
+from helga import log, metrics, settings
 from helga.comm.base import BaseClient
 from helga.plugins import registry
 from helga.util import encodings
@@ -72,6 +72,7 @@ class Factory(XmlStreamFactoryMixin, protocol.ClientFactory):
         # FIXME: Max retries
         if getattr(settings, 'AUTO_RECONNECT', True):
             delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+            metrics.reconnects.inc(backend='xmpp')
             reactor.callLater(delay, connector.connect)
         else:
             raise reason
@@ -91,6 +92,7 @@ class Factory(XmlStreamFactoryMixin, protocol.ClientFactory):
         # FIXME: Max retries
         if getattr(settings, 'AUTO_RECONNECT', True):
             delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+            metrics.reconnects.inc(backend='xmpp')
             reactor.callLater(delay, connector.connect)
         else:
             reactor.stop()
@@ -450,6 +452,15 @@ class Client(BaseClient):
         else:
             channel = nick
 
+        metrics.messages_received.inc(backend='xmpp', channel=metrics.channel_label(channel, is_public))
+
+        # Plugins run in worker processes, responses are handled when they arrive
+        if self.workers is not None:
+            d = self.workers.dispatch(channel, nick, message, self.nickname)
+            d.addCallback(lambda result: self.respond(is_public, *result))
+            d.addErrback(lambda failure: logger.error('Worker dispatch failed: %s', failure))
+            return
+
         # Some things should go first
         try:
             channel, nick, message = registry.preprocess(self, channel, nick, message)
@@ -458,16 +469,35 @@ class Client(BaseClient):
 
         # if not message.has_response:
         responses = registry.process(self, channel, nick, message)
+        self.respond(is_public, channel, nick, message, responses)
+
+    def respond(self, is_public, channel, nick, message, responses):
+        """
+        Sends any plugin responses for a processed message back over XMPP, logging them if
+        the message occurred on a public channel, and tracks the last message of the user. The
+        message is recorded in the channel history here, after plugins have processed it, so the
+        history plugins see does not yet include the message they are processing.
+
+        :param is_public: True if the message occurred on a public channel
+        :param channel: the channel from which the message came, after preprocessing
+        :param nick: the nick of the user sending the message, after preprocessing
+        :param message: the message contents, after preprocessing, or None if it was suppressed
+        :param responses: a list of plugin response strings
+        """
+        if message is not None:
+            self.record_message(channel, nick, message)
 
         if responses:
             message = u'\n'.join(responses)
             self.msg(channel, message)
+            self.record_message(channel, self.nickname, message)
 
             if is_public:
                 self.log_channel_message(channel, self.nickname, message)
 
         # Update last message
-        self.last_message[channel][nick] = message
+        if message is not None:
+            self.last_message[channel][nick] = message
 
     @encodings.from_unicode_args
     def msg(self, channel, message):
@@ -481,6 +511,7 @@ class Client(BaseClient):
         """
         logger.debug('[-->] %s - %s', channel, message)
         is_public = self.is_public_channel(channel)
+        metrics.messages_sent.inc(backend='xmpp', channel=metrics.channel_label(channel, is_public))
 
         if is_public:
             resp_host = self.conference_host
@@ -15,10 +15,27 @@
 import warnings
 
 
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from pymongo.errors import ConnectionFailure
 
-from helga import settings
+from helga import metrics, settings
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    A pymongo command listener recording the duration of every MongoDB command, and any
+    failures, in :mod:`helga.metrics`
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.db_command_seconds.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        metrics.db_command_seconds.observe(event.duration_micros / 1e6, command=event.command_name)
+        metrics.db_command_failures.inc(command=event.command_name)
 
 
 def connect():
@@ -32,7 +49,8 @@ def connect():
     db_settings = getattr(settings, 'DATABASE', {})
 
     try:
-        client = MongoClient(db_settings['HOST'], db_settings['PORT'])
+        client = MongoClient(db_settings['HOST'], db_settings['PORT'],
+                             event_listeners=[CommandMetricsListener()])
     except ConnectionFailure:
         warnings.warn('MongoDB is not available. Some features may not work')
         return None, None
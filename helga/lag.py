@@ -0,0 +1,213 @@
+"""
+Monitoring of reactor event loop lag, to find code that blocks the reactor thread. Enabled
+when helga starts, and reported by the operator command ``helga operator lag``
+(see :ref:`builtin.plugins.operator`)
+"""
+import collections
+import sys
+import thread
+import threading
+import time
+import traceback
+
+from helga import log, metrics, settings
+
+
+logger = log.getLogger(__name__)
+
+#: The number of seconds between lag samples
+SAMPLE_INTERVAL = 1.0
+
+#: The number of recent lag samples kept for :meth:`LagMonitor.summary`
+WINDOW_SIZE = 300
+
+#: The number of recent stalls kept
+STALL_HISTORY_SIZE = 10
+
+#: A time the reactor was blocked for at least :data:`~helga.settings.REACTOR_LAG_THRESHOLD`
+#: seconds, and the stack of the reactor thread while it was blocked, or None if not captured
+Stall = collections.namedtuple('Stall', 'time lag stack')
+
+_lag_monitor = None
+
+
+def get_lag_monitor():
+    """
+    Returns the running :class:`LagMonitor`, or None if it has not been started
+    """
+    return _lag_monitor
+
+
+def start_lag_monitor(clock=None):
+    """
+    Starts the shared :class:`LagMonitor`, configured by :data:`~helga.settings.REACTOR_LAG_THRESHOLD`
+    and :data:`~helga.settings.REACTOR_LAG_STACKS`. This should be called from the reactor thread.
+
+    :param clock: the reactor to schedule samples with
+    """
+    global _lag_monitor
+
+    if _lag_monitor is None:
+        _lag_monitor = LagMonitor(threshold=getattr(settings, 'REACTOR_LAG_THRESHOLD', 0.5),
+                                  capture_stacks=getattr(settings, 'REACTOR_LAG_STACKS', False),
+                                  clock=clock)
+        _lag_monitor.start()
+        _lag_monitor.loop.clock.addSystemEventTrigger('before', 'shutdown', _lag_monitor.stop)
+
+    return _lag_monitor
+
+
+def format_stack(stack, limit=3):
+    """
+    Returns a one line summary of the innermost frames of a stack, innermost first,
+    i.e. ``helga/plugins/foo.py:12 in bar < helga/plugins/__init__.py:330 in process``
+
+    :param stack: a stack as returned by ``traceback.extract_stack``
+    :param limit: the number of frames to include
+    """
+    return u' < '.join(u'{0}:{1} in {2}'.format(filename, lineno, name)
+                       for filename, lineno, name, _ in reversed(stack[-limit:]))
+
+
+class LagMonitor(metrics.ReactorLagSampler):
+    """
+    A :class:`~helga.metrics.ReactorLagSampler` that also keeps a rolling window of recent lag
+    samples, and logs a warning for every stall: a sample at least ``threshold`` seconds late.
+
+    Since a late sample only runs once whatever blocked the reactor has finished, it cannot
+    tell what that was. If ``capture_stacks`` is True, a watchdog thread checks that samples
+    run on time, and if one is ``threshold`` seconds overdue it captures the stack of the
+    reactor thread, which is then still inside the blocking code.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, threshold=0.5, capture_stacks=False, clock=None):
+        """
+        :param interval: the number of seconds between samples
+        :param threshold: the lag in seconds at which a sample counts as a stall
+        :param capture_stacks: True to capture the reactor thread stack during stalls
+        :param clock: the reactor to schedule samples with, for testing
+        """
+        super(LagMonitor, self).__init__(interval=interval, clock=clock)
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+
+        #: Recent lag samples, oldest first
+        self.window = collections.deque(maxlen=WINDOW_SIZE)
+
+        #: Recent :data:`Stall` records, oldest first
+        self.stalls = collections.deque(maxlen=STALL_HISTORY_SIZE)
+
+        self.watchdog = None
+        self.stopped = threading.Event()
+        self.reactor_thread = None
+        self.heartbeat = None
+        self.stack = None
+
+    def start(self):
+        """
+        Start sampling, and the watchdog thread if capturing stacks
+        """
+        self.reactor_thread = thread.get_ident()
+        self.heartbeat = time.time()
+        self.stopped.clear()
+        super(LagMonitor, self).start()
+
+        if self.capture_stacks:
+            self.watchdog = threading.Thread(target=self.watch, name='helga-lag-watchdog')
+            self.watchdog.daemon = True
+            self.watchdog.start()
+
+    def stop(self):
+        """
+        Stop sampling and the watchdog thread
+        """
+        super(LagMonitor, self).stop()
+        self.stopped.set()
+
+    def watch(self):
+        """
+        The watchdog thread loop, checking several times an interval whether a sample is overdue
+        """
+        while not self.stopped.wait(self.interval / 4.0):
+            self.check(time.time())
+
+    def check(self, now):
+        """
+        Capture the stack of the reactor thread if a sample is at least ``threshold`` seconds
+        overdue, once per stall
+
+        :param now: the current unix time
+        """
+        if self.stack is not None or now - self.heartbeat - self.interval < self.threshold:
+            return
+
+        frame = sys._current_frames().get(self.reactor_thread)
+        if frame is not None:
+            self.stack = traceback.extract_stack(frame)
+
+    def record(self, lag):
+        """
+        Record a measured lag, logging a warning if it is a stall
+
+        :param lag: the number of seconds a sample ran late
+        """
+        super(LagMonitor, self).record(lag)
+
+        self.heartbeat = time.time()
+        self.window.append(lag)
+        stack, self.stack = self.stack, None
+
+        if lag < self.threshold:
+            return
+
+        self.stalls.append(Stall(self.heartbeat, lag, stack))
+        if stack is None:
+            logger.warning('Reactor blocked for %.3f seconds', lag)
+        else:
+            logger.warning('Reactor blocked for %.3f seconds in:\n%s', lag,
+                           ''.join(traceback.format_list(stack)))
+
+    def percentile(self, percent):
+        """
+        Returns a percentile of the lag samples in the rolling window, or None if there are none
+
+        :param percent: the percentile, from 0 to 100
+        """
+        samples = sorted(self.window)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100.0))]
+
+    def histogram(self, buckets=metrics.DEFAULT_BUCKETS):
+        """
+        Returns a list of two-tuples of bucket upper bound and the number of lag samples in
+        the rolling window at or below it, ending with an upper bound of infinity
+
+        :param buckets: an increasing sequence of bucket upper bounds
+        """
+        samples = list(self.window)
+        return [(bound, sum(1 for lag in samples if lag <= bound))
+                for bound in tuple(buckets) + (float('inf'),)]
+
+    def summary(self):
+        """
+        Returns a one line summary of the rolling window and the most recent stall
+        """
+        if not self.window:
+            return u'No reactor lag samples yet'
+
+        text = u'Reactor lag over the last {0} seconds: p50 {1:.0f}ms, p99 {2:.0f}ms, max {3:.0f}ms'.format(
+            int(len(self.window) * self.interval),
+            self.percentile(50) * 1000,
+            self.percentile(99) * 1000,
+            max(self.window) * 1000,
+        )
+
+        if self.stalls:
+            stall = self.stalls[-1]
+            text += u'. Last stall of {0:.2f}s at {1} UTC'.format(
+                stall.lag, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(stall.time)))
+            if stall.stack:
+                text += u' in {0}'.format(format_stack(stall.stack))
+
+        return text
@@ -1,13 +1,46 @@
 """
 Logging utilities for helga
 """
+import bisect
+import calendar
+import collections
 import datetime
+import gzip
 import logging
 import logging.handlers
 import os
+import Queue
+import re
+import struct
 import sys
+import threading
+import time
+import zlib
 
-from helga import settings
+from twisted.internet import reactor
+
+from helga import metrics, settings
+from helga.util.encodings import from_unicode, to_unicode
+
+
+#: Channel log lines that start a new logged message, ``HH:MM:SS - nick - message``.
+#: Any other line is a continuation of the previous message
+LINE_PAT = re.compile(r'^(\d{2}:?){3} - \w+ - .*$')
+
+#: The header of each record of a binary channel log: the unix time the message was logged,
+#: and the byte lengths of the UTF-8 encoded nick and message that follow it
+BINARY_RECORD = struct.Struct('!dHI')
+
+#: The format of each entry of a binary channel log's offset index: the byte offset of a record
+BINARY_INDEX_ENTRY = struct.Struct('!Q')
+
+#: The approximate number of uncompressed bytes of each independently compressed gzip member
+#: of a compressed channel log. A page of a compressed log is read by decompressing from the
+#: start of the member containing it, rather than from the start of the file
+GZIP_MEMBER_SIZE = 64 * 1024
+
+#: A record read from a binary channel log
+BinaryRecord = collections.namedtuple('BinaryRecord', 'offset size created nick message')
 
 
 def getLogger(name):
@@ -59,44 +92,544 @@ def get_channel_logger(channel):
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
-    # Setup a daily rotating file handler
-    handler = ChannelLogFileHandler(log_dir)
+    # Setup a daily rotating file handler, writing from a background thread if configured
+    writer = None
+    if getattr(settings, 'CHANNEL_LOGGING_BACKGROUND', False):
+        writer = get_channel_log_writer()
+
+    search_index = None
+    if getattr(settings, 'CHANNEL_LOGGING_SEARCH', False):
+        from helga.search import get_search_index
+        search_index = get_search_index()
+
+    # Compress any logs of past days left uncompressed by a previous run. Only the text format
+    # is compressed, the binary format is meant for random access
+    binary = getattr(settings, 'CHANNEL_LOGGING_FORMAT', 'text') == 'binary'
+    compress = getattr(settings, 'CHANNEL_LOGGING_COMPRESS', False) and not binary
+    if compress:
+        reactor.callInThread(compress_channel_logs, log_dir)
+
+    handler_class = BinaryChannelLogFileHandler if binary else ChannelLogFileHandler
+    handler = handler_class(log_dir,
+                            buffer_size=getattr(settings, 'CHANNEL_LOGGING_BUFFER_SIZE', 1),
+                            flush_interval=getattr(settings, 'CHANNEL_LOGGING_FLUSH_INTERVAL', 0),
+                            writer=writer,
+                            search_index=search_index,
+                            compress=compress,
+                            catalog=get_channel_log_catalog())
     handler.setFormatter(logging.Formatter(u'%(utctime)s - %(nick)s - %(message)s'))
     logger.addHandler(handler)
 
     return logger
 
 
+def channel_log_date(filename):
+    """
+    Returns the ``YYYY-MM-DD`` UTC date of a channel log filename, which may be compressed
+    or binary, or None if the filename is not that of a channel log
+
+    :param filename: a channel log filename, i.e. ``2014-12-01.txt``, ``2014-12-01.txt.gz``
+                     or ``2014-12-01.log``
+    """
+    match = re.match(r'^(\d{4}-\d{2}-\d{2})\.(txt(\.gz)?|log)$', filename)
+    return match.group(1) if match else None
+
+
+def find_channel_log(log_dir, date):
+    """
+    Returns the path of the log file of a channel for a UTC date, either plain text,
+    compressed or binary, or None if there is no log for that date
+
+    :param log_dir: the directory of a channel's log files
+    :param date: the ``YYYY-MM-DD`` UTC date of the log
+    """
+    for ext in ('.txt', '.txt.gz', '.log'):
+        path = os.path.join(log_dir, date + ext)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def open_channel_log(path):
+    """
+    Opens a channel log file for reading in binary mode, transparently decompressing
+    compressed log files
+
+    :param path: the path of a channel log file
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_gzip_members(fp, size=GZIP_MEMBER_SIZE):
+    """
+    Generator of (member, data) tuples of the decompressed contents of a gzip file, starting from
+    the current position of an open file, which must be the start of a gzip member. ``member`` is
+    the file offset of the gzip member that ``data`` was decompressed from, so reading can later
+    start again from that member.
+
+    :param fp: a gzip file opened for reading in binary mode
+    :param size: the number of compressed bytes to read at a time
+    """
+    member = position = fp.tell()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    while True:
+        block = fp.read(size)
+        if not block:
+            return
+        position += len(block)
+
+        while block:
+            data = decompressor.decompress(block)
+            if data:
+                yield member, data
+
+            # Anything following the end of a member is the start of the next one, or padding
+            block = decompressor.unused_data
+            if block:
+                if not block.strip('\x00'):
+                    return
+                member = position - len(block)
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def encode_record(created, nick, message):
+    """
+    Encodes a message as a binary channel log record
+
+    :param created: the unix time the message was logged
+    :param nick: the nick of the user that sent the message
+    :param message: the message contents
+    """
+    nick = from_unicode(nick)
+    message = from_unicode(message)
+    return BINARY_RECORD.pack(created, len(nick), len(message)) + nick + message
+
+
+def read_records(fp):
+    """
+    Generator of :data:`BinaryRecord` tuples of each complete record of a binary channel log,
+    starting from the current position of an open file. A partial record at the end of the
+    file, which may still be being written, is ignored.
+
+    :param fp: a binary channel log file opened for reading in binary mode
+    """
+    offset = fp.tell()
+
+    while True:
+        header = fp.read(BINARY_RECORD.size)
+        if len(header) < BINARY_RECORD.size:
+            return
+
+        created, nick_size, message_size = BINARY_RECORD.unpack(header)
+        body = fp.read(nick_size + message_size)
+        if len(body) < nick_size + message_size:
+            return
+
+        size = BINARY_RECORD.size + len(body)
+        yield BinaryRecord(offset, size, created,
+                           to_unicode(body[:nick_size]), to_unicode(body[nick_size:]))
+        offset += size
+
+
+def record_time(created):
+    """
+    Returns the ``HH:MM:SS`` UTC time of day of a unix time, as shown in channel logs
+
+    :param created: a unix time
+    """
+    return datetime.datetime.utcfromtimestamp(int(created)).strftime('%H:%M:%S')
+
+
+def record_message(record):
+    """
+    Returns a binary channel log record as a dictionary of the message time,
+    nick and contents, like those of :func:`parse_messages`
+
+    :param record: a :data:`BinaryRecord`
+    """
+    return {
+        'time': record_time(record.created),
+        'nick': record.nick,
+        'message': record.message,
+    }
+
+
+def export_binary_channel_log(path):
+    """
+    Generator of the lines of a binary channel log in the plain text channel log format,
+    as UTF-8 byte strings
+
+    :param path: the path of a binary channel log file
+    """
+    with open(path, 'rb') as fp:
+        for record in read_records(fp):
+            message = record_message(record)
+            yield from_unicode(u'{time} - {nick} - {message}\n'.format(**message))
+
+
+def compress_channel_log(path):
+    """
+    Compresses a channel log file with gzip, replacing ``YYYY-MM-DD.txt`` with ``YYYY-MM-DD.txt.gz``.
+    The compressed file only replaces the original once it is completely written. Every
+    :data:`GZIP_MEMBER_SIZE` bytes of complete lines are compressed as a separate gzip member, see
+    :func:`read_gzip_members`.
+
+    :param path: the path of a plain text channel log file
+    """
+    tmp_path = path + '.gz.tmp'
+
+    with open(path, 'rb') as src:
+        with open(tmp_path, 'wb') as dst:
+            while True:
+                chunk = src.read(GZIP_MEMBER_SIZE)
+                if not chunk:
+                    break
+                if not chunk.endswith('\n'):
+                    chunk += src.readline()
+
+                member = gzip.GzipFile(filename='', mode='wb', fileobj=dst)
+                member.write(chunk)
+                member.close()
+
+    os.rename(tmp_path, path + '.gz')
+    os.remove(path)
+
+
+def compress_channel_logs(log_dir):
+    """
+    Compresses the plain text log files of a channel for every day before the current UTC day
+
+    :param log_dir: the directory of a channel's log files
+    """
+    today = datetime.datetime.utcnow().strftime('%Y-%m-%d')
+
+    for filename in sorted(os.listdir(log_dir)):
+        if not filename.endswith('.txt') or channel_log_date(filename) >= today:
+            continue
+
+        try:
+            compress_channel_log(os.path.join(log_dir, filename))
+        except Exception:
+            logging.getLogger(__name__).exception('Failed to compress channel log %s', filename)
+
+
+def parse_messages(lines):
+    """
+    Generator of channel logged messages as dictionaries of the message time, nick and contents.
+    Continuation lines are joined to the message they follow. Lines that precede any
+    timestamped line are yielded as a single message with an empty time and nick.
+
+    :param lines: an iterable of byte string or unicode channel log lines
+    """
+    current = None
+
+    for line in lines:
+        line = to_unicode(line).rstrip(u'\n')
+
+        if LINE_PAT.match(line):
+            if current is not None:
+                current['message'] = current['message'].rstrip(u'\n')
+                yield current
+
+            parts = line.strip().split(u' - ')
+            current = {
+                'time': parts.pop(0),
+                'nick': parts.pop(0),
+                'message': u' - '.join(parts),
+            }
+        elif current is None:
+            current = {'time': u'', 'nick': u'', 'message': line}
+        else:
+            current['message'] = u'\n'.join((current['message'], line))
+
+    if current is not None:
+        current['message'] = current['message'].rstrip(u'\n')
+        yield current
+
+
+_channel_log_catalogs = {}
+
+
+def get_channel_log_catalog():
+    """
+    Obtains the shared :class:`ChannelLogCatalog` of :data:`~helga.settings.CHANNEL_LOGGING_DIR`,
+    scanning the directory on first use
+    """
+    log_dir = settings.CHANNEL_LOGGING_DIR
+
+    if log_dir not in _channel_log_catalogs:
+        catalog = ChannelLogCatalog(log_dir)
+        catalog.load()
+        _channel_log_catalogs[log_dir] = catalog
+
+    return _channel_log_catalogs[log_dir]
+
+
+class ChannelLogCatalog(object):
+    """
+    An in-memory catalog of logged channels and the UTC dates each has a log file for, so that
+    listing them never touches the filesystem. The log directory is scanned once by :meth:`load`,
+    after which channel log handlers add each channel and date as they create its log file.
+    Log files created or removed by anything else are only seen after the next :meth:`load`.
+    This is safe to use from multiple threads.
+    """
+
+    def __init__(self, log_dir):
+        """
+        :param log_dir: the directory containing a directory of daily log files for each channel
+        """
+        self.log_dir = log_dir
+        self.lock = threading.Lock()
+
+        # Channel directory name -> ascending list of YYYY-MM-DD dates
+        self._dates = {}
+
+    def load(self):
+        """
+        Scan the log directory, replacing everything in the catalog
+        """
+        dates = {}
+
+        if os.path.isdir(self.log_dir):
+            for channel in os.listdir(self.log_dir):
+                channel_dir = os.path.join(self.log_dir, channel)
+                if not os.path.isdir(channel_dir):
+                    continue
+                dates[channel] = sorted(set(filter(None, map(channel_log_date, os.listdir(channel_dir)))))
+
+        with self.lock:
+            self._dates = dates
+
+    def add(self, channel, date):
+        """
+        Record that a channel has a log file for a date
+
+        :param channel: the channel directory name, i.e. '#bots'
+        :param date: the ``YYYY-MM-DD`` UTC date of the log file
+        """
+        with self.lock:
+            dates = self._dates.setdefault(channel, [])
+            pos = bisect.bisect_left(dates, date)
+            if pos == len(dates) or dates[pos] != date:
+                dates.insert(pos, date)
+
+    def channels(self):
+        """
+        Returns a sorted list of logged channel directory names
+        """
+        with self.lock:
+            return sorted(self._dates)
+
+    def dates(self, channel):
+        """
+        Returns the dates a channel has log files for, most recent first, or None if
+        the channel has never been logged
+
+        :param channel: the channel directory name, i.e. '#bots'
+        """
+        with self.lock:
+            dates = self._dates.get(channel)
+            return None if dates is None else dates[::-1]
+
+
+_channel_log_writer = None
+
+
+def get_channel_log_writer():
+    """
+    Obtains the shared :class:`ChannelLogWriter` used by all channel loggers, starting it
+    on first use. The writer is configured by :data:`~helga.settings.CHANNEL_LOGGING_QUEUE_SIZE`,
+    :data:`~helga.settings.CHANNEL_LOGGING_QUEUE_OVERFLOW` and
+    :data:`~helga.settings.CHANNEL_LOGGING_FLUSH_INTERVAL`, and is stopped, writing everything
+    still queued to disk, when the reactor shuts down.
+    """
+    global _channel_log_writer
+
+    if _channel_log_writer is None:
+        _channel_log_writer = ChannelLogWriter(
+            maxsize=getattr(settings, 'CHANNEL_LOGGING_QUEUE_SIZE', 0),
+            overflow=getattr(settings, 'CHANNEL_LOGGING_QUEUE_OVERFLOW', 'block'),
+            flush_interval=getattr(settings, 'CHANNEL_LOGGING_FLUSH_INTERVAL', 0),
+        )
+        _channel_log_writer.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', _channel_log_writer.stop)
+
+    return _channel_log_writer
+
+
+class ChannelLogWriter(threading.Thread):
+    """
+    A daemon thread that writes channel log lines to disk so that a slow log directory
+    never stalls the reactor. Channel log handlers format records and put them on a bounded
+    queue. When the queue is full, lines are either dropped or the caller blocks until there
+    is room, depending on the ``overflow`` policy. Buffered lines of every handler are written
+    to disk at least every ``flush_interval`` seconds.
+    """
+
+    #: Queued to tell the writer thread to stop
+    STOP = object()
+
+    def __init__(self, maxsize=0, overflow='block', flush_interval=0):
+        """
+        :param maxsize: the maximum number of queued log lines, or 0 for no limit
+        :param overflow: either 'block' or 'drop', what to do when the queue is full
+        :param flush_interval: the maximum number of seconds a line is buffered before being written
+        """
+        if overflow not in ('block', 'drop'):
+            raise ValueError('Unknown channel log queue overflow policy: {0}'.format(overflow))
+
+        super(ChannelLogWriter, self).__init__(name='channel-log-writer')
+        self.daemon = True
+        self.queue = Queue.Queue(maxsize)
+        self.overflow = overflow
+        self.flush_interval = flush_interval
+
+        #: The number of log lines dropped because the queue was full
+        self.dropped = 0
+
+        # Handlers that have buffered lines not yet written to disk
+        self.pending = set()
+
+    def put(self, handler, created, line):
+        """
+        Queue a formatted log line to be written by a handler
+
+        :param handler: the :class:`ChannelLogFileHandler` that should write the line
+        :param created: the unix timestamp of the log record
+        :param line: the formatted log line
+        """
+        try:
+            self.queue.put((handler, created, line), block=(self.overflow == 'block'))
+        except Queue.Full:
+            self.dropped += 1
+            metrics.channel_log_lines_dropped.inc()
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logging.getLogger(__name__).warning(
+                    'Channel log queue is full, %d lines dropped so far', self.dropped)
+
+    def run(self):
+        last_flush = time.time()
+
+        while True:
+            timeout = None
+            if self.pending:
+                timeout = max(0, last_flush + self.flush_interval - time.time())
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                item = None
+
+            if item is self.STOP:
+                self.flush()
+                return
+
+            if item is not None:
+                handler, created, line = item
+                try:
+                    handler.write(line, created)
+                except Exception:
+                    logging.getLogger(__name__).exception('Failed to write channel log line')
+                self.pending.add(handler)
+
+            if self.pending and time.time() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.time()
+
+    def flush(self):
+        """
+        Write the buffered lines of every handler to disk. This should only be called
+        from the writer thread, or once it has stopped.
+        """
+        while self.pending:
+            handler = self.pending.pop()
+            try:
+                handler.flush()
+            except Exception:
+                logging.getLogger(__name__).exception('Failed to flush channel log')
+
+    def stop(self, timeout=None):
+        """
+        Stop the writer thread once everything already queued has been written to disk
+
+        :param timeout: the maximum number of seconds to wait for the thread to finish
+        """
+        if self.is_alive():
+            self.queue.put(self.STOP)
+            self.join(timeout)
+
+
 class UTCTimeLogFilter(logging.Filter):
     """
     A log record filter that will add an attribute ``utcnow`` and ``utctime``
     to a log record. The former is a utcnow datetime object, the latter is
-    the formatted time of day for utcnow.
+    the formatted time of day for utcnow. Both are computed at most once per
+    second, since channel log lines are only stamped to the second.
     """
 
+    def __init__(self, *args, **kwargs):
+        logging.Filter.__init__(self, *args, **kwargs)
+        self._second = None
+        self._utcnow = None
+        self._utctime = None
+
     def filter(self, record):
         """
         Filter the log record and add two attributes:
 
-        * ``utcnow``: the value of `datetime.datetime.utcnow`
+        * ``utcnow``: the value of `datetime.datetime.utcnow`, truncated to the second
         * ``utctime``: the time formatted string of ``utcnow`` in the form ``HH:MM:SS``
         """
-        record.utcnow = datetime.datetime.utcnow()
-        record.utctime = record.utcnow.strftime('%H:%M:%S')
+        second = int(time.time())
+
+        if second != self._second:
+            self._second = second
+            self._utcnow = datetime.datetime.utcfromtimestamp(second)
+            self._utctime = self._utcnow.strftime('%H:%M:%S')
+
+        record.utcnow = self._utcnow
+        record.utctime = self._utctime
         return True
 
 
 class ChannelLogFileHandler(logging.handlers.BaseRotatingHandler):
     """
     A rotating file handler implementation that will create UTC dated log files
-    suitable for channel logging.
+    suitable for channel logging. Formatted records are buffered in memory and
+    written in batches, either once ``buffer_size`` records are buffered or
+    ``flush_interval`` seconds after the first buffered record, whichever comes first.
+    If a :class:`ChannelLogWriter` is given, buffering and writing happen on the
+    writer's thread rather than the thread that logged the record. If a
+    :class:`~helga.search.SearchIndex` is given, it is updated after each write.
+    If ``compress`` is True, log files are compressed in a reactor thread once they
+    have been rotated. If a :class:`ChannelLogCatalog` is given, each new log file is
+    added to it.
     """
 
-    def __init__(self, basedir):
+    def __init__(self, basedir, buffer_size=1, flush_interval=0, writer=None, search_index=None,
+                 compress=False, catalog=None):
         """
         :param basedir: The base directory where logs should be stored
+        :param buffer_size: The number of records to buffer before writing them to disk
+        :param flush_interval: The maximum number of seconds a record may be buffered
+        :param writer: An optional :class:`ChannelLogWriter` to write records in the background
+        :param search_index: An optional :class:`~helga.search.SearchIndex` of channel logs
+        :param compress: True if log files should be compressed after rotation
+        :param catalog: An optional :class:`ChannelLogCatalog` to add new log files to
         """
         self.basedir = basedir
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.writer = writer
+        self.search_index = search_index
+        self.compress = compress
+        self.catalog = catalog
+        self.buffer = []
+        self._flush_call = None
+
         filename = os.path.join(basedir, self.current_filename())
         self.next_rollover = self.compute_next_rollover()
         try:
@@ -105,6 +638,21 @@ class ChannelLogFileHandler(logging.handlers.BaseRotatingHandler):
             # python 2.6 uses old-style classes for logging.Handler
             logging.handlers.BaseRotatingHandler.__init__(self, filename, 'a')
 
+        self.add_to_catalog()
+
+    @property
+    def next_rollover(self):
+        """
+        The UTC datetime of the next rollover
+        """
+        return self._next_rollover
+
+    @next_rollover.setter
+    def next_rollover(self, value):
+        # Keep a unix timestamp so checking for rollover is a simple comparison
+        self._next_rollover = value
+        self._next_rollover_ts = calendar.timegm(value.utctimetuple())
+
     def compute_next_rollover(self):
         """
         Based on UTC now, computes the next rollover date, which will be 00:00:00
@@ -123,23 +671,188 @@ class ChannelLogFileHandler(logging.handlers.BaseRotatingHandler):
 
     def shouldRollover(self, record):
         """
-        Returns True if the current UTC datetime occurs on or after the
-        next scheduled rollover datetime. False otherwise.
+        Returns True if the record was created, or if no record is given the current
+        UTC datetime occurs, on or after the next scheduled rollover datetime. False otherwise.
+
+        :param record: a python log record
+        """
+        created = time.time() if record is None else record.created
+        return created >= self._next_rollover_ts
+
+    def emit(self, record):
+        """
+        Formats a log record and hands it to the background writer if there is one,
+        otherwise buffers it directly. Without a writer, a write of buffered records
+        is scheduled to occur within ``flush_interval`` seconds.
+
+        :param record: a python log record
+        """
+        try:
+            line = self.serialize(record)
+
+            if self.writer is not None:
+                self.writer.put(self, record.created, line)
+                return
+
+            self.write(line, record.created)
+
+            if self.buffer and self._flush_call is None:
+                self._flush_call = reactor.callLater(self.flush_interval, self.flush)
+        except Exception:
+            self.handleError(record)
+
+    def serialize(self, record):
+        """
+        Returns a log record as it is buffered and written to disk, a formatted line
 
         :param record: a python log record
         """
-        return datetime.datetime.utcnow() >= self.next_rollover
+        return self.format(record)
+
+    def write_buffer(self, lines):
+        """
+        Writes buffered lines to the log file. This is called with the handler lock held.
+
+        :param lines: a list of formatted log lines
+        """
+        self.stream.write(from_unicode(u'\n'.join(lines) + u'\n'))
+        self.stream.flush()
+
+    def write(self, line, created):
+        """
+        Buffers a formatted log line, performing a rollover first if needed. Buffered
+        lines are written to disk once the buffer is full.
+
+        :param line: the formatted log line
+        :param created: the unix timestamp of the log record
+        """
+        self.acquire()
+        try:
+            if created >= self._next_rollover_ts:
+                self.doRollover()
+
+            self.buffer.append(line)
+
+            if len(self.buffer) >= self.buffer_size or self.flush_interval <= 0:
+                self.flush()
+        finally:
+            self.release()
+
+    def flush(self):
+        """
+        Write any buffered records to the current log file in a single write. If there is
+        a search index, it is then updated, in the writer thread if there is one, otherwise
+        in a reactor thread so the reactor is never blocked on the index.
+        """
+        self.acquire()
+        try:
+            if self._flush_call is not None:
+                if self._flush_call.active():
+                    self._flush_call.cancel()
+                self._flush_call = None
+
+            if not self.buffer:
+                return
+
+            lines, self.buffer = self.buffer, []
+
+            if self.stream is None:
+                self.stream = self._open()
+
+            self.write_buffer(lines)
+        finally:
+            self.release()
+
+        if self.search_index is None:
+            return
+
+        if self.writer is None:
+            reactor.callInThread(self.update_search_index, self.baseFilename)
+        else:
+            self.update_search_index(self.baseFilename)
+
+    def update_search_index(self, filename):
+        """
+        Index any lines of a log file not yet in the search index
+
+        :param filename: the path of the log file
+        """
+        try:
+            self.search_index.update(filename)
+        except Exception:
+            logging.getLogger(__name__).exception('Failed to update channel log search index')
 
     def doRollover(self):
         """
-        Perform log rollover. Closes any open stream, sets a new log filename,
-        and computes the next rollover time.
+        Perform log rollover. Writes any buffered records to the previous log file, closes
+        any open stream, sets a new log filename, and computes the next rollover time. The
+        previous log file is compressed in a reactor thread if ``compress`` is True.
         """
+        self.flush()
+
         if self.stream:
             self.stream.close()
             self.stream = None
 
+        previous = self.baseFilename
         self.baseFilename = os.path.abspath(os.path.join(self.basedir, self.current_filename()))
+
+        if self.compress and previous != self.baseFilename and os.path.isfile(previous):
+            # This may be called from the writer thread, so schedule compression thread safely
+            reactor.callFromThread(reactor.callInThread, compress_channel_log, previous)
         self.stream = self._open()
+        self.add_to_catalog()
 
         self.next_rollover = self.compute_next_rollover()
+
+    def add_to_catalog(self):
+        """
+        Add the channel and date of the current log file to the catalog, if there is one
+        """
+        if self.catalog is not None:
+            self.catalog.add(os.path.basename(self.basedir), channel_log_date(self.current_filename()))
+
+
+class BinaryChannelLogFileHandler(ChannelLogFileHandler):
+    """
+    A channel log handler that writes length-prefixed binary records, rather than lines of text,
+    to UTC dated ``YYYY-MM-DD.log`` files. Each record is a :data:`BINARY_RECORD` header followed
+    by the UTF-8 encoded nick and message, so message boundaries are exact even for multi-line
+    messages. Alongside each log file, a ``YYYY-MM-DD.idx`` file holds the byte offset of every
+    record as a :data:`BINARY_INDEX_ENTRY`, allowing random access to any message.
+    Use :func:`export_binary_channel_log` to convert a binary log to the plain text format.
+    """
+
+    def current_filename(self):
+        """
+        Returns a UTC dated filename suitable as a log file. Example: 2014-12-15.log
+        """
+        return datetime.datetime.utcnow().strftime('%Y-%m-%d.log')
+
+    def serialize(self, record):
+        """
+        Returns a log record encoded as a binary record
+
+        :param record: a python log record
+        """
+        return encode_record(record.created, record.nick, record.getMessage())
+
+    def write_buffer(self, records):
+        """
+        Writes buffered records to the log file, and their offsets to its index file
+
+        :param records: a list of encoded binary records
+        """
+        self.stream.seek(0, os.SEEK_END)
+        offset = self.stream.tell()
+
+        entries = []
+        for record in records:
+            entries.append(BINARY_INDEX_ENTRY.pack(offset))
+            offset += len(record)
+
+        self.stream.write(''.join(records))
+        self.stream.flush()
+
+        with open(os.path.splitext(self.baseFilename)[0] + '.idx', 'ab') as fp:
+            fp.write(''.join(entries))
@@ -0,0 +1,403 @@
+"""
+Runtime metrics, exposed in the Prometheus text format by the builtin ``metrics`` webhook
+(see :ref:`builtin.webhooks.metrics`)
+
+Metrics are module level objects, updated wherever the measured thing happens::
+
+    from helga import metrics
+
+    metrics.messages_received.inc(backend='irc', channel='#bots')
+
+    with metrics.plugin_seconds.time(plugin='ping'):
+        do_something()
+
+Updating a metric takes a lock and a dictionary lookup, so it is cheap enough for any code path.
+"""
+import os
+import resource
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from twisted.internet import reactor, task
+
+from helga.util.encodings import from_unicode
+
+
+#: The default upper bounds, in seconds, of histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricRegistry(object):
+    """
+    A collection of metrics, rendered together
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry
+
+        :param metric: a :class:`Metric`
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format, as a byte string
+        """
+        lines = []
+        for metric in sorted(self.metrics, key=lambda metric: metric.name):
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """
+    Formats a list of (name, value) label pairs, i.e. ``{channel="#bots"}``
+    """
+    if not labels:
+        return ''
+
+    pairs = []
+    for name, value in labels:
+        value = from_unicode(value if isinstance(value, basestring) else str(value))
+        value = value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+        pairs.append('{0}="{1}"'.format(name, value))
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    """
+    Formats a sample value, i.e. ``1.0`` or ``+Inf``
+    """
+    value = float(value)
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(value)
+
+
+class Metric(object):
+    """
+    Base class of metrics. Each metric holds a value for every combination of label values it
+    has been updated with. Metrics are safe to update from any thread.
+    """
+
+    #: The Prometheus metric type
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), registry=None):
+        """
+        :param name: the metric name, i.e. ``helga_messages_received_total``
+        :param documentation: a short description of the metric
+        :param labels: the names of the labels each value of the metric is identified by
+        :param registry: the :class:`MetricRegistry` to add this to, defaulting to the module's
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+        (default_registry if registry is None else registry).register(self)
+
+    def key(self, labels):
+        """
+        Returns the tuple of label values identifying a value of this metric
+
+        :param labels: a dictionary of label names to values
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError('{0} requires labels {1}'.format(self.name, ', '.join(self.labels)))
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """
+        Yields a three-tuple of sample name, list of (label name, value) pairs and value for
+        each sample of the metric
+        """
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for key, value in values:
+            yield self.name, zip(self.labels, key), value
+
+
+class Counter(Metric):
+    """
+    A value that only ever increases, such as the number of messages received
+    """
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the counter
+
+        :param amount: the amount to increment by
+        :param labels: the label values of the counter to increment
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        Returns the current value of the counter
+        """
+        return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down, such as a queue length. Rather than being set, a gauge
+    may be given a function called for its value whenever metrics are rendered.
+    """
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        """
+        Set the value of the gauge
+
+        :param value: the new value
+        :param labels: the label values of the gauge to set
+        """
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, fn, **labels):
+        """
+        Use a function to get the value of the gauge. The function should be quick, since it is
+        called whenever metrics are rendered. If it raises an exception, the value is omitted.
+
+        :param fn: a callable returning a number
+        :param labels: the label values of the gauge
+        """
+        self.set(fn, **labels)
+
+    def get(self, **labels):
+        """
+        Returns the current value of the gauge, or None if it has not been set
+        """
+        value = self.values.get(self.key(labels))
+        return value() if callable(value) else value
+
+    def samples(self):
+        for name, labels, value in super(Gauge, self).samples():
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue
+            yield name, labels, value
+
+
+class Histogram(Metric):
+    """
+    Counts of observed values, such as durations, in buckets of increasing upper bounds
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, registry=None):
+        """
+        :param buckets: an increasing sequence of bucket upper bounds. A bucket with an upper
+                        bound of infinity is always added.
+
+        See :class:`Metric` for the other parameters
+        """
+        super(Histogram, self).__init__(name, documentation, labels, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Record an observed value
+
+        :param value: the observed value
+        :param labels: the label values of the histogram
+        """
+        key = self.key(labels)
+        bucket = bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # One count per bucket, plus the +Inf bucket, followed by the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        A context manager observing the number of seconds its block takes
+
+        :param labels: the label values of the histogram
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(counts)) for key, counts in self.values.items())
+
+        for key, counts in values:
+            labels = zip(self.labels, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + [('le', format_value(bound))], cumulative
+            yield self.name + '_sum', labels, counts[-1]
+            yield self.name + '_count', labels, cumulative
+
+
+def process_rss():
+    """
+    Returns the resident set size of this process in bytes. Where ``/proc`` is not available,
+    this is the peak resident set size instead.
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ReactorLagSampler(object):
+    """
+    Measures how late the reactor runs scheduled calls, which is how long anything blocking
+    the reactor thread delays everything else. A ``LoopingCall`` runs every ``interval``
+    seconds, and each time records the difference between the time it was scheduled to run
+    and the time it actually ran.
+    """
+
+    def __init__(self, interval=1.0, clock=None):
+        """
+        :param interval: the number of seconds between samples
+        :param clock: the reactor to schedule samples with, for testing
+        """
+        self.interval = interval
+        self.loop = task.LoopingCall.withCount(self.sample)
+        self.loop.clock = clock or reactor
+        self.intervals = 0
+
+    def start(self):
+        """
+        Start sampling
+        """
+        self.intervals = 0
+        self.loop.start(self.interval, now=False)
+
+    def stop(self):
+        """
+        Stop sampling
+        """
+        if self.loop.running:
+            self.loop.stop()
+
+    def sample(self, count):
+        """
+        Record the lag of a call of the looping call
+
+        :param count: the number of intervals since the previous call, more than one if the
+                      reactor was blocked for longer than an interval
+        """
+        # This call was due one interval after the previous one was due, however many
+        # intervals have passed since
+        scheduled = self.loop.starttime + (self.intervals + 1) * self.interval
+        self.intervals += count
+        self.record(max(0.0, self.loop.clock.seconds() - scheduled))
+
+    def record(self, lag):
+        """
+        Record a measured lag
+
+        :param lag: the number of seconds a call ran late
+        """
+        reactor_lag.observe(lag)
+
+
+default_registry = MetricRegistry()
+
+#: Chat messages received, by chat backend and channel. Private messages have the channel 'private'
+messages_received = Counter('helga_messages_received_total', 'Chat messages received',
+                            ['backend', 'channel'])
+
+#: Chat messages sent, by chat backend and channel. Private messages have the channel 'private'
+messages_sent = Counter('helga_messages_sent_total', 'Chat messages sent', ['backend', 'channel'])
+
+#: Chat messages dropped before reaching plugins, by reason, see :class:`helga.suppress.MessageSuppressor`
+messages_suppressed = Counter('helga_messages_suppressed_total', 'Chat messages dropped before reaching plugins',
+                              ['reason'])
+
+#: Channel log lines discarded because the background writer's queue was full, see
+#: :class:`helga.log.ChannelLogWriter`
+channel_log_lines_dropped = Counter('helga_channel_log_lines_dropped_total',
+                                    'Channel log lines discarded because the writer queue was full')
+
+#: Invocations of commands that were rate limited, by plugin, see :class:`helga.ratelimit.RateLimiter`
+plugin_rate_limited = Counter('helga_plugin_rate_limited_total', 'Command invocations that were rate limited',
+                              ['plugin'])
+
+#: Lookups of cached plugin responses, by plugin and result, 'hit' or 'miss', see :attr:`helga.plugins.Plugin.cache`
+plugin_cache_requests = Counter('helga_plugin_cache_requests_total', 'Lookups of cached plugin responses',
+                                ['plugin', 'result'])
+
+#: Reconnects to the chat server, by chat backend
+reconnects = Counter('helga_reconnects_total', 'Reconnects to the chat server', ['backend'])
+
+#: The number of messages waiting to be sent because of the setting :data:`~helga.settings.RATE_LIMIT`
+outbound_queue_length = Gauge('helga_outbound_queue_length', 'Chat messages waiting to be sent',
+                              ['backend'])
+
+#: Time plugins spend processing a message, by plugin name
+plugin_seconds = Histogram('helga_plugin_process_seconds', 'Time plugins spend processing a message',
+                           ['plugin'])
+
+#: How late the reactor runs scheduled calls, see :class:`ReactorLagSampler`
+reactor_lag = Histogram('helga_reactor_lag_seconds', 'How late the reactor runs scheduled calls')
+
+#: Time MongoDB commands take, by command name
+db_command_seconds = Histogram('helga_db_command_seconds', 'Time MongoDB commands take', ['command'])
+
+#: MongoDB commands that failed, by command name
+db_command_failures = Counter('helga_db_command_failures_total', 'MongoDB commands that failed',
+                              ['command'])
+
+#: Time webhook routes take to respond, by route path pattern
+webhook_seconds = Histogram('helga_webhook_request_seconds', 'Time webhook routes take to respond',
+                            ['route'])
+
+#: The resident memory of the helga process
+process_resident_memory = Gauge('helga_process_resident_memory_bytes', 'Resident memory size in bytes')
+process_resident_memory.set_function(process_rss)
+
+
+def render():
+    """
+    Returns all metrics in the Prometheus text exposition format
+    """
+    return default_registry.render()
+
+
+def channel_label(channel, is_public):
+    """
+    Returns the channel label value for a message, which groups all private messages together
+    so that each nick does not get its own metric
+
+    :param channel: the channel name, or the nick of a private message
+    :param is_public: True if the channel is a public channel
+    """
+    return channel if is_public else 'private'
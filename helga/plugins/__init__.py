@@ -3,12 +3,15 @@ Helga's core plugin library containing base implementations for creating plugins
 as well as utilities for managing plugins at runtime
 """
 from __future__ import absolute_import
+import fnmatch
 import functools
+import math
 import pkg_resources
 import random
 import re
 import shlex
 import sys
+import time
 import warnings
 
 from collections import defaultdict
@@ -17,8 +20,11 @@ from operator import methodcaller
 
 import smokesignal
 
-from helga import log, settings
+from helga import log, metrics, settings
+from helga.ratelimit import RateLimiter
+from helga.suppress import MessageSuppressor
 from helga.util.encodings import from_unicode, to_unicode
+from helga.util.lru import LRUDict
 
 
 logger = log.getLogger(__name__)
@@ -56,6 +62,23 @@ if not settings.COMMAND_ARGS_SHLEX:
     warnings.warn(u'Command arg parsing will default to shlex in a future version', FutureWarning)
 
 
+def _as_list(patterns):
+    """
+    Returns a list of glob patterns given either a list or a single pattern string
+    """
+    if isinstance(patterns, basestring):
+        return [patterns]
+    return patterns
+
+
+def _glob_match(name, patterns):
+    """
+    Returns True if a channel or nick matches any of a list of case insensitive glob patterns
+    """
+    name = to_unicode(name).lower()
+    return any(fnmatch.fnmatchcase(name, to_unicode(pattern).lower()) for pattern in patterns)
+
+
 def random_ack():
     """
     Returns a random choice from :data:`ACKS`
@@ -92,6 +115,12 @@ class Registry(object):
         :annotation: = {}
 
         A dictionary of enabled plugin names per channel, keyed by channel name
+
+    .. attribute:: generation
+        :annotation: = 0
+
+        A number incremented whenever a plugin is registered or reloaded, so that anything
+        derived from registered plugins, such as the help index, can tell when it is stale
     """
     __instance = None
 
@@ -109,6 +138,19 @@ class Registry(object):
         if not hasattr(self, 'plugins'):
             self.plugins = {}
 
+        if not hasattr(self, 'registered_names'):
+            # Registered plugin objects -> the name they were registered with
+            self.registered_names = {}
+
+        if not hasattr(self, 'generation'):
+            self.generation = 0
+
+        if not hasattr(self, 'suppressor'):
+            self.suppressor = MessageSuppressor()
+
+        if not hasattr(self, 'limiter'):
+            self.limiter = RateLimiter()
+
         self.plugin_names = set(ep.name for ep in pkg_resources.iter_entry_points('helga_plugins'))
 
         # Plugins whitelist/blacklist
@@ -142,7 +184,8 @@ class Registry(object):
 
     def register(self, name, fn_or_cls):
         """
-        Register a decorated plugin function or :class:`Plugin` subclass with a given name
+        Register a decorated plugin function or :class:`Plugin` subclass with a given name. If a
+        plugin was already registered with the name, any responses it cached are discarded.
 
         :param name: the name of the plugin
         :param fn_or_cls: a decorated plugin function or :class:`Plugin` subclass
@@ -159,7 +202,17 @@ class Registry(object):
         if not (isinstance(fn_or_cls, Plugin) or hasattr(fn_or_cls, '_plugins')):
             raise TypeError(u"Plugin {0} must be a subclass of Plugin, or a decorated function".format(name))
 
+        # Forget a plugin being replaced, so it is not kept alive after a reload
+        previous = self.plugins.get(name)
+        for plugin in getattr(previous, '_plugins', [previous] if previous else []):
+            plugin.clear_cache()
+            self.registered_names.pop(plugin, None)
+
         self.plugins[name] = fn_or_cls
+        self.generation += 1
+
+        for plugin in getattr(fn_or_cls, '_plugins', [fn_or_cls]):
+            self.registered_names[plugin] = name
 
     @property
     def all_plugins(self):
@@ -237,7 +290,8 @@ class Registry(object):
     def reload(self, name):
         """
         Reloads a plugin with a given name. This is equivalent to finding the registered
-        entry point module and using the python builtin ``reload()``.
+        entry point module and using the python builtin ``reload()``. Any responses cached by
+        the plugin are discarded (see :attr:`Plugin.cache`).
 
         :param name: the desired plugin to reload
         :returns: True if reloaded, False if an exception occurred
@@ -287,6 +341,11 @@ class Registry(object):
         Invoke the ``preprocess`` method for each plugin on a given channel according to plugin priority.
         Any exceptions from plugins will be suppressed and logged.
 
+        Before any plugin, repeated messages and bot loops are detected (see
+        :class:`~helga.suppress.MessageSuppressor`). Such a message is not preprocessed, and is
+        returned as None, which :meth:`process` does not dispatch to plugins and clients do not
+        track as the user's last message.
+
         :param client: an instance of :class:`helga.comm.irc.Client` or :class:`helga.comm.xmpp.Client`
         :param channel: the channel from which the message came
         :param nick: the nick of the user sending the message
@@ -294,7 +353,13 @@ class Registry(object):
         :returns: a three-tuple (channel, nick, message) containing modifications all preprocessor
                   plugins have made
         """
+        if self.suppressor.check(client, channel, nick, message):
+            return channel, nick, None
+
         for plugin in self.prioritized(channel):
+            if not self.accepts(plugin, client, channel, nick, message):
+                continue
+
             try:
                 channel, nick, message = plugin.preprocess(client, channel, nick, message)
             except Exception:
@@ -303,6 +368,17 @@ class Registry(object):
 
         return channel, nick, message
 
+    def accepts(self, plugin, client, channel, nick, message):
+        """
+        Checks whether a plugin's filters accept a message (see :meth:`Plugin.accepts`). A plugin
+        whose filters raise an exception does not accept the message, and the exception is logged.
+        """
+        try:
+            return plugin.accepts(client, channel, nick, message)
+        except Exception:
+            logger.exception('Checking the filters of plugin %s failed', plugin)
+            return False
+
     def process(self, client, channel, nick, message):
         """
         Invoke the ``process`` method for each plugin on a given channel according to plugin priority.
@@ -313,19 +389,42 @@ class Registry(object):
         :exc:`~helga.plugins.ResponseNotReady` will prevent others from processing. All response strings are
         explicitly converted to unicode.
 
+        Plugins whose filters do not accept the message are excluded before dispatch (see
+        :ref:`plugins.filters`). Plugins are rate limited per user and per channel by :data:`~helga.settings.PLUGIN_RATE_LIMITS`
+        (see :class:`~helga.ratelimit.RateLimiter`). A rate limited plugin is skipped without processing
+        the message. If the message invokes a rate limited command, the user is told when to try again.
+
         :param client: an instance of :class:`helga.comm.irc.Client` or :class:`helga.comm.xmpp.Client`
         :param channel: the channel from which the message came
         :param nick: the nick of the user sending the message
         :param message: the original message received
         :returns: a list of non-empty unicode response strings
         """
+        # The message was suppressed by preprocess
+        if message is None:
+            return []
+
         responses = []
         first_responder = getattr(settings, 'PLUGIN_FIRST_RESPONDER_ONLY', False)
 
-        for plugin in self.prioritized(channel):
+        plugins = [plugin for plugin in self.prioritized(channel) if self.accepts(plugin, client, channel, nick, message)]
+
+        for plugin in plugins:
+            name = self.registered_names.get(plugin, 'unknown')
+
+            wait = self.limiter.allow(channel, nick, name)
+            if wait:
+                if (isinstance(plugin, Command) and plugin.invoked(client.nickname, message) and
+                        self.limiter.deny(channel, nick, name, wait)):
+                    responses.append(u'{0}, slow down! Try {1} again in {2} seconds'.format(
+                        nick, plugin.command, int(math.ceil(wait))))
+                continue
+
             try:
-                resp = plugin.process(client, channel, nick, message)
+                with metrics.plugin_seconds.time(plugin=name):
+                    resp = plugin.process(client, channel, nick, message)
             except ResponseNotReady:
+                self.limiter.consume(channel, nick, name)
                 if first_responder:
                     break
                 continue  # pragma: no cover Python == 2.7
@@ -336,6 +435,8 @@ class Registry(object):
             if not resp:
                 continue
 
+            self.limiter.consume(channel, nick, name)
+
             # Chained decorator style plugins return a list of strings
             if isinstance(resp, (tuple, list)):
                 # Be sure to filter Nones, then strip
@@ -379,8 +480,120 @@ class Plugin(object):
     #: The registered priority of the plugin
     priority = PRIORITY_NORMAL
 
-    def __init__(self, priority=PRIORITY_NORMAL):
+    #: An optional number of seconds to cache responses for. Plugins whose response depends only
+    #: on the channel and the parsed command arguments or pattern matches, such as lookups or help
+    #: text, can set this to answer repeated requests without running again. Only non-empty
+    #: responses are cached, at most :data:`~helga.settings.PLUGIN_CACHE_SIZE` per plugin.
+    cache = None
+
+    #: An optional list of glob patterns, such as ``'#dev-*'``, of the channels on which this plugin
+    #: handles messages. Private messages are handled only if a pattern matches the sender's nick.
+    #: A single pattern string may be given instead of a list. See :ref:`plugins.filters`.
+    channels = None
+
+    #: An optional list of glob patterns of the only nicks whose messages this plugin handles
+    nicks = None
+
+    #: An optional list of glob patterns of nicks whose messages this plugin ignores
+    ignore_nicks = None
+
+    #: A boolean, if True, this plugin only handles private messages
+    private_only = False
+
+    #: A boolean, if True, this plugin only handles messages on public channels
+    public_only = False
+
+    #: The minimum length of messages this plugin handles, ignoring leading and trailing whitespace
+    min_length = 0
+
+    def __init__(self, priority=PRIORITY_NORMAL, channels=None, nicks=None, ignore_nicks=None,
+                 private_only=False, public_only=False, min_length=0):
         self.priority = priority
+        self.channels = _as_list(channels or self.channels)
+        self.nicks = _as_list(nicks or self.nicks)
+        self.ignore_nicks = _as_list(ignore_nicks or self.ignore_nicks)
+        self.private_only = private_only or self.private_only
+        self.public_only = public_only or self.public_only
+        self.min_length = min_length or self.min_length
+
+    def accepts(self, client, channel, nick, message):
+        """
+        Checks a message against the declarative filters of this plugin, which the plugin registry
+        does before dispatching the message to the plugin. See :ref:`plugins.filters`.
+
+        :param client: an instance of :class:`helga.comm.irc.Client` or :class:`helga.comm.xmpp.Client`,
+                       which decides whether the channel is public
+        :param channel: the channel from which the message was received
+        :param nick: the nick of the user sending the message
+        :param message: the message received
+        :returns: True if this plugin should handle the message
+        """
+        if self.private_only or self.public_only:
+            public = client.is_public_channel(channel)
+            if (self.private_only and public) or (self.public_only and not public):
+                return False
+
+        if self.min_length and len(message.strip()) < self.min_length:
+            return False
+
+        if self.channels is not None and not _glob_match(channel, self.channels):
+            return False
+
+        if self.nicks is not None and not _glob_match(nick, self.nicks):
+            return False
+
+        if self.ignore_nicks and _glob_match(nick, self.ignore_nicks):
+            return False
+
+        return True
+
+    @property
+    def responses(self):
+        """
+        The cache of responses, a bounded dictionary of (channel, key) to (expiry time, response)
+        """
+        if getattr(self, '_responses', None) is None:
+            self._responses = LRUDict(maxlen=getattr(settings, 'PLUGIN_CACHE_SIZE', 1000))
+        return self._responses
+
+    def clear_cache(self):
+        """
+        Discard all cached responses
+        """
+        self._responses = None
+
+    def run_cached(self, key, client, channel, nick, message, *args):
+        """
+        Calls ``run`` with the given arguments, unless :attr:`cache` is set and a response for the
+        same channel and key was cached less than that many seconds ago, in which case that response
+        is returned instead. Cache hits and misses are counted by the metric
+        :data:`helga.metrics.plugin_cache_requests`.
+
+        :param key: a hashable key identifying the request, such as the parsed command arguments
+        :returns: the cached response, otherwise the return value of ``run``
+        """
+        if not self.cache:
+            return self.run(client, channel, nick, message, *args)
+
+        key = (channel, key)
+        try:
+            hash(key)
+        except TypeError:
+            return self.run(client, channel, nick, message, *args)
+
+        name = registry.registered_names.get(self, 'unknown')
+        now = time.time()
+
+        expires, response = self.responses.get(key, (0, None))
+        if expires > now:
+            metrics.plugin_cache_requests.inc(plugin=name, result='hit')
+            return response
+
+        metrics.plugin_cache_requests.inc(plugin=name, result='miss')
+        response = self.run(client, channel, nick, message, *args)
+        if response:
+            self.responses[key] = (now + self.cache, response)
+        return response
 
     def run(self, client, channel, nick, message, *args, **kwargs):
         """
@@ -494,12 +707,14 @@ class Command(Plugin):
     #: whitespace splitting
     shlex = False
 
-    def __init__(self, command='', aliases=None, help='', priority=PRIORITY_NORMAL, shlex=False):
-        super(Command, self).__init__(priority)
+    def __init__(self, command='', aliases=None, help='', priority=PRIORITY_NORMAL, shlex=False, cache=None,
+                 **filters):
+        super(Command, self).__init__(priority, **filters)
         self.command = command or self.command
         self.aliases = aliases or self.aliases
         self.help = help or self.help
         self.shlex = shlex
+        self.cache = cache or self.cache
 
     def parse(self, botnick, message):
         """
@@ -593,6 +808,27 @@ class Command(Plugin):
         """
         return None  # pragma: no cover
 
+    def _is_command(self, command):
+        """
+        Returns True if a parsed command string is this command or one of its aliases
+        """
+        all_commands = [self.command] + list(self.aliases)
+
+        if settings.COMMAND_IGNORECASE:
+            command = command.lower()
+            all_commands = map(methodcaller('lower'), all_commands)
+
+        return command in all_commands
+
+    def invoked(self, botnick, message):
+        """
+        Returns True if a message invokes this command or one of its aliases, without running it
+
+        :param botnick: the current bot nickname
+        :param message: the incoming chat message
+        """
+        return self._is_command(self.parse(botnick, message)[0])
+
     def process(self, client, channel, nick, message):
         """
         Parses the incoming message and determins if this command should run (i.e. if the primary
@@ -607,16 +843,11 @@ class Command(Plugin):
         :returns: None if the plugin should not run, otherwise the return value of the ``run`` method
         """
         command, args = self.parse(client.nickname, message)
-        all_commands = [self.command] + list(self.aliases)
-
-        if settings.COMMAND_IGNORECASE:
-            command = command.lower()
-            all_commands = map(methodcaller('lower'), all_commands)
-
-        if command not in all_commands:
+        if not self._is_command(command):
             return None
 
-        return self.run(client, channel, nick, message, command, args)
+        key = (command.lower() if settings.COMMAND_IGNORECASE else command, tuple(args))
+        return self.run_cached(key, client, channel, nick, message, command, args)
 
 
 class Match(Plugin):
@@ -629,9 +860,10 @@ class Match(Plugin):
     #: can be evaluated for truthiness.
     pattern = ''
 
-    def __init__(self, pattern='', priority=PRIORITY_LOW):
-        super(Match, self).__init__(priority)
+    def __init__(self, pattern='', priority=PRIORITY_LOW, cache=None, **filters):
+        super(Match, self).__init__(priority, **filters)
         self.pattern = pattern or self.pattern
+        self.cache = cache or self.cache
 
     def run(self, client, channel, nick, message, matches):
         """
@@ -696,10 +928,11 @@ class Match(Plugin):
         if not bool(matches):
             return None
 
-        return self.run(client, channel, nick, message, matches)
+        key = tuple(matches) if isinstance(matches, list) else matches
+        return self.run_cached(key, client, channel, nick, message, matches)
 
 
-def command(command, aliases=None, help='', priority=PRIORITY_NORMAL, shlex=False):
+def command(command, aliases=None, help='', priority=PRIORITY_NORMAL, shlex=False, cache=None, **filters):
     """
     A decorator for creating command plugins
 
@@ -710,6 +943,11 @@ def command(command, aliases=None, help='', priority=PRIORITY_NORMAL, shlex=Fals
     :param priority: The priority of the plugin. Default is :data:`~helga.plugins.PRIORITY_NORMAL`.
     :param shlex: A boolean indicating whether to use shlex arg string parsing rather than naive
                   whitespace splitting.
+    :param cache: An optional number of seconds to cache responses for the same channel and
+                  arguments. See :attr:`Plugin.cache`.
+    :param filters: Optional declarative filters of the messages the plugin handles: ``channels``,
+                    ``nicks``, ``ignore_nicks``, ``private_only``, ``public_only`` and ``min_length``.
+                    See :ref:`plugins.filters`.
 
     Decorated functions should follow this pattern:
 
@@ -729,10 +967,11 @@ def command(command, aliases=None, help='', priority=PRIORITY_NORMAL, shlex=Fals
         :returns: String or list of strings to return via chat. None or empty string or list
                   for no response
     """
-    return Command(command, aliases=aliases, help=help, priority=priority, shlex=shlex).decorate
+    return Command(command, aliases=aliases, help=help, priority=priority, shlex=shlex, cache=cache,
+                   **filters).decorate
 
 
-def match(pattern, priority=PRIORITY_LOW):
+def match(pattern, priority=PRIORITY_LOW, cache=None, **filters):
     """
     A decorator for creating match plugins
 
@@ -740,6 +979,10 @@ def match(pattern, priority=PRIORITY_LOW):
                     this argument can be a callable that accepts a chat message string as its only
                     argument and returns a value that can be evaluated for truthiness.
     :param priority: The priority of the plugin. Default is :data:`~helga.plugins.PRIORITY_LOW`
+    :param cache: An optional number of seconds to cache responses for the same channel and
+                  matches. See :attr:`Plugin.cache`.
+    :param filters: Optional declarative filters of the messages the plugin handles, as for
+                    :func:`command`. See :ref:`plugins.filters`.
 
     Decorated match functions should follow this pattern:
 
@@ -756,14 +999,16 @@ def match(pattern, priority=PRIORITY_LOW):
                         the return value of the callable passed
         :returns: String or list of strings to return via chat. None or empty string or list for no response
     """
-    return Match(pattern, priority=priority).decorate
+    return Match(pattern, priority=priority, cache=cache, **filters).decorate
 
 
-def preprocessor(priority=PRIORITY_NORMAL):
+def preprocessor(priority=PRIORITY_NORMAL, **filters):
     """
     A decorator for creating preprocessor plugins
 
     :param priority: The priority of the plugin. Default is :data:`~helga.plugins.PRIORITY_NORMAL`
+    :param filters: Optional declarative filters of the messages the plugin handles, as for
+                    :func:`command`. See :ref:`plugins.filters`.
 
     Decorated preprocessor functions should follow this pattern:
 
@@ -780,6 +1025,6 @@ def preprocessor(priority=PRIORITY_NORMAL):
     """
     # This happens if not using a priority argument, but just decorating
     if callable(priority):
-        return Plugin(priority=PRIORITY_NORMAL).decorate(priority, preprocessor=True)
+        return preprocessor()(priority)
     else:
-        return functools.partial(Plugin(priority=priority).decorate, preprocessor=True)
+        return functools.partial(Plugin(priority=priority, **filters).decorate, preprocessor=True)
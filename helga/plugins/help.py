@@ -1,19 +1,33 @@
-from collections import defaultdict
+from collections import OrderedDict
 
 from helga.plugins import command, registry
+from helga.util.lru import LRUDict
+
+
+#: The number of plugins listed per page of help
+PAGE_SIZE = 10
+
+#: The maximum number of help indexes kept, one per distinct set of enabled plugins
+INDEX_CACHE_SIZE = 100
+
+DEFAULT_HELP = u'No help string for this plugin'
+
+# (registry generation, frozenset of enabled plugin names) -> help index
+_indexes = LRUDict(maxlen=INDEX_CACHE_SIZE)
 
 
 def format_help_string(name, *helps):
     return u'[{0}] {1}'.format(name, '. '.join(helps))
 
 
-@command('help', aliases=['halp'],
-         help="Show the help string for any commands. Usage: helga help [<plugin>]")
-def help(client, channel, nick, message, cmd, args):
-    helps = defaultdict(list)
-    default_help = u'No help string for this plugin'
+def build_index(plugin_names):
+    """
+    Returns an ordered dictionary of plugin name to formatted help string, sorted by name,
+    for those of the given plugin names that are loaded
+    """
+    index = OrderedDict()
 
-    for plugin_name in registry.enabled_plugins[channel]:
+    for plugin_name in sorted(plugin_names):
         try:
             plugin = registry.plugins[plugin_name]
         except KeyError:
@@ -21,33 +35,66 @@ def help(client, channel, nick, message, cmd, args):
 
         # A simple object
         if hasattr(plugin, 'help'):
-            helps[plugin_name].append(plugin.help or default_help)
+            index[plugin_name] = format_help_string(plugin_name, plugin.help or DEFAULT_HELP)
 
         # A decorated function
         elif hasattr(plugin, '_plugins'):
             fn_helps = filter(bool, map(lambda x: getattr(x, 'help', None), plugin._plugins))
-            helps[plugin_name].extend(fn_helps or [default_help])
+            index[plugin_name] = format_help_string(plugin_name, *(fn_helps or [DEFAULT_HELP]))
+
+    return index
+
+
+def get_index(channel):
+    """
+    Returns the help index of the plugins enabled on a channel. Indexes are built once per set of
+    enabled plugins, and rebuilt when a plugin is registered or reloaded.
+    """
+    enabled = frozenset(registry.enabled_plugins[channel])
+    key = (registry.generation, enabled)
+
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = build_index(enabled)
+    return index
+
+
+@command('help', aliases=['halp'],
+         help="Show the help string for any commands. Usage: helga help [<plugin>|<page>]")
+def help(client, channel, nick, message, cmd, args):
+    index = get_index(channel)
+    page = 1
 
     try:
         plugin = args[0]
     except IndexError:
         pass
     else:
-        if plugin not in registry.enabled_plugins[channel]:
+        if plugin.isdigit() and plugin not in index:
+            page = int(plugin)
+        elif plugin not in registry.enabled_plugins[channel]:
             return u"Sorry {0}, I don't know about that plugin".format(nick)
-        elif plugin not in helps.keys():
+        elif plugin not in index:
             return u"Sorry {0}, there's no help string for plugin '{1}'".format(nick, plugin)
+        else:
+            # Single plugin, it's probably ok in the public channel
+            return index[plugin]
 
-        # Single plugin, it's probably ok in the public channel
-        return format_help_string(plugin, *helps[plugin])
+    pages = max(1, (len(index) + PAGE_SIZE - 1) // PAGE_SIZE)
+    if not 1 <= page <= pages:
+        return u"Sorry {0}, there are only {1} pages of help".format(nick, pages)
 
     if channel != nick:
         client.me(channel, 'whispers to {0}'.format(nick))
 
-    retval = []
-    # Send the message to the user
-    for key, value in helps.iteritems():
-        retval.append(format_help_string(key, *value))
+    start = (page - 1) * PAGE_SIZE
+    retval = index.values()[start:start + PAGE_SIZE]
 
     retval.insert(0, u"{0}, here are the plugins I know about".format(nick))
+    if page < pages:
+        retval.append(u'Page {0} of {1}. For more, use: helga help {2}'.format(page, pages, page + 1))
+    elif pages > 1:
+        retval.append(u'Page {0} of {1}'.format(page, pages))
+
+    # Send the message to the user
     client.msg(nick, u'\n'.join(retval))
@@ -0,0 +1,36 @@
+from helga import settings
+from helga.plugins import command
+from helga.search import get_search_index
+
+
+RESULT_LIMIT = 3
+
+
+@command('logsearch', help='Search the logs of the current channel, most recent first. Optionally '
+                           'limit to messages from a nick. Double quote phrases. '
+                           'Usage: helga logsearch [nick:<nick>] <terms>')
+def logsearch(client, channel, nick, message, cmd, args):
+    """
+    Respond with the most recent channel log messages matching search terms
+    """
+    if not settings.CHANNEL_LOGGING or not getattr(settings, 'CHANNEL_LOGGING_SEARCH', False):
+        return u'Channel log search is not enabled'
+
+    from_nick = None
+    terms = []
+    for arg in args:
+        if arg.startswith(u'nick:'):
+            from_nick = arg[5:]
+        else:
+            terms.append(arg)
+
+    if not terms:
+        return u'Usage: helga logsearch [nick:<nick>] <terms>'
+
+    results = get_search_index().search(u' '.join(terms), channel=channel, nick=from_nick, limit=RESULT_LIMIT)
+
+    if not results:
+        return u'No results for {0}'.format(u' '.join(terms))
+
+    return [u'[{0} {1}] <{2}> {3}'.format(r['date'], r['time'], r['nick'], r['message'].replace(u'\n', u' '))
+            for r in results]
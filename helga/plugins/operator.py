@@ -2,7 +2,7 @@ import random
 
 import smokesignal
 
-from helga import log
+from helga import lag, log, profiler, workers
 from helga.db import db
 from helga.plugins import command, registry, random_ack
 
@@ -58,9 +58,47 @@ def reload_plugin(plugin):
         return u"Failed to reload plugin '{0}'".format(plugin)
 
 
+def lag_summary():
+    """
+    Describes recent reactor lag and the last stall, see :mod:`helga.lag`
+    """
+    monitor = lag.get_lag_monitor()
+    if monitor is None:
+        return u'Reactor lag is not being monitored'
+    return monitor.summary()
+
+
+def control_profiler(args):
+    """
+    Starts or stops the sampling profiler, or describes the running or last profile,
+    see :mod:`helga.profiler`
+
+    :param args: the subcommand arguments following 'profile', i.e. ['start', '60']
+    """
+    sampler = profiler.get_profiler()
+    action = args[0] if args else 'status'
+
+    if action == 'start':
+        try:
+            seconds = int(args[1]) if len(args) > 1 else profiler.DEFAULT_DURATION
+        except ValueError:
+            seconds = -1
+        if seconds < 0:
+            return u'Usage: helga operator profile start [seconds]'
+        if not sampler.start(seconds or None):
+            return u'A profile is already running'
+        return u'Profiling for {0}. Results are served by the profile webhook'.format(
+            u'{0} seconds'.format(seconds) if seconds else u'until stopped')
+
+    if action == 'stop' and not sampler.stop():
+        return u'No profile is running'
+
+    return sampler.status()
+
+
 @command('operator', aliases=['oper', 'op'],
          help="Admin like control over helga. Must be an operator to use. "
-              "Usage: helga (operator|oper|op) (reload <plugin>|"
+              "Usage: helga (operator|oper|op) (reload <plugin>|lag|profile [start [seconds]|stop]|"
               "(join|leave|autojoin (add|remove)) <channel>)")
 def operator(client, channel, nick, message, cmd, args):
     """
@@ -91,3 +129,11 @@ def operator(client, channel, nick, message, cmd, args):
     # Reload a plugin without restarting
     elif subcmd == 'reload':
         return reload_plugin(args[1])
+
+    # Reported by the process holding the chat connection, even when plugins run in workers
+    elif subcmd == 'lag':
+        return workers.call_in_coordinator(client, channel, lag_summary)
+
+    # The profile webhook serves the profiler of the process holding the chat connection
+    elif subcmd == 'profile':
+        return workers.call_in_coordinator(client, channel, control_profiler, args[1:])
@@ -22,16 +22,24 @@ registered, using setuptools entry_points. However, they must belong to the entr
 For more information, see :ref:`webhooks`
 """
 import functools
+import itertools
 import pkg_resources
 import re
+import sre_constants
+import sre_parse
+import time
 
-from twisted.internet import reactor
+from collections import MutableMapping
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import failure
+from twisted.python.threadpool import ThreadPool
 from twisted.web import server, resource
 from twisted.web.error import Error
 
 import smokesignal
 
-from helga import log, settings
+from helga import log, metrics, settings
 from helga.plugins import Command, registry
 from helga.util.encodings import from_unicode
 
@@ -44,6 +52,27 @@ class HttpError(Error):
     __doc__ = Error.__doc__
 
 
+_thread_pool = None
+
+
+def get_thread_pool():
+    """
+    Obtains the thread pool used to run webhook routes declared with ``threaded=True``, starting
+    it on first use. The pool holds at most :data:`~helga.settings.WEBHOOKS_THREAD_POOL_SIZE`
+    threads, separate from the reactor thread pool, and is stopped when the reactor shuts down.
+    """
+    global _thread_pool
+
+    if _thread_pool is None:
+        _thread_pool = ThreadPool(minthreads=0,
+                                  maxthreads=getattr(settings, 'WEBHOOKS_THREAD_POOL_SIZE', 10),
+                                  name='webhooks')
+        _thread_pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _thread_pool.stop)
+
+    return _thread_pool
+
+
 class WebhookPlugin(Command):
     """
     A command plugin that manages running an HTTP server for webhook routes and services. Usage::
@@ -190,6 +219,120 @@ class WebhookPlugin(Command):
             return self.control(subcmd)
 
 
+def literal_prefix(pattern):
+    """
+    Returns the literal text that any path matched by a route path regular expression must
+    start with, which may be empty. For example, the prefix of ``^/logger/(?P<channel>\w+)/?$``
+    is ``/logger/``.
+
+    :param pattern: a route path regular expression string
+    """
+    parsed = sre_parse.parse(pattern)
+
+    # Flags like (?i) can change what a literal matches
+    if parsed.pattern.flags & ~re.UNICODE:
+        return ''
+
+    prefix = []
+    for op, value in parsed:
+        if op == sre_constants.AT and value == sre_constants.AT_BEGINNING and not prefix:
+            continue
+        # Only ASCII is compared, since request paths are byte strings
+        if op != sre_constants.LITERAL or value > 127:
+            break
+        prefix.append(chr(value))
+    return ''.join(prefix)
+
+
+class RouteTable(MutableMapping):
+    """
+    A mapping of route path regular expressions to two-tuples of allowed methods and route
+    handler function. Patterns are compiled when added, and indexed in a trie by their
+    :func:`literal prefix <literal_prefix>`, so finding the route for a request path only
+    tries the patterns whose prefix the path starts with, however many routes there are.
+
+    Candidate routes are tried most specific first: routes with a longer literal prefix are
+    tried before routes with a shorter one, and routes with the same prefix are tried in the
+    order they were added. For example, ``/logger/search`` is tried before ``/logger/(?P<channel>\w+)``.
+    """
+
+    def __init__(self, routes=None):
+        """
+        :param routes: an optional mapping of routes to add
+        """
+        self._routes = {}
+        self._order = itertools.count()
+
+        # Each trie node is a two-tuple of a dictionary of child nodes by character, and a
+        # list of (order, pattern, compiled pattern) for routes whose prefix ends at the node
+        self._trie = ({}, [])
+
+        self.update(routes or {})
+
+    def _node(self, prefix, create=False):
+        node = self._trie
+        for char in prefix:
+            if char not in node[0]:
+                if not create:
+                    return None
+                node[0][char] = ({}, [])
+            node = node[0][char]
+        return node
+
+    def __getitem__(self, pattern):
+        return self._routes[pattern]
+
+    def __setitem__(self, pattern, route):
+        if pattern not in self._routes:
+            node = self._node(literal_prefix(pattern), create=True)
+            node[1].append((next(self._order), pattern, re.compile(pattern)))
+        self._routes[pattern] = route
+
+    def __delitem__(self, pattern):
+        del self._routes[pattern]
+        node = self._node(literal_prefix(pattern))
+        node[1][:] = [entry for entry in node[1] if entry[1] != pattern]
+
+    def __iter__(self):
+        return iter(sorted(self._routes))
+
+    def __len__(self):
+        return len(self._routes)
+
+    def candidates(self, path):
+        """
+        Returns a list of (pattern, compiled pattern) of the routes that may match a path,
+        most specific first
+
+        :param path: a URL path
+        """
+        nodes = [self._trie]
+        for char in path:
+            node = nodes[-1][0].get(char)
+            if node is None:
+                break
+            nodes.append(node)
+
+        return [(pattern, compiled)
+                for node in reversed(nodes)
+                for _, pattern, compiled in node[1]]
+
+    def match(self, path):
+        """
+        Finds the most specific route matching a path
+
+        :param path: a URL path
+        :returns: a two-tuple of the route, itself a two-tuple of allowed methods and route
+                  handler function, and the regular expression match object, or None if no
+                  route matches
+        """
+        for pattern, compiled in self.candidates(path):
+            match = compiled.match(path)
+            if match:
+                return self._routes[pattern], match
+        return None
+
+
 class WebhookRoot(resource.Resource):
     """
     The root HTTP resource the webhook HTTP server uses to respond to requests. This
@@ -202,9 +345,9 @@ class WebhookRoot(resource.Resource):
         #: An instance of :class:`helga.comm.irc.Client` or :class:`helga.comm.xmpp.Client`
         self.chat_client = None
 
-        #: A dictionary of regular expression URL paths as keys, and two-tuple values
+        #: A :class:`RouteTable` of regular expression URL paths as keys, and two-tuple values
         #: of allowed methods, and the route handler function
-        self.routes = {}
+        self.routes = RouteTable()
 
     def add_route(self, fn, path, methods):
         """
@@ -223,7 +366,8 @@ class WebhookRoot(resource.Resource):
         matching the incoming request path. Any response string generated will be explicitly
         encoded as a UTF-8 byte string.
 
-        If no route patch matches the incoming request, a 404 is returned.
+        If no route patch matches the incoming request, a 404 is returned. If more than one
+        route matches, the most specific is used (see :class:`RouteTable`).
 
         If a route is found, but the request uses a method that the route handler does not
         support, a 405 is returned.
@@ -232,27 +376,94 @@ class WebhookRoot(resource.Resource):
         :returns: a string with the HTTP response content
         """
         request.setHeader('Server', 'helga')
-        for pat, route in self.routes.iteritems():
-            match = re.match(pat, request.path)
-            if match:
-                break
-        else:
+        found = self.routes.match(request.path)
+        if found is None:
             request.setResponseCode(404)
             return '404 Not Found'
 
         # Ensure that this route handles the request method
-        methods, fn = route
+        (methods, fn), match = found
         if request.method.upper() not in methods:
             request.setResponseCode(405)
             return '405 Method Not Allowed'
 
+        start = time.time()
+
+        def observe(result):
+            metrics.webhook_seconds.observe(time.time() - start, route=match.re.pattern)
+            return result
+
         # Handle raised HttpErrors
         try:
-            # Explicitly return a byte string. Twisted expects this
-            return from_unicode(fn(request, self.chat_client, **match.groupdict()))
+            response = fn(request, self.chat_client, **match.groupdict())
         except HttpError as e:
             request.setResponseCode(int(e.status))
-            return e.message or e.response
+            return observe(e.message or e.response)
+
+        if isinstance(response, defer.Deferred):
+            self.render_deferred(request, response.addBoth(observe))
+            return server.NOT_DONE_YET
+
+        # Explicitly return a byte string. Twisted expects this
+        return observe(from_unicode(response))
+
+    def render_deferred(self, request, deferred):
+        """
+        Writes the response of a route that returned a Deferred once it fires. HttpError failures
+        are handled as they are for routes that raise them, and any other failure is logged and
+        answered with a 500 response. The Deferred is cancelled if the client disconnects, or if
+        it has not fired within :data:`~helga.settings.WEBHOOKS_TIMEOUT` seconds, in which case
+        a 504 response is returned.
+
+        :param request: The incoming HTTP request, ``twisted.web.http.Request``
+        :param deferred: the Deferred returned by the route handler
+        """
+        state = {'disconnected': False, 'timed_out': False}
+
+        def disconnected(reason):
+            state['disconnected'] = True
+            deferred.cancel()
+
+        def timed_out():
+            state['timed_out'] = True
+            deferred.cancel()
+
+        timeout = getattr(settings, 'WEBHOOKS_TIMEOUT', 30)
+        timeout_call = reactor.callLater(timeout, timed_out) if timeout else None
+        request.notifyFinish().addErrback(disconnected)
+
+        def respond(response):
+            if response is server.NOT_DONE_YET:
+                return
+            request.write(from_unicode(response))
+            request.finish()
+
+        def finish(result):
+            if timeout_call is not None and timeout_call.active():
+                timeout_call.cancel()
+
+            # Nobody is left to respond to
+            if state['disconnected']:
+                return
+
+            if not isinstance(result, failure.Failure):
+                return respond(result)
+
+            if result.check(HttpError):
+                request.setResponseCode(int(result.value.status))
+                return respond(result.value.message or result.value.response)
+
+            if result.check(defer.CancelledError) and state['timed_out']:
+                request.setResponseCode(504)
+                return respond('504 Gateway Timeout')
+
+            logger.error('Webhook route for %s failed: %s', request.path, result.getTraceback())
+            request.setResponseCode(500)
+            respond('500 Internal Server Error')
+
+        deferred.addBoth(finish)
+        deferred.addErrback(lambda result: logger.error('Failed to write webhook response: %s',
+                                                        result.getTraceback()))
 
 
 def authenticated(fn):
@@ -276,7 +487,21 @@ def authenticated(fn):
     return ensure_authenticated
 
 
-def route(path, methods=None):
+def run_in_thread_pool(fn):
+    """
+    Decorator for running a webhook route handler in the webhooks thread pool (see
+    :func:`get_thread_pool`), so it may block without stalling the reactor. The decorated
+    function returns a Deferred firing with the handler's return value.
+
+    :param fn: the route handler to decorate
+    """
+    @functools.wraps(fn)
+    def defer_to_thread_pool(*args, **kwargs):
+        return threads.deferToThreadPool(reactor, get_thread_pool(), fn, *args, **kwargs)
+    return defer_to_thread_pool
+
+
+def route(path, methods=None, threaded=False):
     """
     Decorator to register a webhook route. This requires a path regular expression, and
     optionally a list of HTTP methods to accept, which defaults to accepting ``GET`` requests
@@ -284,6 +509,8 @@ def route(path, methods=None):
 
     :param path: a regular expression string for the URL path of the route
     :param methods: a list of accepted HTTP methods for this route, defaulting to ``['GET']``
+    :param threaded: True if the route handler blocks, and should be run in a thread pool
+                     rather than the reactor thread (see :func:`run_in_thread_pool`)
 
     Decorated routes must follow this pattern:
 
@@ -293,7 +520,12 @@ def route(path, methods=None):
         :param request: The incoming HTTP request, ``twisted.web.http.Request``
         :param client: The client connection. An instance of :class:`helga.comm.irc.Client`
                        or :class:`helga.comm.xmpp.Client`
-        :returns: a string HTTP response
+        :returns: a string HTTP response, or a Deferred firing with one
+
+    A route handler may return a Deferred rather than a string, for instance if it queries
+    an upstream service. The response is written when the Deferred fires, and the Deferred is
+    cancelled if the client disconnects or :data:`~helga.settings.WEBHOOKS_TIMEOUT` passes.
+    Threaded route handlers should not write to the request, since it is not thread safe.
     """
     plugin = registry.get_plugin('webhooks')
     if methods is None:
@@ -301,7 +533,7 @@ def route(path, methods=None):
 
     def wrapper(fn):
         if plugin is not None:
-            plugin.add_route(fn, path, methods)
+            plugin.add_route(run_in_thread_pool(fn) if threaded else fn, path, methods)
         return fn
 
     return wrapper
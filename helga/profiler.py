@@ -0,0 +1,186 @@
+"""
+A statistical profiler for the running bot, started and stopped by the operator command
+``helga operator profile`` (see :ref:`builtin.plugins.operator`) or the ``profile`` webhook
+(see :ref:`builtin.webhooks.profile`). A background thread periodically samples the stack
+of every other thread, so the profiled code runs unmodified and the overhead depends only on
+the sampling interval. Results are collapsed stacks, the input format of flame graph tools
+such as `FlameGraph <https://github.com/brendangregg/FlameGraph>`_ and speedscope.
+
+Only the process holding the chat connection is profiled. If plugins run in worker processes
+(see :mod:`helga.workers`), the operator command is still run by that process, so it controls
+the same profiler the webhook serves.
+"""
+import collections
+import sys
+import thread
+import threading
+import time
+
+from helga import log, settings
+
+
+logger = log.getLogger(__name__)
+
+#: The number of seconds a profile runs for when no duration is given
+DEFAULT_DURATION = 60
+
+_profiler = None
+
+
+def get_profiler():
+    """
+    Obtains the shared :class:`SamplingProfiler`, creating it on first use with the sampling
+    interval :data:`~helga.settings.PROFILER_INTERVAL`
+    """
+    global _profiler
+
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval=getattr(settings, 'PROFILER_INTERVAL', 0.01))
+
+    return _profiler
+
+
+def collapse_stack(frame, thread_name):
+    """
+    Returns a stack as a semicolon separated string of frames, outermost first and beginning
+    with the thread name, i.e. ``MainThread;run (helga/bin/helga.py:21);...``. Frames are
+    identified by function rather than line, so that samples in the same function combine.
+
+    :param frame: the innermost frame of the stack
+    :param thread_name: the name of the thread running the stack
+    """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+
+    frames.append(thread_name)
+    return ';'.join(reversed(frames))
+
+
+class SamplingProfiler(object):
+    """
+    Counts how often each distinct stack is seen while sampling every thread at a fixed interval.
+    Only one profile runs at a time; starting a new one discards the results of the last.
+    """
+
+    def __init__(self, interval=0.01):
+        """
+        :param interval: the number of seconds between samples
+        """
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.reset()
+
+    def reset(self):
+        """
+        Discard any results
+        """
+        with self.lock:
+            #: The number of times each collapsed stack was sampled
+            self.stacks = collections.Counter()
+
+            #: The number of times every thread was sampled
+            self.samples = 0
+
+            #: The unix time the profile started, or None if never started
+            self.started = None
+
+            #: The unix time the profile stopped, or None if still running or never started
+            self.stopped = None
+
+    @property
+    def running(self):
+        """
+        True if a profile is running
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration=DEFAULT_DURATION):
+        """
+        Start profiling in a background thread, discarding the results of any previous profile
+
+        :param duration: the number of seconds to profile for, or None to run until stopped
+        :returns: False if a profile is already running, otherwise True
+        """
+        if self.running:
+            return False
+
+        self.reset()
+        self.started = time.time()
+        self.stopping.clear()
+
+        logger.info('Starting profiler for %s seconds', duration or 'unlimited')
+        deadline = self.started + duration if duration else None
+        self.thread = threading.Thread(target=self.run, args=(deadline,), name='helga-profiler')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """
+        Stop profiling, waiting for the sampling thread to finish
+
+        :returns: False if no profile was running, otherwise True
+        """
+        if not self.running:
+            return False
+
+        self.stopping.set()
+        self.thread.join()
+        return True
+
+    def run(self, deadline=None):
+        """
+        The sampling thread loop
+
+        :param deadline: the unix time to stop at, or None to run until stopped
+        """
+        try:
+            while not self.stopping.wait(self.interval):
+                if deadline is not None and time.time() >= deadline:
+                    break
+                self.sample()
+        finally:
+            self.stopped = time.time()
+            logger.info('Stopped profiler after %d samples', self.samples)
+
+    def sample(self):
+        """
+        Record the current stack of every thread but the calling one
+        """
+        current = thread.get_ident()
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+
+        stacks = [collapse_stack(frame, names.get(ident, 'Thread-{0}'.format(ident)))
+                  for ident, frame in sys._current_frames().items() if ident != current]
+
+        with self.lock:
+            self.stacks.update(stacks)
+            self.samples += 1
+
+    def collapsed(self):
+        """
+        Returns the results as collapsed stacks: one line for each distinct stack, followed by
+        a space and the number of times it was sampled, most sampled first
+        """
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join('{0} {1}\n'.format(stack, count) for stack, count in stacks)
+
+    def status(self):
+        """
+        Returns a one line description of the running or last profile
+        """
+        if self.started is None:
+            return u'No profile has been recorded'
+
+        if self.running:
+            return u'Profiling, {0} samples over {1:.0f} seconds so far'.format(
+                self.samples, time.time() - self.started)
+
+        return u'Profiled {0} samples over {1:.0f} seconds'.format(
+            self.samples, self.stopped - self.started)
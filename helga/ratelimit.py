@@ -0,0 +1,205 @@
+"""
+Token bucket rate limiting of plugins, per user and per channel. A user repeatedly running an
+expensive command would otherwise make helga run it every time. Limits are checked before a plugin
+processes a message, see :meth:`helga.plugins.Registry.process`, and are configured by
+:data:`~helga.settings.PLUGIN_RATE_LIMITS`.
+"""
+import time
+
+from helga import log, metrics, settings
+from helga.util.encodings import to_unicode
+from helga.util.lru import LRUDict
+
+
+logger = log.getLogger(__name__)
+
+#: The maximum number of token buckets held, beyond which the least recently used are dropped
+BUCKETS_SIZE = 10000
+
+#: The number of seconds between sweeps dropping idle buckets
+PRUNE_INTERVAL = 60
+
+#: The scopes of rate limits, and the setting keys of their budgets
+SCOPES = (('user', 'USER'), ('channel', 'CHANNEL'))
+
+
+class TokenBucket(object):
+    """
+    A bucket holding up to ``capacity`` tokens, refilled at a steady rate so that it is full
+    again ``seconds`` after being emptied. Each use of a plugin takes one token.
+    """
+
+    def __init__(self, capacity, seconds, now):
+        """
+        :param capacity: the maximum number of tokens, i.e. the number of uses allowed in a burst
+        :param seconds: the number of seconds to refill the bucket from empty
+        :param now: the current unix time
+        """
+        self.capacity = float(capacity)
+        self.rate = self.capacity / seconds
+        self.tokens = self.capacity
+        self.updated = now
+
+    def refill(self, now):
+        """
+        Add the tokens accrued since the bucket was last updated
+
+        :param now: the current unix time
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self, now):
+        """
+        Returns True if the bucket would be full at a given time, which makes it no different
+        from a new bucket
+        """
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def wait(self):
+        """
+        Returns the number of seconds until the bucket next has a token, zero if it has one now
+        """
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter(object):
+    """
+    Limits how often each plugin runs for each user on each channel, and for each channel as a
+    whole. Budgets come from :data:`~helga.settings.PLUGIN_RATE_LIMITS`. A plugin is allowed to process
+    a message only if the buckets of the user and channel both have a token, and a token is taken
+    from both when the plugin responds. Buckets are only created when a plugin responds, and are
+    dropped once they have refilled, so memory is held only for users and channels that are being
+    limited, not for every message seen.
+    """
+
+    def __init__(self):
+        # (scope, channel, nick or None, plugin name) -> TokenBucket
+        self.buckets = LRUDict(maxlen=BUCKETS_SIZE)
+
+        # (channel, nick, plugin name) -> the time until which no further cooldown notice is sent
+        self.noticed = LRUDict(maxlen=BUCKETS_SIZE)
+        self.pruned = time.time()
+
+    def budgets(self, plugin):
+        """
+        Returns the configured budgets of a plugin as a dictionary of scope to (count, seconds), with
+        budgets for all plugins under the name '*' used for scopes the plugin does not set
+
+        :param plugin: the name of the plugin
+        """
+        limits = getattr(settings, 'PLUGIN_RATE_LIMITS', None) or {}
+        default = limits.get('*') or {}
+        own = limits.get(plugin) or {}
+
+        budgets = {}
+        for scope, key in SCOPES:
+            budget = own.get(key, default.get(key))
+            if budget:
+                budgets[scope] = budget
+        return budgets
+
+    def get_buckets(self, channel, nick, plugin, now, create=False):
+        """
+        Returns the refilled buckets limiting a plugin for a nick on a channel. Returns an empty
+        list if the plugin is not limited. Missing buckets, which would be full, are only created
+        if ``create`` is True.
+        """
+        budgets = self.budgets(plugin)
+        if not budgets:
+            return []
+
+        buckets = []
+        nick = to_unicode(nick).lower()
+
+        for scope, (count, seconds) in budgets.items():
+            key = (scope, channel, nick if scope == 'user' else None, plugin)
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.refill(now)
+            elif create:
+                bucket = self.buckets[key] = TokenBucket(count, seconds, now)
+            else:
+                continue
+            buckets.append(bucket)
+
+        return buckets
+
+    def allow(self, channel, nick, plugin):
+        """
+        Checks whether a plugin may process a message. If not, the plugin is rate limited, and
+        the number of seconds until it may run again is returned. This only reads the buckets
+        the plugin already has, see :meth:`deny` to record a rate limited invocation.
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param plugin: the name of the plugin
+        :returns: zero if the plugin may run, otherwise the number of seconds to wait
+        """
+        now = time.time()
+        self.prune(now)
+
+        return max([bucket.wait() for bucket in self.get_buckets(channel, nick, plugin, now)] or [0])
+
+    def consume(self, channel, nick, plugin):
+        """
+        Take a token from each bucket limiting a plugin, after it responds to a message
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param plugin: the name of the plugin
+        """
+        for bucket in self.get_buckets(channel, nick, plugin, time.time(), create=True):
+            bucket.tokens = max(0, bucket.tokens - 1)
+
+    def deny(self, channel, nick, plugin, wait):
+        """
+        Records that a user invoked a rate limited plugin, which is counted by the metric
+        :data:`helga.metrics.plugin_rate_limited`. Returns whether a cooldown notice should be
+        sent, see :meth:`notice`.
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param plugin: the name of the plugin
+        :param wait: the number of seconds until the plugin may run again
+        """
+        logger.debug('Rate limiting plugin %s for %s on %s', plugin, nick, channel)
+        metrics.plugin_rate_limited.inc(plugin=plugin)
+        return self.notice(channel, nick, plugin, wait)
+
+    def notice(self, channel, nick, plugin, wait):
+        """
+        Returns whether a cooldown notice should be sent to a rate limited user, which is at most
+        once per cooldown, or never if :data:`~helga.settings.PLUGIN_RATE_LIMIT_NOTICE` is False
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param plugin: the name of the plugin
+        :param wait: the number of seconds until the plugin may run again
+        """
+        if not getattr(settings, 'PLUGIN_RATE_LIMIT_NOTICE', True):
+            return False
+
+        now = time.time()
+        key = (channel, to_unicode(nick).lower(), plugin)
+        if self.noticed.get(key, 0) > now:
+            return False
+
+        self.noticed[key] = now + wait
+        return True
+
+    def prune(self, now):
+        """
+        Drop buckets that have refilled since they were last used, at most every
+        :data:`PRUNE_INTERVAL` seconds
+
+        :param now: the current unix time
+        """
+        if now - self.pruned < PRUNE_INTERVAL:
+            return
+
+        self.pruned = now
+        for key in [key for key, bucket in self.buckets.items() if bucket.full(now)]:
+            del self.buckets[key]
+        for key in [key for key, until in self.noticed.items() if until <= now]:
+            del self.noticed[key]
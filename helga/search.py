@@ -0,0 +1,272 @@
+"""
+Full-text search of channel logs, using an SQLite FTS5 index stored alongside the logs
+"""
+import os
+import re
+import sqlite3
+import threading
+
+from twisted.internet import reactor
+
+from helga import log, settings
+from helga.util.encodings import to_unicode
+
+
+logger = log.getLogger(__name__)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    message,
+    channel UNINDEXED,
+    date UNINDEXED,
+    time UNINDEXED,
+    nick UNINDEXED
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    compressed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+#: The number of messages indexed at a time, between which searches may run
+BATCH_SIZE = 500
+
+#: True in processes that only search the index and leave updating it to another process, such
+#: as plugin worker processes (see :mod:`helga.workers`). The index of such a process is read only.
+read_only = False
+
+_search_index = None
+
+
+def get_search_index():
+    """
+    Obtains the shared :class:`SearchIndex` of channel logs, creating it on first use. The
+    index is stored at :data:`~helga.settings.CHANNEL_LOGGING_SEARCH_DB`, or in
+    :data:`~helga.settings.CHANNEL_LOGGING_DIR` if that is not set. When first created,
+    any logs not yet indexed are indexed in a background thread, unless :data:`read_only`.
+    """
+    global _search_index
+
+    if _search_index is None:
+        path = getattr(settings, 'CHANNEL_LOGGING_SEARCH_DB', None)
+        if not path:
+            path = os.path.join(settings.CHANNEL_LOGGING_DIR, '.search.sqlite3')
+
+        _search_index = SearchIndex(settings.CHANNEL_LOGGING_DIR, path, read_only=read_only)
+        if not read_only:
+            reactor.callInThread(_search_index.backfill)
+
+    return _search_index
+
+
+def line_batches(data, size):
+    """
+    Generator of (lines, size) tuples of successive batches of at least ``size`` lines of
+    channel log text, and their length in bytes. Batches only end before a timestamped
+    line, so a message and its continuation lines are always in the same batch.
+
+    :param data: channel log text of complete lines
+    :param size: the minimum number of lines in each batch but the last
+    """
+    lines, length = [], 0
+
+    for line in data.splitlines(True):
+        if len(lines) >= size and log.LINE_PAT.match(to_unicode(line).rstrip(u'\n')):
+            yield lines, length
+            lines, length = [], 0
+        lines.append(line)
+        length += len(line)
+
+    if lines:
+        yield lines, length
+
+
+def fts_query(terms):
+    """
+    Converts user search terms into an FTS5 query that matches messages containing every
+    term. Double quoted terms are matched as phrases, and no other characters have special
+    meaning.
+
+    :param terms: the search terms, i.e. ``foo "bar baz"``
+    """
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', to_unicode(terms)):
+        term = phrase or word
+        if term.strip():
+            parts.append(u'"{0}"'.format(term.replace(u'"', u'""')))
+    return u' '.join(parts)
+
+
+class SearchIndex(object):
+    """
+    An incremental full-text index of channel log files. The number of bytes indexed
+    from each log file is recorded, so updating the index for a file only reads
+    what has been written to it since. This is safe to use from multiple threads. Updates
+    are made in batches of :data:`BATCH_SIZE` messages, so a search waits at most for one
+    batch to be written rather than for a whole file to be indexed.
+    """
+
+    def __init__(self, log_dir, path, read_only=False):
+        """
+        :param log_dir: the directory containing a directory of daily log files for each channel
+        :param path: the path of the SQLite database file for the index
+        :param read_only: if True, the index is only searched, never created or updated. Only one
+                          process may update an index, since updates are only serialized within
+                          a process.
+        """
+        self.log_dir = log_dir
+        self.path = path
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+
+        if read_only:
+            self.db.execute('PRAGMA query_only = ON')
+        else:
+            self.db.executescript(SCHEMA)
+
+    def update(self, logfile):
+        """
+        Index any complete lines, or binary records, added to a channel log file since it was
+        last indexed. A compressed log file is treated as the same file as the plain text log it
+        replaced, and once indexed is never read again.
+
+        :param logfile: the path to a daily channel log file, either plain text, compressed or binary
+        """
+        if self.read_only:
+            return
+
+        compressed = logfile.endswith('.gz')
+        channel = to_unicode(os.path.basename(os.path.dirname(logfile)))
+        date = to_unicode(log.channel_log_date(os.path.basename(logfile)))
+        key = to_unicode(os.path.abspath(logfile[:-3] if compressed else logfile))
+
+        # Only one update runs at a time, so a file is never indexed twice. Files are read
+        # without holding the database lock, which is only held to write each batch
+        with self.update_lock:
+            with self.lock:
+                row = self.db.execute('SELECT size, compressed FROM files WHERE path = ?', (key,)).fetchone()
+            offset, done = row if row else (0, False)
+
+            if done or (not compressed and os.path.getsize(logfile) <= offset):
+                return
+
+            # Lists of (messages, size indexed once they are written)
+            batches = []
+
+            if logfile.endswith('.log'):
+                with open(logfile, 'rb') as fp:
+                    fp.seek(offset)
+                    records = list(log.read_records(fp))
+
+                if not records:
+                    return
+
+                for i in range(0, len(records), BATCH_SIZE):
+                    batch = records[i:i + BATCH_SIZE]
+                    batches.append((map(log.record_message, batch), batch[-1].offset + batch[-1].size))
+            else:
+                with log.open_channel_log(logfile) as fp:
+                    fp.seek(offset)
+                    data = fp.read()
+
+                # Leave a partial line for next time, it is still being written. Compressed
+                # logs are complete, so they are read in full
+                if not compressed:
+                    data = data[:data.rfind('\n') + 1]
+                    if not data:
+                        return
+
+                for lines, length in line_batches(data, BATCH_SIZE):
+                    offset += length
+                    batches.append((list(log.parse_messages(lines)), offset))
+
+            # A compressed log is still recorded as done when nothing more was read from it
+            batches = batches or [([], offset)]
+
+            for i, (messages, size) in enumerate(batches):
+                with self.lock, self.db:
+                    self.db.executemany(
+                        'INSERT INTO messages (message, channel, date, time, nick) VALUES (?, ?, ?, ?, ?)',
+                        ((m['message'], channel, date, m['time'], m['nick']) for m in messages)
+                    )
+                    self.db.execute('INSERT OR REPLACE INTO files (path, size, compressed) VALUES (?, ?, ?)',
+                                    (key, size, compressed and i == len(batches) - 1))
+
+    def backfill(self):
+        """
+        Index everything not yet indexed from every channel log file
+        """
+        if self.read_only or not os.path.isdir(self.log_dir):
+            return
+
+        for channel in sorted(os.listdir(self.log_dir)):
+            channel_dir = os.path.join(self.log_dir, channel)
+            if not os.path.isdir(channel_dir):
+                continue
+
+            for filename in sorted(os.listdir(channel_dir)):
+                if log.channel_log_date(filename) is None:
+                    continue
+                try:
+                    self.update(os.path.join(channel_dir, filename))
+                except Exception:
+                    logger.exception('Failed to index channel log %s/%s', channel, filename)
+
+    def search(self, terms, channel=None, nick=None, since=None, until=None, limit=20, offset=0,
+               exclude=None):
+        """
+        Search logged messages, most recent first
+
+        :param terms: the search terms, see :func:`fts_query`
+        :param channel: optional channel name to limit results to, with or without a leading '#'
+        :param nick: optional nick to limit results to, ignoring case
+        :param since: optional ``YYYY-MM-DD`` date of the earliest messages to include
+        :param until: optional ``YYYY-MM-DD`` date of the latest messages to include
+        :param limit: the maximum number of results
+        :param offset: the number of results to skip
+        :param exclude: optional list of channel names to exclude, with or without a leading '#'
+        :returns: a list of dictionaries of the message channel, date, time, nick and contents
+        """
+        query = fts_query(terms)
+        if not query:
+            return []
+
+        sql = ['SELECT channel, date, time, nick, message FROM messages WHERE messages MATCH ?']
+        params = [query]
+
+        if channel:
+            sql.append('AND channel IN (?, ?)')
+            channel = to_unicode(channel).lstrip(u'#')
+            params.extend([channel, u'#' + channel])
+        for name in exclude or []:
+            sql.append('AND channel NOT IN (?, ?)')
+            name = to_unicode(name).lstrip(u'#')
+            params.extend([name, u'#' + name])
+        if nick:
+            sql.append('AND lower(nick) = lower(?)')
+            params.append(to_unicode(nick))
+        if since:
+            sql.append('AND date >= ?')
+            params.append(since)
+        if until:
+            sql.append('AND date <= ?')
+            params.append(until)
+
+        sql.append('ORDER BY date DESC, time DESC LIMIT ? OFFSET ?')
+        params.extend([limit, offset])
+
+        with self.lock:
+            try:
+                rows = self.db.execute(' '.join(sql), params).fetchall()
+            except sqlite3.OperationalError:
+                # A read only index may not have been created yet by the updating process
+                if not self.read_only:
+                    raise
+                logger.exception('Failed to search channel log index %s', self.path)
+                rows = []
+
+        keys = ('channel', 'date', 'time', 'nick', 'message')
+        return [dict(zip(keys, row)) for row in rows]
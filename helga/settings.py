@@ -60,6 +60,50 @@ CHANNEL_LOGGING_DIR = '.logs'
 #: browsable channel log web ui.
 CHANNEL_LOGGING_HIDE_CHANNELS = []
 
+#: The number of messages shown per page in the browsable channel log web ui.
+CHANNEL_LOGGING_PAGE_SIZE = 500
+
+#: If :data:`CHANNEL_LOGGING` is enabled, maintain a full-text search index of channel logs. This
+#: enables searching logs with the ``logsearch`` command and the ``/logger/search`` web ui.
+CHANNEL_LOGGING_SEARCH = False
+
+#: The path of the SQLite database file for the channel log search index. If not set, the index
+#: is stored in :data:`CHANNEL_LOGGING_DIR`.
+CHANNEL_LOGGING_SEARCH_DB = None
+
+#: If :data:`CHANNEL_LOGGING` is enabled, the number of log lines per channel to buffer in
+#: memory before writing them to disk. A value of 1 writes every line as it is logged.
+CHANNEL_LOGGING_BUFFER_SIZE = 50
+
+#: If :data:`CHANNEL_LOGGING` is enabled, the maximum number of seconds a log line is buffered
+#: before being written to disk, regardless of :data:`CHANNEL_LOGGING_BUFFER_SIZE`.
+CHANNEL_LOGGING_FLUSH_INTERVAL = 2
+
+#: If :data:`CHANNEL_LOGGING` is enabled, the format of channel log files. Either 'text' for
+#: ``YYYY-MM-DD.txt`` files of ``HH:MM:SS - nick - message`` lines, or 'binary' for ``YYYY-MM-DD.log``
+#: files of length-prefixed records with an offset index, which keeps multi-line messages intact and
+#: allows random access. Binary logs are not compressed, and can be exported to the text format with
+#: :func:`helga.log.export_binary_channel_log`.
+CHANNEL_LOGGING_FORMAT = 'text'
+
+#: If :data:`CHANNEL_LOGGING` is enabled, compress the log file of each day with gzip once the day
+#: is over. Compressed logs are read transparently by the channel log web ui and search index.
+CHANNEL_LOGGING_COMPRESS = False
+
+#: If :data:`CHANNEL_LOGGING` is enabled, write channel logs from a background thread so that a
+#: slow :data:`CHANNEL_LOGGING_DIR` does not stall the bot. Anything still queued is written to disk
+#: when the bot shuts down.
+CHANNEL_LOGGING_BACKGROUND = True
+
+#: If :data:`CHANNEL_LOGGING_BACKGROUND` is enabled, the maximum number of log lines waiting to be
+#: written by the background thread. A value of 0 does not limit the queue.
+CHANNEL_LOGGING_QUEUE_SIZE = 10000
+
+#: If :data:`CHANNEL_LOGGING_BACKGROUND` is enabled, what to do with new log lines when the queue is
+#: full. Either 'block' to wait for room in the queue, which stalls the bot but loses nothing, or 'drop'
+#: to discard them, which are counted by the metric ``helga_channel_log_lines_dropped_total``.
+CHANNEL_LOGGING_QUEUE_OVERFLOW = 'block'
+
 #: The preferred nick of the bot instance. For XMPP clients, this will be used when joining rooms.
 NICK = 'helga'
 
@@ -94,9 +138,65 @@ AUTO_RECONNECT_DELAY = 5
 #: to every message sent to IRC.
 RATE_LIMIT = None
 
+#: A dictionary of token bucket rate limits of plugins, keyed by plugin name, or '*' for limits of every
+#: plugin that has none of its own. Each value is a dictionary with optional keys ``USER``, limiting each
+#: user on each channel, and ``CHANNEL``, limiting each channel as a whole. Each limit is a tuple of
+#: the number of times the plugin may respond in a burst, and the number of seconds to recover from
+#: a full burst. A rate limited plugin does not process messages until it recovers. For example, to
+#: allow any user three ``expensive`` commands per minute, and a channel ten::
+#:
+#:     PLUGIN_RATE_LIMITS = {
+#:         'expensive': {'USER': (3, 60), 'CHANNEL': (10, 60)},
+#:     }
+PLUGIN_RATE_LIMITS = {}
+
+#: A boolean, if True, a user trying a command that is rate limited by :data:`PLUGIN_RATE_LIMITS` is told
+#: how long until they can try again, at most once per cooldown
+PLUGIN_RATE_LIMIT_NOTICE = True
+
 #: A list of chat nicks that should be considered operators/administrators
 OPERATORS = []
 
+#: An integer maximum number of channels, including private conversations, for which the last
+#: message of each user and the recent channel history are tracked by chat clients. The least
+#: recently active channels are forgotten first. None implies no limit, which was the behavior
+#: before this setting was added. Large deployments active on more channels than this, whose
+#: plugins rely on :attr:`~helga.comm.base.BaseClient.last_message`, should raise it.
+LAST_MESSAGE_MAX_CHANNELS = 1000
+
+#: An integer maximum number of users per channel for which the last message is tracked by chat
+#: clients. The least recently active users are forgotten first. None implies no limit, which was
+#: the behavior before this setting was added.
+LAST_MESSAGE_MAX_NICKS = 1000
+
+#: An integer number of seconds after which the tracked last message of a user, or a channel
+#: with no activity, is forgotten. None implies these are never expired.
+LAST_MESSAGE_TTL = None
+
+#: An integer number of recent messages per channel kept in memory by chat clients for use
+#: by plugins (see :meth:`helga.comm.base.BaseClient.recent_messages`). Zero or None disables
+#: keeping channel history.
+CHANNEL_HISTORY_SIZE = 100
+
+#: An integer number of seconds during which a message identical to one the same nick sent on the same
+#: channel, ignoring case and whitespace, is dropped before reaching plugins. This stops bots and bridges
+#: echoing each other from costing a plugin dispatch per echo, but also drops people repeating
+#: themselves, so it is best kept short. Zero or None, the default, disables this.
+MESSAGE_DEDUP_WINDOW = 0
+
+#: A list of nicks of other bots and bridges. A rapid exchange of messages between these and helga is
+#: treated as a bot loop, and messages from them are dropped before reaching plugins until it stops.
+#: See :data:`BOT_LOOP_LENGTH` and :data:`BOT_LOOP_WINDOW`.
+BOT_NICKS = []
+
+#: An integer number of consecutive channel messages, all sent by bots listed in :data:`BOT_NICKS` or by
+#: helga, that are treated as a bot loop. Loops are detected using channel history, see
+#: :data:`CHANNEL_HISTORY_SIZE`. Zero or None disables bot loop detection.
+BOT_LOOP_LENGTH = 6
+
+#: An integer number of seconds within which :data:`BOT_LOOP_LENGTH` bot messages are treated as a bot loop
+BOT_LOOP_WINDOW = 30
+
 #: A dictionary containing connection info for MongoDB. The minimum settings that should
 #: exist here are 'HOST', the MongoDB host, 'PORT, the MongoDB port, and 'DB' which should be the
 #: MongoDB collection to use. These values default to 'localhost', 27017, and 'helga' respectively.
@@ -144,6 +244,10 @@ ENABLED_WEBHOOKS = True
 #: that no webhooks will be made available. See :ref:`webhooks` for more details.
 DISABLED_WEBHOOKS = None
 
+#: The maximum number of responses cached per plugin, for plugins that cache responses
+#: (see :attr:`helga.plugins.Plugin.cache`)
+PLUGIN_CACHE_SIZE = 1000
+
 #: A boolean, if True, the first response received from a plugin will be the only message
 #: sent back to the chat server. If False, all responses are sent.
 PLUGIN_FIRST_RESPONDER_ONLY = True
@@ -167,12 +271,47 @@ COMMAND_ARGS_SHLEX = False
 #: a command 'foo' will respond to 'FOO', 'Foo', 'foo', etc.
 COMMAND_IGNORECASE = False
 
+#: An integer number of worker processes in which plugins should run. If zero or None, plugins
+#: run in the same process as the chat connection. Otherwise, incoming messages are dispatched
+#: to worker processes, sharded by channel so that messages for any one channel are processed
+#: in order. See :mod:`helga.workers` for more information.
+WORKER_PROCESSES = 0
+
+#: If :data:`WORKER_PROCESSES` is set, the number of seconds to wait for a worker to process a
+#: message before giving up on any response. Zero or None waits indefinitely.
+WORKER_TIMEOUT = 30
+
+#: A float number of seconds. Whenever the reactor is blocked for at least this long, so that
+#: nothing else runs, a warning is logged. See :mod:`helga.lag` for more information.
+REACTOR_LAG_THRESHOLD = 0.5
+
+#: A boolean, if True, a watchdog thread captures the stack of the reactor thread while it is blocked
+#: for longer than :data:`REACTOR_LAG_THRESHOLD`, showing which code path caused the stall. This is
+#: included in the warning logged, and by the operator command ``helga operator lag``.
+REACTOR_LAG_STACKS = False
+
+#: A float number of seconds between samples of the profiler started by the operator command
+#: ``helga operator profile``. Shorter intervals give more detail at the cost of more overhead.
+#: See :mod:`helga.profiler` for more information.
+PROFILER_INTERVAL = 0.01
+
 #: The integer port the webhooks plugin should listen for http requests.
 WEBHOOKS_PORT = 8080
 
 #: List of two-tuple username and passwords used for http webhook basic authentication
 WEBHOOKS_CREDENTIALS = []  # Tuples of (user, pass)
 
+#: The number of seconds a webhook route returning a Deferred may take before the request is cancelled
+#: and answered with a 504 response. Zero or None disables the timeout.
+WEBHOOKS_TIMEOUT = 30
+
+#: The maximum number of threads used to run webhook routes declared with ``threaded=True``
+WEBHOOKS_THREAD_POOL_SIZE = 10
+
+#: The number of seconds during which the batch announcements webhook skips a message identical to
+#: one it already announced on the same channel. Zero or None disables this.
+WEBHOOKS_ANNOUNCE_DEDUP_WINDOW = 60
+
 
 def configure(overrides):
     """
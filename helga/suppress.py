@@ -0,0 +1,108 @@
+"""
+Suppression of repeated and bot loop messages before they reach plugins. When two bots or
+bridges echo each other, every echo would otherwise cost a full plugin dispatch, and could
+make helga respond to its own relayed output forever. See :meth:`helga.plugins.Registry.preprocess`.
+"""
+import time
+
+from helga import log, metrics, settings
+from helga.util.encodings import to_unicode
+from helga.util.lru import LRUDict
+
+
+logger = log.getLogger(__name__)
+
+#: The maximum number of recent message fingerprints remembered
+RECENT_MESSAGES_SIZE = 1000
+
+
+def normalize(message):
+    """
+    Returns the text of a message as compared for repeats, ignoring case and whitespace
+
+    :param message: the message contents
+    """
+    return u' '.join(to_unicode(message).lower().split())
+
+
+class MessageSuppressor(object):
+    """
+    Decides which incoming messages are dropped rather than dispatched to plugins. A message is
+    dropped if it is:
+
+    * a ``repeat``: the same normalized text sent by the same nick on the same channel within
+      :data:`~helga.settings.MESSAGE_DEDUP_WINDOW` seconds of the last time it was seen
+    * an ``echo``: sent by a nick that is helga's own
+    * a ``loop``: sent by one of :data:`~helga.settings.BOT_NICKS` when the last
+      :data:`~helga.settings.BOT_LOOP_LENGTH` messages on the channel, including helga's
+      responses, were all sent by bots, by more than one of them, within
+      :data:`~helga.settings.BOT_LOOP_WINDOW` seconds
+
+    Dropped messages are counted by the metric :data:`helga.metrics.messages_suppressed`.
+    """
+
+    def __init__(self):
+        # (channel, nick, normalized message) -> the time it was last seen
+        self.recent = LRUDict(maxlen=RECENT_MESSAGES_SIZE)
+
+    def check(self, client, channel, nick, message):
+        """
+        Checks whether a message should be dropped, and if so counts it
+
+        :param client: an instance of :class:`helga.comm.irc.Client` or :class:`helga.comm.xmpp.Client`
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param message: the message received
+        :returns: the reason to drop the message, 'repeat', 'echo' or 'loop', or None to keep it
+        """
+        reason = self.reason(client, channel, nick, message)
+        if reason is not None:
+            logger.debug('Suppressing %s from %s on %s: %s', reason, nick, channel, message)
+            metrics.messages_suppressed.inc(reason=reason)
+        return reason
+
+    def reason(self, client, channel, nick, message):
+        """
+        Returns the reason to drop a message, or None to keep it. See :meth:`check`
+        """
+        nick = to_unicode(nick).lower()
+        own_nick = to_unicode(getattr(client, 'nickname', None) or u'').lower()
+
+        if own_nick and nick == own_nick:
+            return 'echo'
+
+        now = time.time()
+        window = getattr(settings, 'MESSAGE_DEDUP_WINDOW', 0)
+        if window:
+            key = (channel, nick, normalize(message))
+            last = self.recent.get(key)
+            self.recent[key] = now
+            if last is not None and now - last < window:
+                return 'repeat'
+
+        bots = set(to_unicode(bot).lower() for bot in getattr(settings, 'BOT_NICKS', []))
+        if nick in bots and self.is_loop(client, channel, bots | set([own_nick]), now):
+            return 'loop'
+
+        return None
+
+    def is_loop(self, client, channel, bots, now):
+        """
+        Returns True if the recent messages on a channel are a rapid exchange between bots
+
+        :param client: the chat client, whose channel history is checked
+        :param channel: the channel name
+        :param bots: a set of lower case bot nicks, including helga's own
+        :param now: the current unix time
+        """
+        length = getattr(settings, 'BOT_LOOP_LENGTH', 6)
+        if not length:
+            return False
+
+        records = client.recent_messages(channel, limit=length)
+        if len(records) < length:
+            return False
+
+        nicks = set(to_unicode(record.nick).lower() for record in records)
+        return (nicks <= bots and len(nicks) > 1 and
+                now - records[-1].time <= getattr(settings, 'BOT_LOOP_WINDOW', 30))
@@ -7,6 +7,13 @@ from helga.bin import helga
 
 class TestRun(object):
 
+    def setup_method(self, method):
+        self.lag_patcher = patch('helga.lag.start_lag_monitor')
+        self.start_lag_monitor = self.lag_patcher.start()
+
+    def teardown_method(self, method):
+        self.lag_patcher.stop()
+
     def test_tcp(self):
         server = {
             'HOST': 'localhost',
@@ -24,6 +31,7 @@ class TestRun(object):
                 helga.smokesignal.emit.assert_called_with('started')
                 helga.reactor.connectTCP.assert_called_with('localhost', 6667, factory)
                 assert helga.reactor.run.called
+                self.start_lag_monitor.assert_called_with(clock=helga.reactor)
 
     def test_ssl(self):
         server = {
@@ -47,6 +55,18 @@ class TestRun(object):
                 helga.reactor.connectSSL.assert_called_with('localhost', 6667, factory, ssl)
                 assert helga.reactor.run.called
 
+    def test_starts_workers(self):
+        server = {
+            'HOST': 'localhost',
+            'PORT': 6667,
+        }
+
+        with patch.multiple(helga, smokesignal=Mock(), _get_backend=Mock(), reactor=Mock()):
+            with patch.multiple(helga.settings, SERVER=server, WORKER_PROCESSES=3):
+                with patch('helga.workers.start') as start:
+                    helga.run()
+                    start.assert_called_with(3)
+
 
 class TestMain(object):
 
@@ -67,3 +87,20 @@ class TestMain(object):
                 helga.main()
                 helga.settings.configure.assert_called_with('bar')
                 assert helga.run.called
+
+    def test_bench(self):
+        sys.argv = ['helga', 'bench', '--settings', 'bar', '--messages', '50', '--plugins', 'ping']
+        bench = Mock()
+        bench.main.return_value = 0
+
+        with patch.multiple(helga, run=Mock(), settings=Mock(), sys=Mock(argv=sys.argv)):
+            with patch.dict('sys.modules', {'helga.bench': bench}):
+                with patch('helga.bench', bench, create=True):
+                    helga.main()
+
+            helga.settings.configure.assert_called_with('bar')
+            assert helga.settings.LOG_LEVEL == 'WARNING'
+            assert not helga.run.called
+            args = bench.main.call_args[0][0]
+            assert (args.messages, args.plugins) == (50, 'ping')
+            helga.sys.exit.assert_called_with(0)
@@ -0,0 +1,61 @@
+from mock import patch
+
+from helga.comm.base import BaseClient
+
+
+@patch.multiple('helga.comm.base.settings', LAST_MESSAGE_MAX_CHANNELS=50, LAST_MESSAGE_MAX_NICKS=20,
+                LAST_MESSAGE_TTL=None)
+def test_last_message_stays_bounded():
+    client = BaseClient()
+
+    # Roughly a month of traffic: 2000 channels and private conversations, 10000 users
+    for i in xrange(100000):
+        channel = '#channel{0}'.format((i * 7) % 2000)
+        nick = 'user{0}'.format((i * 13) % 10000)
+        client.last_message[channel][nick] = 'message {0}'.format(i)
+
+    assert len(client.last_message) == 50
+    assert all(len(nicks) <= 20 for nicks in client.last_message.values())
+
+    # The most recent message is always kept
+    channel, nick = '#channel{0}'.format((99999 * 7) % 2000), 'user{0}'.format((99999 * 13) % 10000)
+    assert client.last_message[channel][nick] == 'message 99999'
+
+
+class TestHistory(object):
+
+    def setup(self):
+        self.client = BaseClient()
+
+    def test_recent_messages_newest_first(self):
+        for i in range(3):
+            self.client.record_message('#foo', 'bar', 'message {0}'.format(i))
+
+        records = self.client.recent_messages('#foo')
+        assert [r.message for r in records] == ['message 2', 'message 1', 'message 0']
+        assert all(r.nick == 'bar' for r in records)
+
+    def test_recent_messages_by_nick_with_limit(self):
+        self.client.record_message('#foo', 'bar', 'one')
+        self.client.record_message('#foo', 'baz', 'two')
+        self.client.record_message('#foo', 'bar', 'three')
+
+        records = self.client.recent_messages('#foo', nick='bar', limit=1)
+        assert [r.message for r in records] == ['three']
+
+    def test_recent_messages_unknown_channel(self):
+        assert self.client.recent_messages('#foo') == []
+        assert '#foo' not in self.client.history
+
+    @patch('helga.comm.base.settings')
+    def test_history_is_fixed_size(self, settings):
+        settings.CHANNEL_HISTORY_SIZE = 2
+        for i in range(5):
+            self.client.record_message('#foo', 'bar', str(i))
+        assert [r.message for r in self.client.recent_messages('#foo')] == ['4', '3']
+
+    @patch('helga.comm.base.settings')
+    def test_history_disabled(self, settings):
+        settings.CHANNEL_HISTORY_SIZE = 0
+        self.client.record_message('#foo', 'bar', 'baz')
+        assert self.client.recent_messages('#foo') == []
@@ -25,6 +25,14 @@ class FactoryTestCase(TestCase):
         self.factory.clientConnectionLost(connector, Exception)
         reactor.callLater.assert_called_with(1, connector.connect)
 
+    @patch('helga.comm.irc.settings')
+    @patch('helga.comm.irc.reactor')
+    @patch('helga.comm.irc.metrics')
+    def test_client_connection_lost_counts_reconnect(self, metrics, reactor, settings):
+        settings.AUTO_RECONNECT = True
+        self.factory.clientConnectionLost(Mock(), Exception)
+        metrics.reconnects.inc.assert_called_with(backend='irc')
+
     @patch('helga.comm.irc.settings')
     def test_client_connection_lost_raises(self, settings):
         settings.AUTO_RECONNECT = False
@@ -138,6 +146,67 @@ class ClientTestCase(TestCase):
 
         assert self.client.msg.call_args[0][0] == 'foo'
 
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_suppressed_keeps_last_message(self, registry):
+        self.client.msg = Mock()
+        self.client.last_message['#bots']['foo'] = 'earlier'
+        registry.preprocess.return_value = ('#bots', 'foo', None)
+        registry.process.return_value = []
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+
+        assert self.client.last_message['#bots']['foo'] == 'earlier'
+        assert not self.client.msg.called
+
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_records_history(self, registry):
+        self.client.msg = Mock()
+        registry.process.return_value = ['response']
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+
+        records = self.client.recent_messages('#bots')
+        assert [(r.nick, r.message) for r in records] == [
+            (self.client.nickname, 'response'),
+            ('foo', 'this is the input'),
+        ]
+
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_records_history_after_processing(self, registry):
+        self.client.msg = Mock()
+        self.client.record_message('#bots', 'foo', 'earlier')
+        seen = []
+        registry.process.side_effect = lambda client, channel, user, message: (
+            seen.extend(r.message for r in client.recent_messages(channel)) or [])
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+
+        assert seen == ['earlier']
+        assert [r.message for r in self.client.recent_messages('#bots')] == ['this is the input', 'earlier']
+
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_suppressed_not_recorded(self, registry):
+        self.client.msg = Mock()
+        registry.preprocess.return_value = ('#bots', 'foo', None)
+        registry.process.return_value = []
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+
+        assert self.client.recent_messages('#bots') == []
+
+    @patch('helga.comm.irc.metrics')
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_counts_messages(self, registry, metrics):
+        self.client.nickname = 'helga'
+        registry.process.return_value = []
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+        metrics.messages_received.inc.assert_called_with(backend='irc', channel=metrics.channel_label.return_value)
+        metrics.channel_label.assert_called_with('#bots', True)
+
+        self.client.privmsg('foo!~bar@baz', 'helga', 'this is the input')
+        metrics.channel_label.assert_called_with('foo', False)
+
     @patch('helga.comm.irc.registry')
     def test_action(self, registry):
         self.client.msg = Mock()
@@ -268,3 +337,20 @@ class ClientTestCase(TestCase):
             self.client.log_channel_message('foo', 'bar', 'baz')
             self.client.get_channel_logger.assert_called_with('foo')
             logger.info.assert_called_with('baz', extra={'nick': 'bar'})
+
+    @patch('helga.comm.irc.registry')
+    def test_privmsg_dispatches_to_workers(self, registry):
+        self.client.msg = Mock()
+        self.client.workers = Mock()
+        d = self.client.workers.dispatch.return_value
+
+        self.client.privmsg('foo!~bar@baz', '#bots', 'this is the input')
+
+        self.client.workers.dispatch.assert_called_with('#bots', 'foo', 'this is the input',
+                                                        self.client.nickname)
+        assert not registry.process.called
+
+        # Simulate the worker response
+        respond = d.addCallback.call_args[0][0]
+        respond(('#bots', 'foo', 'this is the input', ['line1', 'line2']))
+        self.client.msg.assert_called_with('#bots', 'line1\nline2')
@@ -5,6 +5,7 @@ import pytest
 from mock import patch
 
 from helga.comm import slack
+from helga.plugins import Plugin
 
 
 @pytest.fixture(scope='module', autouse=True)
@@ -53,3 +54,15 @@ class TestClient(object):
             assert '@alfredo test <reply> & more' == result
             mock_get_user.assert_called_with('U1234ABC')
 
+
+    def test_is_public_channel(self, client):
+        assert client.is_public_channel(u'#general')
+
+        # Direct messages have no channel name
+        assert not client.is_public_channel(u'')
+
+    def test_filters_direct_messages(self, client):
+        assert Plugin(private_only=True).accepts(client, u'', u'me', u'foo')
+        assert not Plugin(public_only=True).accepts(client, u'', u'me', u'foo')
+        assert Plugin(public_only=True).accepts(client, u'#general', u'me', u'foo')
+        assert not Plugin(private_only=True).accepts(client, u'#general', u'me', u'foo')
@@ -19,6 +19,7 @@ from helga.plugins import (Command,
                            match,
                            preprocessor,
                            registry)
+from helga.ratelimit import RateLimiter
 
 
 class TestRegistry(object):
@@ -185,6 +186,93 @@ class TestRegistry(object):
             assert things[1].process.called
             assert not things[2].process.called
 
+    def test_process_records_plugin_time(self):
+        plugin = Mock()
+        plugin.process.return_value = 'foo'
+        registry.registered_names[plugin] = 'myplugin'
+
+        with patch.object(registry, 'prioritized') as prio:
+            with patch('helga.plugins.metrics') as metrics:
+                prio.return_value = [plugin]
+                assert [u'foo'] == registry.process(None, '#bots', 'me', 'foobar')
+                metrics.plugin_seconds.time.assert_called_with(plugin='myplugin')
+
+        del registry.registered_names[plugin]
+
+    def test_process_excludes_filtered_plugins(self):
+        public = Command('foo', public_only=True)
+        public.run = Mock(return_value='public')
+        private = Command('foo', private_only=True)
+        private.run = Mock(return_value='private')
+        client = Mock(nickname='helga')
+        client.is_public_channel.side_effect = lambda channel: channel.startswith('#')
+
+        with patch.object(registry, 'prioritized', return_value=[public, private]):
+            with patch.object(settings, 'PLUGIN_FIRST_RESPONDER_ONLY', False):
+                assert registry.process(client, '#bots', 'me', '!foo') == [u'public']
+                assert registry.process(client, 'me', 'me', '!foo') == [u'private']
+
+    def test_filter_errors_exclude_only_that_plugin(self):
+        broken = Command('foo', channels=[None])
+        broken.run = Mock(return_value='broken')
+        working = Command('foo')
+        working.run = Mock(return_value='working')
+
+        with patch.object(registry, 'prioritized', return_value=[broken, working]):
+            with patch.object(settings, 'PLUGIN_FIRST_RESPONDER_ONLY', False):
+                assert registry.process(Mock(nickname='helga'), '#bots', 'me', '!foo') == [u'working']
+                with patch.object(registry, 'suppressor') as suppressor:
+                    suppressor.check.return_value = None
+                    assert registry.preprocess(None, '#bots', 'me', 'foo') == ('#bots', 'me', 'foo')
+        assert not broken.run.called
+
+    def test_preprocess_excludes_filtered_plugins(self):
+        @preprocessor(ignore_nicks=['*bot'])
+        def upper(client, channel, nick, message):
+            return channel, nick, message.upper()
+
+        with patch.object(registry, 'prioritized', return_value=upper._plugins):
+            with patch.object(registry, 'suppressor') as suppressor:
+                suppressor.check.return_value = None
+                assert registry.preprocess(None, '#bots', 'me', 'foo') == ('#bots', 'me', 'FOO')
+                assert registry.preprocess(None, '#bots', 'relaybot', 'foo') == ('#bots', 'relaybot', 'foo')
+
+    def test_process_rate_limited(self):
+        cmd = Command('expensive')
+        cmd.run = Mock(return_value='done')
+        other = Mock()
+        other.process.return_value = 'other'
+        registry.registered_names.update({cmd: 'expensive', other: 'other'})
+        client = Mock(nickname='helga')
+        limits = {'expensive': {'USER': (2, 60)}}
+
+        with patch.object(registry, 'prioritized', return_value=[cmd, other]):
+            with patch.object(registry, 'limiter', RateLimiter()), patch('helga.ratelimit.metrics') as metrics:
+                with patch.multiple(settings, create=True, PLUGIN_RATE_LIMITS=limits,
+                                    PLUGIN_RATE_LIMIT_NOTICE=True, PLUGIN_FIRST_RESPONDER_ONLY=False):
+                    # Messages not handled by the plugin do not use its budget
+                    assert registry.process(client, '#bots', 'me', 'chatter') == [u'other']
+                    assert len(registry.limiter.buckets) == 0
+
+                    for _ in range(2):
+                        assert registry.process(client, '#bots', 'me', '!expensive') == [u'done', u'other']
+
+                    # Limited plugins are skipped, with one notice per cooldown
+                    assert registry.process(client, '#bots', 'me', '!expensive') == [
+                        u'me, slow down! Try expensive again in 30 seconds', u'other']
+                    assert registry.process(client, '#bots', 'me', '!expensive') == [u'other']
+                    assert cmd.run.call_count == 2
+
+                    # Only rate limited invocations are counted
+                    assert registry.process(client, '#bots', 'me', 'chatter') == [u'other']
+                    assert metrics.plugin_rate_limited.inc.call_count == 2
+
+                    # Other users are not limited
+                    assert registry.process(client, '#bots', 'you', '!expensive') == [u'done', u'other']
+
+        del registry.registered_names[cmd]
+        del registry.registered_names[other]
+
     def test_process_async_honors_all_responses(self):
         things = [Mock(), Mock(), Mock()]
 
@@ -280,6 +368,23 @@ class TestRegistry(object):
             registry.register(repr(plugin), plugin)
             assert repr(plugin) in registry.plugins
 
+    def test_register_clears_previous_cache(self):
+        previous = Command('foo', cache=60)
+        previous.responses[('#bots', 'key')] = (0, 'cached')
+        registry.register('foo', previous)
+        registry.register('foo', Command('foo'))
+        assert len(previous.responses) == 0
+
+    def test_register_forgets_previous_names(self):
+        @command('foo')
+        def previous(client, channel, nick, message, cmd, args):
+            pass
+
+        registry.register('foo', previous)
+        registry.register('foo', Command('foo'))
+        assert not any(plugin in registry.registered_names for plugin in previous._plugins)
+        assert registry.registered_names[registry.plugins['foo']] == 'foo'
+
     def test_register_plugin_handles_unicode(self):
         for plugin in self.invalid_plugins:
             with pytest.raises(TypeError):
@@ -482,12 +587,84 @@ class TestRegistry(object):
             # Exception raising preprocess should have at least been called
             assert plugins[1].preprocess.called
 
+    def test_preprocess_suppressed(self):
+        plugin = Mock()
+
+        with patch.object(registry, 'prioritized', return_value=[plugin]):
+            with patch.object(registry, 'suppressor') as suppressor:
+                suppressor.check.return_value = 'repeat'
+                assert registry.preprocess(None, '#bots', 'me', 'foo') == ('#bots', 'me', None)
+                suppressor.check.assert_called_with(None, '#bots', 'me', 'foo')
+                assert not plugin.preprocess.called
+
+                # Suppressed messages are not dispatched
+                assert registry.process(None, '#bots', 'me', None) == []
+                assert not plugin.process.called
+
 
 class TestPlugin(object):
 
     def setup(self):
         self.plugin = Plugin()
         self.client = Mock(nickname='helga')
+        self.client.is_public_channel.side_effect = lambda channel: channel.startswith('#')
+
+    def test_accepts_without_filters(self):
+        assert self.plugin.accepts(self.client, '#bots', 'me', 'foo')
+        assert self.plugin.accepts(self.client, 'me', 'me', '')
+
+    def test_accepts_channels(self):
+        plugin = Plugin(channels=['#dev-*', '#Bots'])
+        assert plugin.accepts(self.client, '#dev-helga', 'me', 'foo')
+        assert plugin.accepts(self.client, '#bots', 'me', 'foo')
+        assert not plugin.accepts(self.client, '#other', 'me', 'foo')
+        assert not plugin.accepts(self.client, 'me', 'me', 'foo')
+
+    def test_accepts_private_and_public_only(self):
+        assert Plugin(private_only=True).accepts(self.client, 'me', 'me', 'foo')
+        assert not Plugin(private_only=True).accepts(self.client, '#bots', 'me', 'foo')
+        assert Plugin(public_only=True).accepts(self.client, '#bots', 'me', 'foo')
+        assert not Plugin(public_only=True).accepts(self.client, 'me', 'me', 'foo')
+
+    def test_accepts_single_pattern_strings(self):
+        plugin = Plugin(channels='#dev', nicks='admin*', ignore_nicks='adminbot')
+        assert plugin.channels == ['#dev']
+        assert plugin.accepts(self.client, '#dev', 'admin1', 'foo')
+        assert not plugin.accepts(self.client, '#d', 'admin1', 'foo')
+        assert not plugin.accepts(self.client, '#dev', 'adminbot', 'foo')
+
+    def test_accepts_nicks(self):
+        plugin = Plugin(nicks=['admin*', u'☃'], ignore_nicks=['adminbot'])
+        assert plugin.accepts(self.client, '#bots', 'Admin1', 'foo')
+        assert plugin.accepts(self.client, '#bots', u'☃', 'foo')
+        assert not plugin.accepts(self.client, '#bots', 'me', 'foo')
+        assert not plugin.accepts(self.client, '#bots', 'adminbot', 'foo')
+
+    def test_accepts_min_length(self):
+        plugin = Plugin(min_length=4)
+        assert plugin.accepts(self.client, '#bots', 'me', 'food')
+        assert not plugin.accepts(self.client, '#bots', 'me', '  foo  ')
+
+    def test_filters_do_not_overwrite_class_attributes(self):
+        class MyPlugin(Plugin):
+            channels = ['#bots']
+            public_only = True
+
+        plugin = MyPlugin()
+        assert plugin.channels == ['#bots']
+        assert plugin.public_only
+
+    def test_decorators_accept_filters(self):
+        @command('foo', channels=['#bots'])
+        @match('foo', min_length=10)
+        def foo(*args):
+            pass
+
+        assert foo._plugins[0].min_length == 10
+        assert foo._plugins[1].channels == ['#bots']
+
+        with pytest.raises(TypeError):
+            command('foo', not_a_filter=True)
 
     def test_preprocessor_decorator(self):
         @preprocessor
@@ -501,6 +678,7 @@ class TestPlugin(object):
         assert len(foo._plugins) == 1
         assert expected == foo(*args)
         assert expected == foo._plugins[0].preprocess(*args)
+        assert foo._plugins[0].accepts(*args)
 
     def test_preprocess_with_priority(self):
         @preprocessor(10)
@@ -604,6 +782,45 @@ class TestCommand(object):
             settings.COMMAND_ARGS_SHLEX = False
             assert self.cmd._parse_argstr(argstr) == expected
 
+    def test_invoked(self):
+        assert self.cmd.invoked('helga', 'helga foo bar')
+        assert self.cmd.invoked('helga', '!baz')
+        assert not self.cmd.invoked('helga', 'helga qux')
+
+    def test_process_caches_responses(self):
+        self.cmd.cache = 60
+        self.cmd.run = Mock(return_value='run')
+
+        with patch('helga.plugins.time') as time:
+            time.time.return_value = 100
+            assert self.cmd.process(self.client, '#bots', 'me', 'helga foo 1') == 'run'
+            assert self.cmd.process(self.client, '#bots', 'you', 'helga   foo 1') == 'run'
+            assert self.cmd.run.call_count == 1
+
+            # Cached per channel and arguments
+            self.cmd.process(self.client, '#other', 'me', 'helga foo 1')
+            self.cmd.process(self.client, '#bots', 'me', 'helga foo 2')
+            assert self.cmd.run.call_count == 3
+
+            # Until the cache expires
+            time.time.return_value = 160
+            self.cmd.process(self.client, '#bots', 'me', 'helga foo 1')
+            assert self.cmd.run.call_count == 4
+
+    def test_process_does_not_cache_empty_responses(self):
+        self.cmd.cache = 60
+        self.cmd.run = Mock(return_value=None)
+        self.cmd.process(self.client, '#bots', 'me', 'helga foo')
+        self.cmd.process(self.client, '#bots', 'me', 'helga foo')
+        assert self.cmd.run.call_count == 2
+
+    def test_process_does_not_cache_by_default(self):
+        self.cmd.run = Mock(return_value='run')
+        self.cmd.process(self.client, '#bots', 'me', 'helga foo')
+        self.cmd.process(self.client, '#bots', 'me', 'helga foo')
+        assert self.cmd.run.call_count == 2
+        assert getattr(self.cmd, '_responses', None) is None
+
     def test_process_for_different_command_returns_none(self):
         assert self.cmd.process(self.client, '#bots', 'me', 'helga qux') is None
 
@@ -706,6 +923,21 @@ class TestMatch(object):
             return 'snowman'
         assert 'snowman' == snowman_match._plugins[0](self.client, '#bots', 'me', u'☃')
 
+    def test_process_caches_responses_by_matches(self):
+        run = Mock(return_value='bar')
+
+        @match(r'([A-Z]+-\d+)', cache=60)
+        def issues(*args):
+            return run(*args)
+
+        plugin = issues._plugins[0]
+        assert plugin(self.client, '#bots', 'me', 'see FOO-1') == 'bar'
+        assert plugin(self.client, '#bots', 'you', 'FOO-1 again') == 'bar'
+        assert run.call_count == 1
+
+        plugin(self.client, '#bots', 'me', 'see FOO-2')
+        assert run.call_count == 2
+
 
 def test_custom_plugin_priorities(tmpdir):
     file = tmpdir.join('foo.py')
@@ -194,3 +194,58 @@ def test_format_help_string():
 
     assert unistr == help.format_help_string(u'☃', 'snowman', u'☃')
     assert string == help.format_help_string('foo', 'just foo', 'bar')
+
+
+@patch('helga.plugins.help.registry')
+def test_help_index_is_cached(plugins):
+    foo_fn = stub(_plugins=[stub(help='foo plugin')])
+
+    client = Mock()
+    plugins.generation = 1
+    plugins.enabled_plugins = {'#bots': set(['foo']), '#other': set(['foo'])}
+    plugins.plugins = {'foo': foo_fn}
+
+    assert help.help(client, '#bots', 'me', 'help', 'help', ['foo']) == '[foo] foo plugin'
+    assert help.help(client, '#other', 'me', 'help', 'help', ['foo']) == '[foo] foo plugin'
+    assert help.get_index('#bots') is help.get_index('#other')
+
+    # Rebuilt when the plugin is reloaded
+    foo_fn._plugins = [stub(help='new foo plugin')]
+    assert help.help(client, '#bots', 'me', 'help', 'help', ['foo']) == '[foo] foo plugin'
+    plugins.generation = 2
+    assert help.help(client, '#bots', 'me', 'help', 'help', ['foo']) == '[foo] new foo plugin'
+
+    # Or when plugins are enabled or disabled
+    plugins.plugins['bar'] = stub(help='bar plugin')
+    plugins.enabled_plugins['#bots'] = set(['foo', 'bar'])
+    assert help.help(client, '#bots', 'me', 'help', 'help', ['bar']) == '[bar] bar plugin'
+
+
+@patch('helga.plugins.help.PAGE_SIZE', 2)
+@patch('helga.plugins.help.registry')
+def test_help_is_paginated(plugins):
+    names = ['a', 'b', 'c', 'd', 'e']
+    client = Mock()
+    plugins.enabled_plugins = {'#bots': names}
+    plugins.plugins = dict((name, stub(help='{0} plugin'.format(name))) for name in names)
+
+    help.help(client, '#bots', 'me', 'help', 'help', [])
+    _, message = client.msg.call_args[0]
+    assert message.split('\n') == [
+        'me, here are the plugins I know about',
+        '[a] a plugin',
+        '[b] b plugin',
+        'Page 1 of 3. For more, use: helga help 2',
+    ]
+
+    help.help(client, '#bots', 'me', 'help', 'help', ['3'])
+    _, message = client.msg.call_args[0]
+    assert message.split('\n') == [
+        'me, here are the plugins I know about',
+        '[e] e plugin',
+        'Page 3 of 3',
+    ]
+
+    client.reset_mock()
+    assert help.help(client, '#bots', 'me', 'help', 'help', ['4']) == 'Sorry me, there are only 3 pages of help'
+    assert not client.msg.called
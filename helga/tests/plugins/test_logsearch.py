@@ -0,0 +1,44 @@
+from mock import DEFAULT, patch
+
+from helga.plugins import logsearch
+
+
+class TestLogSearch(object):
+
+    def setup(self):
+        patcher = patch.multiple('helga.plugins.logsearch', settings=DEFAULT, get_search_index=DEFAULT)
+        self.mocks = patcher.start()
+        self.patcher = patcher
+        self.mocks['settings'].CHANNEL_LOGGING = True
+        self.mocks['settings'].CHANNEL_LOGGING_SEARCH = True
+        self.index = self.mocks['get_search_index'].return_value
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def test_not_enabled(self):
+        self.mocks['settings'].CHANNEL_LOGGING_SEARCH = False
+        assert logsearch.logsearch(None, '#foo', 'me', '', 'logsearch', ['foo']) == \
+            'Channel log search is not enabled'
+
+    def test_usage(self):
+        assert logsearch.logsearch(None, '#foo', 'me', '', 'logsearch', ['nick:bob']).startswith('Usage')
+
+    def test_search(self):
+        self.index.search.return_value = [{
+            'channel': u'#foo',
+            'date': u'2014-12-01',
+            'time': u'10:00:00',
+            'nick': u'bob',
+            'message': u'the deploy\nfailed',
+        }]
+
+        assert logsearch.logsearch(None, '#foo', 'me', '', 'logsearch', [u'nick:bob', u'"deploy', u'failed"']) == [
+            u'[2014-12-01 10:00:00] <bob> the deploy failed',
+        ]
+        self.index.search.assert_called_with(u'"deploy failed"', channel='#foo', nick=u'bob',
+                                             limit=logsearch.RESULT_LIMIT)
+
+    def test_no_results(self):
+        self.index.search.return_value = []
+        assert logsearch.logsearch(None, '#foo', 'me', '', 'logsearch', [u'foo']) == u'No results for foo'
@@ -112,3 +112,40 @@ def test_reload_plugin_handles_unicode(plugins):
 
     plugins.reload.return_value = False
     assert u"Failed to reload plugin '{0}'".format(snowman) == operator.reload_plugin(snowman)
+
+
+@patch('helga.plugins.operator.lag')
+def test_operator_lag(lag):
+    client = Mock(operators=['me'])
+    lag.get_lag_monitor.return_value.summary.return_value = 'Reactor lag'
+    assert 'Reactor lag' == operator.operator(client, '#bots', 'me', 'message', 'op', ['lag'])
+
+    lag.get_lag_monitor.return_value = None
+    assert 'not being monitored' in operator.operator(client, '#bots', 'me', 'message', 'op', ['lag'])
+
+
+@patch('helga.plugins.operator.profiler')
+def test_operator_profile(profiler):
+    client = Mock(operators=['me'])
+    profiler.DEFAULT_DURATION = 60
+    sampler = profiler.get_profiler.return_value
+    sampler.status.return_value = 'Profiled'
+
+    def op(*args):
+        return operator.operator(client, '#bots', 'me', 'message', 'op', ['profile'] + list(args))
+
+    assert 'Profiling for 60 seconds' in op('start')
+    sampler.start.assert_called_with(60)
+    assert 'Profiling for 30 seconds' in op('start', '30')
+    sampler.start.assert_called_with(30)
+    assert 'until stopped' in op('start', '0')
+    sampler.start.assert_called_with(None)
+    assert op('start', 'foo').startswith('Usage')
+
+    sampler.start.return_value = False
+    assert op('start') == 'A profile is already running'
+
+    assert op('stop') == 'Profiled'
+    assert op() == 'Profiled'
+    sampler.stop.return_value = False
+    assert op('stop') == 'No profile is running'
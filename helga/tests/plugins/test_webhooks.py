@@ -4,7 +4,9 @@ import pytest
 from mock import Mock, patch, call
 
 from helga.plugins import webhooks
+from twisted.internet import defer, task
 from twisted.web import server
+from twisted.web.test.requesthelper import DummyRequest
 
 
 @patch('helga.plugins.webhooks.registry')
@@ -318,6 +320,14 @@ class TestWebhookRoot(object):
         mock_fn.assert_called_with(request, self.root.chat_client)
         request.setHeader.assert_called_with('Server', 'helga')
 
+    @patch('helga.plugins.webhooks.metrics')
+    def test_render_records_latency(self, metrics):
+        request = Mock(path='/path/to/resource', method='GET')
+        self.root.routes['/path/to/resource'] = (['GET'], Mock(return_value='foo'))
+
+        self.root.render(request)
+        assert metrics.webhook_seconds.observe.call_args[1] == {'route': '/path/to/resource'}
+
     def test_reunder_handles_http_error(self):
         mock_fn = Mock(side_effect=webhooks.HttpError(404, 'foo not found'))
         request = Mock(path='/path/to/resource', method='GET')
@@ -332,3 +342,145 @@ class TestWebhookRoot(object):
         path = '/path/to/resource'
         self.root.add_route(fn, path, methods)
         assert self.root.routes[path] == (methods, fn)
+
+    def test_render_uses_most_specific_route(self):
+        channel_fn = Mock(return_value='channel')
+        search_fn = Mock(return_value='search')
+        self.root.routes[r'/logger/(?P<channel>\w+)/?$'] = (['GET'], channel_fn)
+        self.root.routes[r'/logger/search/?$'] = (['GET'], search_fn)
+
+        assert 'search' == self.root.render(Mock(path='/logger/search', method='GET'))
+
+        request = Mock(path='/logger/searches', method='GET')
+        assert 'channel' == self.root.render(request)
+        channel_fn.assert_called_with(request, self.root.chat_client, channel='searches')
+
+
+
+class TestWebhookRootDeferred(object):
+
+    def setup(self):
+        self.root = webhooks.WebhookRoot()
+        self.request = DummyRequest(['foo'])
+        self.request.path = '/foo'
+        self.deferred = defer.Deferred()
+        self.root.routes['/foo'] = (['GET'], Mock(return_value=self.deferred))
+
+    def render(self, clock=None):
+        with patch.multiple(webhooks, reactor=clock or task.Clock(), settings=Mock(WEBHOOKS_TIMEOUT=10)):
+            return self.root.render(self.request)
+
+    def test_writes_result(self):
+        assert self.render() == server.NOT_DONE_YET
+        assert not self.request.finished
+
+        self.deferred.callback(u'☃')
+        assert self.request.written == [u'☃'.encode('utf-8')]
+        assert self.request.finished
+
+    def test_http_error(self):
+        self.render()
+        self.deferred.errback(webhooks.HttpError(404, 'foo not found'))
+
+        assert self.request.responseCode == 404
+        assert self.request.written == ['foo not found']
+
+    def test_unhandled_error(self):
+        self.render()
+        self.deferred.errback(ValueError('boom'))
+
+        assert self.request.responseCode == 500
+        assert self.request.finished
+
+    def test_timeout(self):
+        clock = task.Clock()
+        self.render(clock)
+        clock.advance(10)
+
+        assert self.request.responseCode == 504
+        assert self.request.written == ['504 Gateway Timeout']
+        assert self.request.finished
+
+    def test_result_cancels_timeout(self):
+        clock = task.Clock()
+        self.render(clock)
+        self.deferred.callback('foo')
+
+        assert clock.getDelayedCalls() == []
+
+    def test_disconnect_cancels(self):
+        cancelled = []
+        self.deferred = defer.Deferred(cancelled.append)
+        self.root.routes['/foo'] = (['GET'], Mock(return_value=self.deferred))
+
+        self.render()
+        self.request.processingFailed(Exception('connection lost'))
+
+        assert cancelled == [self.deferred]
+        assert self.request.written == []
+
+
+@patch('helga.plugins.webhooks.registry')
+@patch('helga.plugins.webhooks.get_thread_pool')
+@patch('helga.plugins.webhooks.threads')
+def test_route_threaded(threads, get_thread_pool, reg):
+    reg.get_plugin.return_value = reg
+    fake_fn = lambda request, client, **kwargs: 'foo'
+    assert webhooks.route('/foo', threaded=True)(fake_fn) is fake_fn
+
+    handler = reg.add_route.call_args[0][0]
+    assert handler('request', 'client', bar='baz') is threads.deferToThreadPool.return_value
+    threads.deferToThreadPool.assert_called_with(webhooks.reactor, get_thread_pool.return_value,
+                                                 fake_fn, 'request', 'client', bar='baz')
+
+
+@pytest.mark.parametrize('pattern,prefix', [
+    ('/path/to/resource', '/path/to/resource'),
+    (r'^/logger/?$', '/logger'),
+    (r'/logger/(?P<channel>[\w\-_]+)/?$', '/logger/'),
+    (r'/foo\.bar+', '/foo.ba'),
+    (r'/foo|/bar', '/'),
+    (r'(?i)/foo', ''),
+    (r'.*', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert webhooks.literal_prefix(pattern) == prefix
+
+
+class TestRouteTable(object):
+
+    def setup(self):
+        self.table = webhooks.RouteTable()
+
+    def test_match_order(self):
+        self.table[r'/foo/.*'] = 'foo'
+        self.table[r'/.*'] = 'any'
+        self.table[r'/foo/bar$'] = 'bar'
+        self.table[r'/foo/(?P<name>\w+)$'] = 'name'
+
+        assert self.table.match('/foo/bar')[0] == 'bar'
+        assert self.table.match('/foo/baz')[0] == 'foo'
+        assert self.table.match('/qux')[0] == 'any'
+
+    def test_match_none(self):
+        self.table[r'/foo$'] = 'foo'
+        assert self.table.match('/bar') is None
+        assert self.table.match('/foobar') is None
+
+    def test_replace_and_delete(self):
+        self.table[r'/foo$'] = 'foo'
+        self.table[r'/foo$'] = 'bar'
+        assert self.table.match('/foo')[0] == 'bar'
+        assert len(self.table) == 1
+
+        del self.table[r'/foo$']
+        assert self.table.match('/foo') is None
+        assert list(self.table) == []
+
+    def test_candidates_independent_of_route_count(self):
+        for i in range(1000):
+            self.table[r'/hook{0}/(?P<id>\d+)$'.format(i)] = i
+
+        candidates = self.table.candidates('/hook42/7')
+        assert [pattern for pattern, _ in candidates] == [r'/hook42/(?P<id>\d+)$']
+        assert self.table.match('/hook42/7')[1].groupdict() == {'id': '7'}
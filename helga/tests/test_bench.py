@@ -0,0 +1,125 @@
+# -*- coding: utf8 -*-
+import json
+
+from mock import Mock, patch
+
+from helga import bench, log, settings
+
+
+def test_synthetic_traffic_is_repeatable():
+    traffic = bench.synthetic_traffic(500, channels=[u'#a', u'#b'], seed=1)
+    assert traffic == bench.synthetic_traffic(500, channels=[u'#a', u'#b'], seed=1)
+    assert traffic != bench.synthetic_traffic(500, channels=[u'#a', u'#b'], seed=2)
+    assert len(traffic) == 500
+
+    channels = set(channel for channel, _, _ in traffic)
+    assert channels == set([u'#a', u'#b', None])
+    assert any(message.startswith(settings.NICK) for _, _, message in traffic)
+
+
+def test_recorded_traffic(tmpdir):
+    logfile = tmpdir.mkdir('#bots').join('2016-01-01.txt')
+    logfile.write('10:00:00 - alice - hello\n'
+                  '10:00:01 - bob - {0} ping\n'
+                  '10:00:02 - {0} - pong\n'.format(settings.NICK))
+
+    assert bench.recorded_traffic([str(logfile)]) == [
+        ('#bots', 'alice', 'hello'),
+        ('#bots', 'bob', '{0} ping'.format(settings.NICK)),
+    ]
+
+
+def test_recorded_traffic_binary(tmpdir):
+    channel_dir = tmpdir.mkdir('#bots')
+    with open(str(channel_dir.join('2016-01-01.log')), 'wb') as fp:
+        fp.write(log.BINARY_RECORD.pack(1451642400, 5, 2) + 'alicehi')
+
+    assert bench.recorded_traffic([str(channel_dir.join('2016-01-01.log'))]) == [
+        ('#bots', u'alice', u'hi'),
+    ]
+
+
+@patch('helga.comm.irc.registry')
+def test_bench_client_runs_pipeline(registry):
+    registry.preprocess.side_effect = lambda client, channel, nick, message: (channel, nick, message)
+    registry.process.return_value = [u'pong ☃']
+
+    client = bench.BenchClient()
+    client.replay(u'#bots', u'alice', u'helga ping')
+    client.replay(None, u'bob', u'helga ping')
+
+    registry.process.assert_any_call(client, '#bots', 'alice', 'helga ping')
+    registry.process.assert_any_call(client, 'bob', 'bob', 'helga ping')
+    assert client.responses == 2
+    assert client.transport.value() == ''
+
+
+@patch('helga.bench.registry')
+def test_load_plugins(registry):
+    registry.all_plugins = set(['ping'])
+    bench.load_plugins(['ping', 'missing'])
+
+    assert registry.whitelist_plugins == set(['ping', 'missing'])
+    assert registry.enabled_plugins['#any'] == frozenset(['ping', 'missing'])
+    assert registry.load.called
+
+
+@patch('helga.bench.settings')
+@patch('helga.bench.load_plugins')
+@patch('helga.bench.registry')
+@patch('helga.comm.irc.registry')
+def test_run(irc_registry, registry, load_plugins, settings):
+    settings.NICK = 'helga'
+    registry.all_plugins = set(['ping', 'other'])
+    plugin = Mock(cache=60)
+    registry.registered_names = {plugin: 'ping'}
+    irc_registry.preprocess.side_effect = lambda client, channel, nick, message: (channel, nick, message)
+    irc_registry.process.side_effect = lambda client, channel, nick, message: ['pong'] if 'ping' in message else []
+
+    traffic = [(u'#bots', u'alice', u'helga ping'), (u'#bots', u'bob', u'hello')] * 5
+    results = bench.run(traffic, plugins=['ping'], warmup=2)
+
+    load_plugins.assert_called_with(['ping'])
+    assert settings.CHANNEL_LOGGING is False
+    assert not settings.MESSAGE_DEDUP_WINDOW
+    assert not settings.BOT_LOOP_LENGTH
+    assert settings.PLUGIN_RATE_LIMITS == {}
+    assert plugin.cache is None
+    assert results['messages'] == 10
+    assert results['responses'] == 5
+    assert results['plugins'] == ['ping']
+    assert results['messages_per_second'] > 0
+    assert 0 <= results['latency_p50_ms'] <= results['latency_p99_ms'] <= results['latency_max_ms']
+    assert results['allocations_per_message'] >= 0
+    json.dumps(results)
+
+
+def test_compare():
+    baseline = {'messages_per_second': 1000, 'latency_p50_ms': 1.0, 'latency_p99_ms': 2.0}
+    results = {'messages_per_second': 950, 'latency_p50_ms': 1.5, 'latency_p99_ms': 1.0,
+               'allocations_per_message': 3.0}
+
+    lines, regressions = bench.compare(baseline, results, tolerance=10)
+    assert regressions == ['latency_p50_ms']
+    assert len(lines) == 3
+    assert lines[1].endswith('REGRESSION')
+
+    assert bench.compare(baseline, results, tolerance=60)[1] == []
+
+
+@patch('helga.bench.run')
+def test_main_compares_with_baseline(run, tmpdir):
+    run.return_value = {'messages_per_second': 500}
+    baseline, output = tmpdir.join('baseline.json'), tmpdir.join('output.json')
+    baseline.write(json.dumps({'messages_per_second': 1000}))
+
+    args = Mock(logs=[], messages=10, seed=0, plugins='ping, help,', warmup=0,
+                output=str(output), compare=str(baseline), tolerance=10)
+    assert bench.main(args) == 1
+    assert run.call_args[1]['plugins'] == ['ping', 'help']
+    assert json.loads(output.read()) == {'messages_per_second': 500}
+
+    args.compare = None
+    args.plugins = None
+    assert bench.main(args) == 0
+    assert run.call_args[1]['plugins'] is None
@@ -0,0 +1,141 @@
+import json
+import sys
+
+import pytest
+
+from mock import Mock, patch
+
+from helga import benchmarks
+
+
+benchmarks.load()
+
+
+@pytest.mark.parametrize('name', list(benchmarks.BENCHMARKS))
+def test_benchmark_runs(name):
+    # Every benchmark should set up, run and clean up without error
+    setup = benchmarks.BENCHMARKS[name]()
+    if hasattr(setup, 'next'):
+        next(setup)()
+        setup.close()
+    else:
+        setup()
+
+
+@pytest.mark.parametrize('name', list(benchmarks.MEMORY_BENCHMARKS))
+def test_memory_benchmark_runs(name):
+    with patch.multiple('helga.benchmarks.comm', DAYS=3, MESSAGES_PER_DAY=100):
+        samples = benchmarks.MEMORY_BENCHMARKS[name]()
+    assert len(samples) == 3
+    assert all(size > 0 for size in samples)
+
+
+def test_last_message_memory_is_bounded():
+    from helga.benchmarks import comm
+
+    with patch.multiple(comm, DAYS=6, MESSAGES_PER_DAY=200):
+        with patch.multiple(comm.settings, LAST_MESSAGE_MAX_CHANNELS=10, LAST_MESSAGE_MAX_NICKS=10):
+            samples = comm.last_message_month()
+
+    # Once the limits are reached, the size stops growing with the number of days
+    assert samples[-1] < samples[-3] * 1.1
+
+
+def test_deep_size():
+    small, large = {'a': [1, 2]}, {'a': [1, 2], 'b': range(1000)}
+    assert 0 < benchmarks.deep_size(small) < benchmarks.deep_size(large)
+
+    # Shared objects such as functions are not counted
+    assert benchmarks.deep_size([test_deep_size]) == sys.getsizeof([test_deep_size])
+
+
+def test_measure_memory():
+    result = benchmarks.measure_memory(lambda: [10, 30, 20])
+    assert result['first_bytes'] == 10
+    assert result['last_bytes'] == 20
+    assert result['peak_bytes'] == 30
+    assert result['samples'] == 3
+    assert 'rss_growth_bytes' in result
+
+
+def test_load_registers_all_modules():
+    modules = set(name.split('.')[0] for name in benchmarks.BENCHMARKS)
+    assert modules == set(benchmarks.MODULES)
+
+
+def test_measure():
+    fn = Mock()
+    result = benchmarks.measure(fn, warmup=0.01, repeat=3, min_time=0.001)
+
+    assert result['repeat'] == 3
+    assert result['number'] >= 1
+    assert 0 < result['best_ns'] <= result['median_ns']
+    assert fn.call_count > 3 * result['number']
+
+
+def test_run_benchmark_cleans_up_generator():
+    cleaned_up = []
+
+    def bench():
+        try:
+            yield lambda: None
+        finally:
+            cleaned_up.append(True)
+
+    benchmarks.run_benchmark(bench, warmup=0, repeat=1, min_time=0)
+    assert cleaned_up == [True]
+
+
+@patch.object(benchmarks, 'BENCHMARKS', {'a.foo': lambda: lambda: None, 'b.bar': lambda: lambda: None})
+def test_run_filters():
+    report = benchmarks.run(r'^a\.', warmup=0, repeat=1, min_time=0)
+    assert list(report['benchmarks']) == ['a.foo']
+    assert report['helga_version']
+
+
+def test_percentile():
+    assert benchmarks.percentile([], 50) is None
+    assert benchmarks.percentile([1, 2, 3, 4], 50) == 3
+    assert benchmarks.percentile([1, 2, 3, 4], 99) == 4
+
+
+def test_compare_value():
+    assert benchmarks.compare_value(100, 120, tolerance=10) == (20.0, True)
+    assert benchmarks.compare_value(100, 105, tolerance=10) == (5.0, False)
+    assert benchmarks.compare_value(100, 80, tolerance=10, higher_is_better=True) == (-20.0, True)
+    assert benchmarks.compare_value(100, 120, tolerance=10, higher_is_better=True) == (20.0, False)
+
+
+def test_compare():
+    baseline = {'benchmarks': {'a': {'median_ns': 100}, 'b': {'median_ns': 100}}}
+    report = {'benchmarks': {'a': {'median_ns': 120}, 'b': {'median_ns': 105}, 'c': {'median_ns': 1}}}
+
+    lines, regressions = benchmarks.compare(baseline, report, tolerance=10)
+    assert regressions == ['a']
+    assert lines[0].endswith('REGRESSION')
+    assert len(lines) == 3
+
+    assert benchmarks.compare({}, report)[1] == []
+
+
+def test_compare_memory():
+    baseline = {'benchmarks': {'a': {'peak_bytes': 1000}}}
+    report = {'benchmarks': {'a': {'peak_bytes': 1200}}}
+
+    lines, regressions = benchmarks.compare(baseline, report, tolerance=10)
+    assert regressions == ['a']
+    assert ' B ' in lines[0]
+
+
+@patch.multiple(benchmarks, settings=Mock(), load=Mock(), run=Mock())
+def test_main(tmpdir):
+    benchmarks.run.return_value = {'benchmarks': {'a': {'median_ns': 150}}}
+    output, baseline = tmpdir.join('output.json'), tmpdir.join('baseline.json')
+    baseline.write(json.dumps({'benchmarks': {'a': {'median_ns': 100}}}))
+
+    assert benchmarks.main(['--filter', 'a', '--repeat', '2', '--output', str(output)]) == 0
+    assert benchmarks.run.call_args == (('a',), {'warmup': 0.1, 'repeat': 2, 'min_time': 0.1})
+    assert json.loads(output.read()) == benchmarks.run.return_value
+
+    assert benchmarks.main(['--compare', str(baseline)]) == 1
+    assert benchmarks.main(['--compare', str(baseline), '--tolerance', '60']) == 0
@@ -54,3 +54,15 @@ def test_connect(settings, mongo):
 
     assert db.connect() == (mongo, database)
     mongo.__getitem__.assert_called_with('baz')
+
+
+@patch('helga.db.metrics')
+def test_command_metrics_listener(metrics):
+    listener = db.CommandMetricsListener()
+
+    listener.succeeded(Mock(duration_micros=1500, command_name='find'))
+    metrics.db_command_seconds.observe.assert_called_with(0.0015, command='find')
+
+    listener.failed(Mock(duration_micros=2000, command_name='insert'))
+    metrics.db_command_seconds.observe.assert_called_with(0.002, command='insert')
+    metrics.db_command_failures.inc.assert_called_with(command='insert')
@@ -0,0 +1,135 @@
+# -*- coding: utf8 -*-
+import thread
+import threading
+
+from mock import Mock, patch
+from twisted.internet import task
+
+from helga import lag
+
+
+class TestLagMonitor(object):
+
+    def setup(self):
+        self.clock = task.Clock()
+        self.monitor = lag.LagMonitor(interval=1, threshold=0.5, clock=self.clock)
+
+    @patch('helga.lag.logger')
+    def test_records_window_and_stalls(self, logger):
+        self.monitor.start()
+        self.clock.advance(1)
+        self.clock.advance(1.25)
+        assert list(self.monitor.window) == [0, 0.25]
+        assert not self.monitor.stalls
+        assert not logger.warning.called
+
+        # A blocked reactor
+        self.clock.advance(2.5)
+        assert list(self.monitor.window) == [0, 0.25, 1.75]
+        assert self.monitor.stalls[-1].lag == 1.75
+        assert self.monitor.stalls[-1].stack is None
+        logger.warning.assert_called_with('Reactor blocked for %.3f seconds', 1.75)
+
+        self.monitor.stop()
+        assert not self.monitor.loop.running
+
+    def test_percentile(self):
+        assert self.monitor.percentile(50) is None
+        self.monitor.window.extend([0.4, 0.1, 0.3, 0.2, 5.0])
+        assert self.monitor.percentile(0) == 0.1
+        assert self.monitor.percentile(50) == 0.3
+        assert self.monitor.percentile(99) == 5.0
+        assert self.monitor.percentile(100) == 5.0
+
+    def test_histogram(self):
+        self.monitor.window.extend([0.001, 0.02, 0.2, 3.0])
+        assert self.monitor.histogram(buckets=(0.01, 0.1, 1.0)) == [
+            (0.01, 1), (0.1, 2), (1.0, 3), (float('inf'), 4),
+        ]
+
+    def test_summary(self):
+        assert self.monitor.summary() == 'No reactor lag samples yet'
+
+        self.monitor.window.extend([0.001, 0.002, 0.003])
+        assert self.monitor.summary() == ('Reactor lag over the last 3 seconds: '
+                                          'p50 2ms, p99 3ms, max 3ms')
+
+    @patch('helga.lag.logger')
+    def test_summary_includes_last_stall(self, logger):
+        self.monitor.stack = [('helga/plugins/foo.py', 12, 'fetch', 'urlopen(url)'),
+                              ('helga/plugins/__init__.py', 330, 'process', 'fn()')]
+
+        with patch('helga.lag.time.time', return_value=1456833891):
+            self.monitor.record(2.14)
+
+        assert self.monitor.stack is None
+        assert self.monitor.summary() == (
+            'Reactor lag over the last 1 seconds: p50 2140ms, p99 2140ms, max 2140ms. '
+            'Last stall of 2.14s at 2016-03-01 12:04:51 UTC in '
+            'helga/plugins/__init__.py:330 in process < helga/plugins/foo.py:12 in fetch'
+        )
+        assert 'urlopen(url)' in logger.warning.call_args[0][2]
+
+    def test_check_captures_reactor_stack_once(self):
+        self.monitor.reactor_thread = thread.get_ident()
+        self.monitor.heartbeat = 100
+
+        # Not yet overdue by the threshold
+        self.monitor.check(101.4)
+        assert self.monitor.stack is None
+
+        self.monitor.check(101.6)
+        stack = self.monitor.stack
+        assert 'test_check_captures_reactor_stack_once' in [name for _, _, name, _ in stack]
+
+        self.monitor.check(102)
+        assert self.monitor.stack is stack
+
+    def test_check_captures_another_thread(self):
+        blocked, release = threading.Event(), threading.Event()
+
+        def block_reactor():
+            blocked.set()
+            release.wait()
+
+        reactor_thread = threading.Thread(target=block_reactor)
+        reactor_thread.start()
+        blocked.wait()
+
+        try:
+            self.monitor.reactor_thread = reactor_thread.ident
+            self.monitor.heartbeat = 100
+            self.monitor.check(102)
+        finally:
+            release.set()
+            reactor_thread.join()
+
+        assert 'block_reactor' in [name for _, _, name, _ in self.monitor.stack]
+
+    def test_start_with_capture_stacks_runs_watchdog(self):
+        self.monitor.capture_stacks = True
+        self.monitor.start()
+        assert self.monitor.watchdog.daemon
+        assert self.monitor.watchdog.is_alive()
+
+        self.monitor.stop()
+        self.monitor.watchdog.join(1)
+        assert not self.monitor.watchdog.is_alive()
+
+
+@patch.multiple(lag, _lag_monitor=None, settings=Mock(REACTOR_LAG_THRESHOLD=2, REACTOR_LAG_STACKS=False))
+def test_start_lag_monitor():
+    clock = task.Clock()
+    clock.addSystemEventTrigger = Mock()
+    monitor = lag.start_lag_monitor(clock=clock)
+
+    assert lag.get_lag_monitor() is monitor
+    assert lag.start_lag_monitor(clock=clock) is monitor
+    assert monitor.threshold == 2
+    assert monitor.loop.running
+    clock.addSystemEventTrigger.assert_called_once_with('before', 'shutdown', monitor.stop)
+
+
+def test_format_stack():
+    stack = [('a.py', 1, 'one', ''), ('b.py', 2, 'two', ''), ('c.py', 3, 'three', '')]
+    assert lag.format_stack(stack, limit=2) == 'c.py:3 in three < b.py:2 in two'
@@ -1,12 +1,16 @@
+# -*- coding: utf8 -*-
 import datetime
+import logging
+import os
 import re
+import StringIO
 
 import freezegun
 import pytest
 
 from mock import patch, Mock
 
-from helga import log
+from helga import log, metrics
 
 
 @patch('helga.log.logging')
@@ -75,10 +79,11 @@ def test_get_logger_uses_custom_formatter(settings, logging):
     logging.Formatter.assert_called_with(settings.LOG_FORMAT)
 
 
+@patch('helga.log.get_channel_log_catalog')
 @patch('helga.log.os')
 @patch('helga.log.logging')
 @patch('helga.log.settings')
-def test_get_channel_logger(settings, logging, os):
+def test_get_channel_logger(settings, logging, os, get_catalog):
     logger = Mock()
     handler = Mock()
     formatter = Mock()
@@ -88,6 +93,11 @@ def test_get_channel_logger(settings, logging, os):
 
     settings.CHANNEL_LOGGING_DIR = '/path/to/channels'
     settings.CHANNEL_LOGGING_DB = False
+    settings.CHANNEL_LOGGING_BUFFER_SIZE = 10
+    settings.CHANNEL_LOGGING_FLUSH_INTERVAL = 5
+    settings.CHANNEL_LOGGING_BACKGROUND = False
+    settings.CHANNEL_LOGGING_COMPRESS = False
+    settings.CHANNEL_LOGGING_SEARCH = False
     os.path.exists.return_value = True
     os.path.join = os_join
 
@@ -105,7 +115,10 @@ def test_get_channel_logger(settings, logging, os):
         assert logger.propagate is False
 
         # Sets the handler correctly
-        log.ChannelLogFileHandler.assert_called_with('/path/to/channels/#foo')
+        log.ChannelLogFileHandler.assert_called_with('/path/to/channels/#foo',
+                                                       buffer_size=10, flush_interval=5,
+                                                       writer=None, search_index=None, compress=False,
+                                                       catalog=get_catalog.return_value)
         handler.setFormatter.assert_called_with(formatter)
 
         # Sets the formatter correctly
@@ -115,15 +128,18 @@ def test_get_channel_logger(settings, logging, os):
         logger.addHandler.assert_called_with(handler)
 
 
+@patch('helga.log.get_channel_log_catalog')
 @patch('helga.log.os')
 @patch('helga.log.logging')
 @patch('helga.log.settings')
-def test_get_channel_logger_creates_log_dirs(settings, logging, os):
+def test_get_channel_logger_creates_log_dirs(settings, logging, os, get_catalog):
     def os_join(*args):
         return '/'.join(args)
 
     settings.CHANNEL_LOGGING_DIR = '/path/to/channels'
     settings.CHANNEL_LOGGING_DB = False
+    settings.CHANNEL_LOGGING_BACKGROUND = False
+    settings.CHANNEL_LOGGING_SEARCH = False
     os.path.exists.return_value = False
     os.path.join = os_join
 
@@ -132,6 +148,54 @@ def test_get_channel_logger_creates_log_dirs(settings, logging, os):
     os.makedirs.assert_called_with('/path/to/channels/#foo')
 
 
+@patch('helga.log.get_channel_log_catalog')
+@patch('helga.log.os')
+@patch('helga.log.settings')
+@patch('helga.log.get_channel_log_writer')
+def test_get_channel_logger_uses_background_writer(get_writer, settings, os, get_catalog):
+    settings.CHANNEL_LOGGING_DIR = '/path/to/channels'
+    settings.CHANNEL_LOGGING_BACKGROUND = True
+    settings.CHANNEL_LOGGING_SEARCH = False
+    settings.CHANNEL_LOGGING_COMPRESS = False
+    os.path.exists.return_value = True
+
+    with patch.object(log, 'ChannelLogFileHandler'):
+        log.get_channel_logger('#bar')
+        assert log.ChannelLogFileHandler.call_args[1]['writer'] is get_writer.return_value
+
+
+@patch('helga.log.get_channel_log_catalog')
+@patch('helga.log.os')
+@patch('helga.log.settings')
+@patch('helga.search.get_search_index')
+def test_get_channel_logger_uses_search_index(get_search_index, settings, os, get_catalog):
+    settings.CHANNEL_LOGGING_DIR = '/path/to/channels'
+    settings.CHANNEL_LOGGING_BACKGROUND = False
+    settings.CHANNEL_LOGGING_SEARCH = True
+    settings.CHANNEL_LOGGING_COMPRESS = False
+    os.path.exists.return_value = True
+
+    with patch.object(log, 'ChannelLogFileHandler'):
+        log.get_channel_logger('#baz')
+        assert log.ChannelLogFileHandler.call_args[1]['search_index'] is get_search_index.return_value
+
+
+@patch('helga.log.get_channel_log_catalog')
+@patch('helga.log.os')
+@patch('helga.log.settings')
+def test_get_channel_logger_binary_format(settings, os, get_catalog):
+    settings.CHANNEL_LOGGING_DIR = '/path/to/channels'
+    settings.CHANNEL_LOGGING_BACKGROUND = False
+    settings.CHANNEL_LOGGING_SEARCH = False
+    settings.CHANNEL_LOGGING_COMPRESS = True
+    settings.CHANNEL_LOGGING_FORMAT = 'binary'
+    os.path.exists.return_value = True
+
+    with patch.object(log, 'BinaryChannelLogFileHandler'):
+        log.get_channel_logger('#qux')
+        assert log.BinaryChannelLogFileHandler.call_args[1]['compress'] is False
+
+
 class TestChannelLogFileHandler(object):
 
     def setup(self):
@@ -181,6 +245,155 @@ class TestChannelLogFileHandler(object):
                 assert self.handler.next_rollover == expected_rollover
 
 
+    def test_do_rollover_flushes_buffer(self):
+        stream = Mock()
+        self.handler.stream = stream
+        self.handler.buffer = [u'12:00:00 - foo - bar']
+
+        with patch.object(self.handler, '_open'):
+            self.handler.doRollover()
+
+        stream.write.assert_called_with('12:00:00 - foo - bar\n')
+        assert self.handler.buffer == []
+
+
+    @patch('helga.log.reactor')
+    def test_do_rollover_compresses_previous(self, reactor, tmpdir):
+        handler = log.ChannelLogFileHandler(str(tmpdir), compress=True)
+        previous = handler.baseFilename
+
+        with freezegun.freeze_time(datetime.datetime.utcnow() + datetime.timedelta(days=1)):
+            handler.doRollover()
+
+        reactor.callFromThread.assert_called_with(reactor.callInThread, log.compress_channel_log, previous)
+        handler.close()
+
+
+class TestChannelLogFileHandlerBuffering(object):
+
+    def setup(self):
+        self.record = logging.LogRecord('foo', logging.INFO, None, None, u'☃', None, None)
+
+    def make_handler(self, tmpdir, **kwargs):
+        handler = log.ChannelLogFileHandler(str(tmpdir), **kwargs)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def read(self, handler):
+        with open(handler.baseFilename) as fp:
+            return fp.read()
+
+    def test_unbuffered_writes_immediately(self, tmpdir):
+        handler = self.make_handler(tmpdir)
+        handler.emit(self.record)
+        assert self.read(handler) == u'☃\n'.encode('utf-8')
+
+    @patch('helga.log.reactor')
+    def test_writes_when_buffer_full(self, reactor, tmpdir):
+        handler = self.make_handler(tmpdir, buffer_size=3, flush_interval=10)
+        handler.emit(self.record)
+        handler.emit(self.record)
+
+        assert handler.buffer == [u'☃', u'☃']
+        assert not os.path.exists(handler.baseFilename) or self.read(handler) == ''
+        reactor.callLater.assert_called_once_with(10, handler.flush)
+
+        handler.emit(self.record)
+
+        assert handler.buffer == []
+        assert self.read(handler) == u'☃\n☃\n☃\n'.encode('utf-8')
+        assert reactor.callLater.return_value.cancel.called
+
+    @patch('helga.log.reactor')
+    def test_flush_updates_search_index_in_thread(self, reactor, tmpdir):
+        handler = self.make_handler(tmpdir)
+        handler.search_index = Mock()
+        handler.emit(self.record)
+        assert not handler.search_index.update.called
+        reactor.callInThread.assert_called_once_with(handler.update_search_index,
+                                                     handler.baseFilename)
+
+    def test_update_search_index(self, tmpdir):
+        handler = self.make_handler(tmpdir)
+        handler.search_index = Mock()
+        handler.search_index.update.side_effect = Exception
+        handler.update_search_index(handler.baseFilename)
+        handler.search_index.update.assert_called_with(handler.baseFilename)
+
+    @patch('helga.log.reactor')
+    def test_close_flushes(self, reactor, tmpdir):
+        handler = self.make_handler(tmpdir, buffer_size=3, flush_interval=10)
+        handler.emit(self.record)
+        handler.close()
+        assert self.read(handler) == u'☃\n'.encode('utf-8')
+
+
+class TestChannelLogWriter(object):
+
+    def setup(self):
+        self.record = logging.LogRecord('foo', logging.INFO, None, None, u'☃', None, None)
+
+    def make_handler(self, tmpdir, writer):
+        handler = log.ChannelLogFileHandler(str(tmpdir), buffer_size=100, flush_interval=60, writer=writer)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        return handler
+
+    def test_invalid_overflow(self):
+        with pytest.raises(ValueError):
+            log.ChannelLogWriter(overflow='explode')
+
+    def test_emit_queues_line(self, tmpdir):
+        writer = log.ChannelLogWriter()
+        handler = self.make_handler(tmpdir, writer)
+        handler.emit(self.record)
+
+        assert writer.queue.get_nowait() == (handler, self.record.created, u'☃')
+        assert handler.buffer == []
+
+    def test_drops_when_full(self, tmpdir):
+        dropped = metrics.channel_log_lines_dropped.get()
+        writer = log.ChannelLogWriter(maxsize=1, overflow='drop')
+        handler = self.make_handler(tmpdir, writer)
+        handler.emit(self.record)
+        handler.emit(self.record)
+
+        assert writer.queue.qsize() == 1
+        assert writer.dropped == 1
+        assert metrics.channel_log_lines_dropped.get() == dropped + 1
+
+    def test_stop_writes_queued_lines(self, tmpdir):
+        writer = log.ChannelLogWriter(flush_interval=60)
+        handler = self.make_handler(tmpdir, writer)
+        writer.start()
+
+        for i in range(3):
+            handler.emit(self.record)
+        writer.stop(timeout=5)
+
+        assert not writer.is_alive()
+        with open(handler.baseFilename) as fp:
+            assert fp.read() == u'☃\n☃\n☃\n'.encode('utf-8')
+
+    def test_writer_updates_search_index(self, tmpdir):
+        writer = log.ChannelLogWriter(flush_interval=60)
+        handler = self.make_handler(tmpdir, writer)
+        handler.search_index = Mock()
+        writer.start()
+
+        handler.emit(self.record)
+        writer.stop(timeout=5)
+
+        handler.search_index.update.assert_called_with(handler.baseFilename)
+
+    def test_write_uses_record_time_for_rollover(self, tmpdir):
+        handler = self.make_handler(tmpdir, None)
+        with patch.object(handler, 'doRollover'):
+            handler.write(u'late', handler._next_rollover_ts - 1)
+            assert not handler.doRollover.called
+            handler.write(u'early', handler._next_rollover_ts)
+            assert handler.doRollover.called
+
+
 def test_utc_time_filter():
     record = Mock()
     filter = log.UTCTimeLogFilter()
@@ -189,3 +402,180 @@ def test_utc_time_filter():
         filter.filter(record)
         assert record.utcnow == date
         assert record.utctime == '08:15:00'
+
+
+def test_utc_time_filter_caches_per_second():
+    filter = log.UTCTimeLogFilter()
+    first, second, third = Mock(), Mock(), Mock()
+
+    with freezegun.freeze_time('2014-10-31 08:15:00.100'):
+        filter.filter(first)
+    with freezegun.freeze_time('2014-10-31 08:15:00.900'):
+        filter.filter(second)
+    with freezegun.freeze_time('2014-10-31 08:15:01'):
+        filter.filter(third)
+
+    assert first.utctime is second.utctime
+    assert third.utctime == '08:15:01'
+
+
+def test_parse_messages():
+    lines = [
+        'no time here',
+        '00:00:00 - foo - this - has - delimiters',
+        '...and more',
+        u'12:01:35 - bar - ☃'.encode('utf-8'),
+    ]
+
+    assert list(log.parse_messages(lines)) == [
+        {'time': '', 'nick': '', 'message': 'no time here'},
+        {'time': '00:00:00', 'nick': 'foo', 'message': 'this - has - delimiters\n...and more'},
+        {'time': '12:01:35', 'nick': 'bar', 'message': u'☃'},
+    ]
+
+
+def test_channel_log_date():
+    assert log.channel_log_date('2014-12-01.txt') == '2014-12-01'
+    assert log.channel_log_date('2014-12-01.txt.gz') == '2014-12-01'
+    assert log.channel_log_date('2014-12-01.txt.gz.tmp') is None
+    assert log.channel_log_date('.search.sqlite3') is None
+
+
+class TestChannelLogCatalog(object):
+
+    def test_load(self, tmpdir):
+        for name in ('2014-12-01.txt', '2014-11-30.txt.gz', '2014-12-02.log', '2014-12-02.idx'):
+            tmpdir.join('#foo', name).ensure()
+        tmpdir.join('#bar', '2014-12-01.txt').ensure()
+        tmpdir.join('.search.sqlite3').ensure()
+
+        catalog = log.ChannelLogCatalog(str(tmpdir))
+        catalog.load()
+
+        assert catalog.channels() == ['#bar', '#foo']
+        assert catalog.dates('#foo') == ['2014-12-02', '2014-12-01', '2014-11-30']
+        assert catalog.dates('#baz') is None
+
+    def test_load_missing_dir(self, tmpdir):
+        catalog = log.ChannelLogCatalog(str(tmpdir.join('missing')))
+        catalog.load()
+        assert catalog.channels() == []
+
+    def test_add(self):
+        catalog = log.ChannelLogCatalog('/path/to/logs')
+        catalog.add('#foo', '2014-12-01')
+        catalog.add('#foo', '2014-12-03')
+        catalog.add('#foo', '2014-12-02')
+        catalog.add('#foo', '2014-12-02')
+
+        assert catalog.dates('#foo') == ['2014-12-03', '2014-12-02', '2014-12-01']
+
+    def test_handler_adds_log_files(self, tmpdir):
+        catalog = log.ChannelLogCatalog(str(tmpdir))
+        basedir = str(tmpdir.join('#foo').ensure(dir=True))
+
+        with freezegun.freeze_time('2014-12-01 23:59'):
+            handler = log.ChannelLogFileHandler(basedir, catalog=catalog)
+        assert catalog.dates('#foo') == ['2014-12-01']
+
+        with freezegun.freeze_time('2014-12-02 00:01'):
+            handler.doRollover()
+        assert catalog.dates('#foo') == ['2014-12-02', '2014-12-01']
+
+
+def test_compress_channel_log(tmpdir):
+    path = tmpdir.join('2014-12-01.txt')
+    path.write('00:00:00 - foo - bar\n')
+
+    log.compress_channel_log(str(path))
+
+    assert tmpdir.listdir() == [tmpdir.join('2014-12-01.txt.gz')]
+    assert log.find_channel_log(str(tmpdir), '2014-12-01') == str(tmpdir.join('2014-12-01.txt.gz'))
+    with log.open_channel_log(log.find_channel_log(str(tmpdir), '2014-12-01')) as fp:
+        assert fp.read() == '00:00:00 - foo - bar\n'
+
+
+def test_compress_channel_log_in_members(tmpdir):
+    path = tmpdir.join('2014-12-01.txt')
+    path.write('00:00:00 - foo - bar\n...baz\n00:00:01 - foo - qux\n')
+
+    with patch.object(log, 'GZIP_MEMBER_SIZE', 5):
+        log.compress_channel_log(str(path))
+
+    gz_path = str(path) + '.gz'
+    with log.open_channel_log(gz_path) as fp:
+        assert fp.read() == '00:00:00 - foo - bar\n...baz\n00:00:01 - foo - qux\n'
+
+    # Members hold complete lines, and are read separately
+    with open(gz_path, 'rb') as fp:
+        members = list(log.read_gzip_members(fp, size=7))
+    assert ''.join(data for _, data in members) == '00:00:00 - foo - bar\n...baz\n00:00:01 - foo - qux\n'
+
+    offsets = sorted(set(member for member, _ in members))
+    assert len(offsets) == 3
+    with open(gz_path, 'rb') as fp:
+        fp.seek(offsets[2])
+        assert ''.join(data for _, data in log.read_gzip_members(fp)) == '00:00:01 - foo - qux\n'
+
+
+def test_find_channel_log(tmpdir):
+    tmpdir.join('2014-12-01.txt').write('')
+    assert log.find_channel_log(str(tmpdir), '2014-12-01') == str(tmpdir.join('2014-12-01.txt'))
+    assert log.find_channel_log(str(tmpdir), '2014-12-02') is None
+
+
+@freezegun.freeze_time('2014-12-02 08:00')
+def test_compress_channel_logs_skips_today(tmpdir):
+    for name in ('2014-11-30.txt.gz', '2014-12-01.txt', '2014-12-02.txt'):
+        tmpdir.join(name).write('')
+
+    log.compress_channel_logs(str(tmpdir))
+
+    assert sorted(p.basename for p in tmpdir.listdir()) == [
+        '2014-11-30.txt.gz', '2014-12-01.txt.gz', '2014-12-02.txt',
+    ]
+
+
+class TestBinaryChannelLog(object):
+
+    def make_record(self, nick, message, created):
+        record = logging.LogRecord('foo', logging.INFO, None, None, message, None, None)
+        record.nick = nick
+        record.created = created
+        return record
+
+    def test_read_records(self):
+        data = log.encode_record(1417392000.5, u'foo', u'line one\n☃') + log.encode_record(1417392001, u'bar', u'')
+        records = list(log.read_records(StringIO.StringIO(data + data[:5])))
+
+        assert records == [
+            log.BinaryRecord(0, 29, 1417392000.5, u'foo', u'line one\n☃'),
+            log.BinaryRecord(29, 17, 1417392001, u'bar', u''),
+        ]
+        assert log.record_message(records[0]) == {'time': '00:00:00', 'nick': u'foo', 'message': u'line one\n☃'}
+
+    def test_handler_writes_records_and_index(self, tmpdir):
+        with freezegun.freeze_time('2014-12-01 08:00'):
+            handler = log.BinaryChannelLogFileHandler(str(tmpdir), buffer_size=2, flush_interval=60)
+
+        handler.emit(self.make_record(u'foo', u'hello\nworld', 1417420800))
+        handler.emit(self.make_record(u'bar', u'50% ☃', 1417420801))
+        handler.emit(self.make_record(u'baz', u'bye', 1417420802))
+        handler.close()
+
+        assert handler.baseFilename == str(tmpdir.join('2014-12-01.log'))
+        with open(handler.baseFilename, 'rb') as fp:
+            records = list(log.read_records(fp))
+
+        with open(str(tmpdir.join('2014-12-01.idx')), 'rb') as fp:
+            index = fp.read()
+
+        assert [r.nick for r in records] == [u'foo', u'bar', u'baz']
+        assert [log.BINARY_INDEX_ENTRY.unpack_from(index, i)[0] for i in range(0, len(index), 8)] == \
+            [r.offset for r in records]
+
+        assert list(log.export_binary_channel_log(handler.baseFilename)) == [
+            '08:00:00 - foo - hello\nworld\n',
+            u'08:00:01 - bar - 50% ☃\n'.encode('utf-8'),
+            '08:00:02 - baz - bye\n',
+        ]
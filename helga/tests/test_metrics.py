@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+import pytest
+
+from mock import Mock, patch
+from twisted.internet import task
+
+from helga import metrics
+
+
+class TestMetrics(object):
+
+    def setup(self):
+        self.registry = metrics.MetricRegistry()
+
+    def test_counter(self):
+        counter = metrics.Counter('foo_total', 'Foos', ['channel'], registry=self.registry)
+        counter.inc(channel='#foo')
+        counter.inc(2, channel='#foo')
+        counter.inc(channel=u'#☃')
+
+        assert counter.get(channel='#foo') == 3
+        assert self.registry.render() == (
+            '# HELP foo_total Foos\n'
+            '# TYPE foo_total counter\n'
+            'foo_total{channel="#foo"} 3.0\n'
+            'foo_total{channel="#\xe2\x98\x83"} 1.0\n'
+        )
+
+    def test_labels_required(self):
+        counter = metrics.Counter('foo_total', 'Foos', ['channel'], registry=self.registry)
+        with pytest.raises(ValueError):
+            counter.inc(nick='foo')
+
+    def test_label_escaping(self):
+        assert metrics.format_labels([('a', 'b"c\\d\ne')]) == '{a="b\\"c\\\\d\\ne"}'
+
+    def test_gauge_function(self):
+        gauge = metrics.Gauge('queue', 'Queue length', ['backend'], registry=self.registry)
+        queue = [1, 2]
+        gauge.set_function(lambda: len(queue), backend='irc')
+        gauge.set_function(Mock(side_effect=Exception), backend='slack')
+
+        queue.append(3)
+        assert gauge.get(backend='irc') == 3
+        assert self.registry.render().splitlines()[2:] == ['queue{backend="irc"} 3.0']
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('latency', 'Latency', buckets=[0.1, 1], registry=self.registry)
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(5)
+
+        assert self.registry.render().splitlines()[2:] == [
+            'latency_bucket{le="0.1"} 2.0',
+            'latency_bucket{le="1.0"} 2.0',
+            'latency_bucket{le="+Inf"} 3.0',
+            'latency_sum 5.15',
+            'latency_count 3.0',
+        ]
+
+    def test_histogram_time(self):
+        histogram = metrics.Histogram('latency', 'Latency', ['plugin'], buckets=[1], registry=self.registry)
+
+        with patch.object(metrics.time, 'time', side_effect=[10, 10.5]):
+            with histogram.time(plugin='foo'):
+                pass
+
+        assert 'latency_sum{plugin="foo"} 0.5' in self.registry.render()
+
+
+def test_process_rss():
+    assert metrics.process_rss() > 0
+
+
+def test_reactor_lag_sampler():
+    clock = task.Clock()
+    sampler = metrics.ReactorLagSampler(interval=1, clock=clock)
+    sampler.start()
+
+    with patch.object(sampler, 'record') as record:
+        clock.advance(1)
+        record.assert_called_with(0)
+
+        # A call delayed by a blocked reactor
+        clock.advance(2.5)
+        record.assert_called_with(1.5)
+
+        clock.advance(0.5)
+        record.assert_called_with(0)
+
+    sampler.stop()
+    assert not sampler.loop.running
+
+
+def test_render_includes_builtin_metrics():
+    output = metrics.render()
+    assert '# TYPE helga_messages_received_total counter' in output
+    assert 'helga_process_resident_memory_bytes ' in output
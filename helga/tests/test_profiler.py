@@ -0,0 +1,90 @@
+# -*- coding: utf8 -*-
+import sys
+import threading
+
+from mock import Mock, patch
+
+from helga import profiler
+
+
+def test_collapse_stack():
+    def inner():
+        return sys._getframe()
+
+    stack = profiler.collapse_stack(inner(), 'MainThread').split(';')
+    assert stack[0] == 'MainThread'
+    assert stack[-2].startswith('test_collapse_stack (')
+    assert stack[-1] == 'inner ({0}:{1})'.format(inner.__code__.co_filename,
+                                                 inner.__code__.co_firstlineno)
+
+
+@patch.multiple(profiler, _profiler=None, settings=Mock(PROFILER_INTERVAL=0.5))
+def test_get_profiler():
+    assert profiler.get_profiler() is profiler.get_profiler()
+    assert profiler.get_profiler().interval == 0.5
+
+
+class TestSamplingProfiler(object):
+
+    def setup(self):
+        self.profiler = profiler.SamplingProfiler(interval=0.001)
+
+    def test_sample_includes_other_threads(self):
+        waiting, release = threading.Event(), threading.Event()
+
+        def wait_for_release():
+            waiting.set()
+            release.wait()
+
+        other = threading.Thread(target=wait_for_release, name='waiter')
+        other.start()
+        waiting.wait()
+
+        try:
+            self.profiler.sample()
+            self.profiler.sample()
+        finally:
+            release.set()
+            other.join()
+
+        assert self.profiler.samples == 2
+        stacks = [stack for stack in self.profiler.stacks if stack.startswith('waiter;')]
+        assert len(stacks) == 1
+        assert 'wait_for_release (' in stacks[0]
+        assert self.profiler.stacks[stacks[0]] == 2
+
+        # The sampling thread itself is not sampled
+        assert not any('test_sample_includes_other_threads' in stack for stack in self.profiler.stacks)
+
+    def test_collapsed(self):
+        self.profiler.stacks.update({'MainThread;a;b': 3, 'MainThread;a': 5})
+        assert self.profiler.collapsed() == 'MainThread;a 5\nMainThread;a;b 3\n'
+
+    def test_start_and_stop(self):
+        assert self.profiler.status() == 'No profile has been recorded'
+        assert not self.profiler.stop()
+
+        assert self.profiler.start(duration=None)
+        assert self.profiler.running
+        assert not self.profiler.start()
+        assert self.profiler.status().startswith('Profiling, ')
+
+        assert self.profiler.stop()
+        assert not self.profiler.running
+        assert self.profiler.stopped >= self.profiler.started
+        assert self.profiler.status().startswith('Profiled ')
+
+    def test_start_discards_previous_results(self):
+        self.profiler.stacks['foo'] = 1
+        self.profiler.start(duration=None)
+        self.profiler.stop()
+        assert 'foo' not in self.profiler.stacks
+
+    def test_stops_after_duration(self):
+        with patch.object(profiler.time, 'time', side_effect=[100, 100, 101, 101]):
+            self.profiler.start(duration=1)
+            self.profiler.thread.join(5)
+
+        assert not self.profiler.running
+        assert self.profiler.samples == 0
+        assert self.profiler.stopped == 101
@@ -0,0 +1,116 @@
+from mock import patch
+
+from helga import ratelimit
+
+
+class TestTokenBucket(object):
+
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(3, 60, now=100)
+        assert bucket.tokens == 3
+        assert bucket.wait() == 0
+
+        bucket.tokens = 0
+        assert bucket.wait() == 20
+        assert not bucket.full(now=150)
+        assert bucket.full(now=160)
+
+        bucket.refill(now=130)
+        assert bucket.tokens == 1.5
+        assert bucket.wait() == 0
+
+        # Never more than full
+        bucket.refill(now=1000)
+        assert bucket.tokens == 3
+
+
+class TestRateLimiter(object):
+
+    def setup(self):
+        self.settings = patch.multiple(ratelimit.settings, create=True, PLUGIN_RATE_LIMIT_NOTICE=True,
+                                       PLUGIN_RATE_LIMITS={
+                                           '*': {'CHANNEL': (3, 30)},
+                                           'expensive': {'USER': (1, 10)},
+                                           'free': {'CHANNEL': None},
+                                       })
+        self.settings.start()
+        self.time = patch.object(ratelimit.time, 'time', return_value=100)
+        self.time.start()
+        self.limiter = ratelimit.RateLimiter()
+
+    def teardown(self):
+        self.time.stop()
+        self.settings.stop()
+
+    def test_budgets(self):
+        assert self.limiter.budgets('expensive') == {'user': (1, 10), 'channel': (3, 30)}
+        assert self.limiter.budgets('other') == {'channel': (3, 30)}
+        assert self.limiter.budgets('free') == {}
+
+    def test_unlimited(self):
+        for _ in range(10):
+            assert not self.limiter.allow('#bots', 'me', 'free')
+            self.limiter.consume('#bots', 'me', 'free')
+        assert len(self.limiter.buckets) == 0
+
+    def test_user_limit(self):
+        assert not self.limiter.allow('#bots', 'me', 'expensive')
+        self.limiter.consume('#bots', 'me', 'expensive')
+        assert self.limiter.allow('#bots', 'Me', 'expensive') == 10
+
+        # Other users and channels have their own buckets
+        assert not self.limiter.allow('#bots', 'you', 'expensive')
+        assert not self.limiter.allow('#other', 'me', 'expensive')
+
+        ratelimit.time.time.return_value = 105
+        assert self.limiter.allow('#bots', 'me', 'expensive') == 5
+        ratelimit.time.time.return_value = 110
+        assert not self.limiter.allow('#bots', 'me', 'expensive')
+
+    def test_channel_limit(self):
+        for nick in ('a', 'b', 'c'):
+            assert not self.limiter.allow('#bots', nick, 'other')
+            self.limiter.consume('#bots', nick, 'other')
+        assert self.limiter.allow('#bots', 'd', 'other') == 10
+        assert not self.limiter.allow('#other', 'd', 'other')
+
+    def test_allow_does_not_create_buckets(self):
+        for nick in ('a', 'b', 'c'):
+            assert not self.limiter.allow('#bots', nick, 'expensive')
+        assert len(self.limiter.buckets) == 0
+
+        self.limiter.consume('#bots', 'a', 'expensive')
+        assert len(self.limiter.buckets) == 2
+
+    @patch.object(ratelimit, 'metrics')
+    def test_deny_counts_and_notices(self, metrics):
+        assert self.limiter.deny('#bots', 'me', 'expensive', 10)
+        assert not self.limiter.deny('#bots', 'me', 'expensive', 10)
+        assert metrics.plugin_rate_limited.inc.call_count == 2
+        metrics.plugin_rate_limited.inc.assert_called_with(plugin='expensive')
+
+    def test_notice_once_per_cooldown(self):
+        assert self.limiter.notice('#bots', 'me', 'expensive', 10)
+        assert not self.limiter.notice('#bots', 'me', 'expensive', 10)
+        assert self.limiter.notice('#bots', 'you', 'expensive', 10)
+
+        ratelimit.time.time.return_value = 110
+        assert self.limiter.notice('#bots', 'me', 'expensive', 10)
+
+    def test_notice_disabled(self):
+        ratelimit.settings.PLUGIN_RATE_LIMIT_NOTICE = False
+        assert not self.limiter.notice('#bots', 'me', 'expensive', 10)
+
+    def test_prune_drops_idle_buckets(self):
+        self.limiter.consume('#bots', 'me', 'expensive')
+        self.limiter.consume('#bots', 'you', 'other')
+        assert len(self.limiter.buckets) == 3
+
+        # Not yet time to prune
+        ratelimit.time.time.return_value = 150
+        self.limiter.prune(150)
+        assert len(self.limiter.buckets) == 3
+
+        # The user bucket refilled after 10 seconds, the channel buckets after 30
+        self.limiter.prune(170)
+        assert len(self.limiter.buckets) == 0
@@ -0,0 +1,186 @@
+# -*- coding: utf8 -*-
+import pytest
+
+from mock import patch
+
+from helga import log, search
+
+
+def test_fts_query():
+    assert search.fts_query(u'foo  bar') == u'"foo" "bar"'
+    assert search.fts_query(u'"foo bar" baz') == u'"foo bar" "baz"'
+    assert search.fts_query(u'foo* OR -bar"') == u'"foo*" "OR" "-bar"""'
+    assert search.fts_query(u'  ""  ') == u''
+
+
+@patch('helga.search.reactor')
+@patch('helga.search.settings')
+def test_get_search_index(settings, reactor, tmpdir):
+    settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+    settings.CHANNEL_LOGGING_SEARCH_DB = None
+
+    with patch.object(search, '_search_index', None):
+        index = search.get_search_index()
+
+        assert search.get_search_index() is index
+        assert index.path == str(tmpdir.join('.search.sqlite3'))
+        reactor.callInThread.assert_called_once_with(index.backfill)
+
+
+@patch('helga.search.reactor')
+@patch('helga.search.settings')
+def test_get_search_index_read_only(settings, reactor, tmpdir):
+    settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+    settings.CHANNEL_LOGGING_SEARCH_DB = None
+
+    with patch.multiple(search, _search_index=None, read_only=True):
+        index = search.get_search_index()
+
+        assert index.read_only
+        assert not reactor.callInThread.called
+
+
+class TestSearchIndex(object):
+
+    def setup_logs(self, tmpdir):
+        self.log_dir = tmpdir.mkdir('logs')
+        self.foo = self.log_dir.mkdir('#foo')
+        self.foo.join('2014-12-01.txt').write('\n'.join([
+            '10:00:00 - alice - the deploy failed',
+            '10:00:05 - bob - which deploy',
+            '...the big one',
+            u'10:00:09 - alice - café deploy failed again'.encode('utf-8'),
+        ]) + '\n', mode='wb')
+        self.foo.join('2014-12-02.txt').write('09:00:00 - bob - deploy worked\n')
+        self.log_dir.mkdir('#bar').join('2014-12-02.txt').write('11:00:00 - carol - deploy failed\n')
+
+        self.index = search.SearchIndex(str(self.log_dir), str(tmpdir.join('search.sqlite3')))
+        self.index.backfill()
+
+    def terms(self, **kwargs):
+        return [(r['channel'], r['date'], r['time']) for r in self.index.search(**kwargs)]
+
+    def test_search(self, tmpdir):
+        self.setup_logs(tmpdir)
+
+        assert self.index.search(u'big') == [{
+            'channel': u'#foo',
+            'date': u'2014-12-01',
+            'time': u'10:00:05',
+            'nick': u'bob',
+            'message': u'which deploy\n...the big one',
+        }]
+
+        assert self.terms(terms=u'deploy') == [
+            (u'#bar', u'2014-12-02', u'11:00:00'),
+            (u'#foo', u'2014-12-02', u'09:00:00'),
+            (u'#foo', u'2014-12-01', u'10:00:09'),
+            (u'#foo', u'2014-12-01', u'10:00:05'),
+            (u'#foo', u'2014-12-01', u'10:00:00'),
+        ]
+
+    def test_search_filters(self, tmpdir):
+        self.setup_logs(tmpdir)
+
+        assert self.terms(terms=u'"deploy failed"', channel=u'foo') == [
+            (u'#foo', u'2014-12-01', u'10:00:09'),
+            (u'#foo', u'2014-12-01', u'10:00:00'),
+        ]
+        assert self.terms(terms=u'deploy', nick=u'BOB', until=u'2014-12-01') == [
+            (u'#foo', u'2014-12-01', u'10:00:05'),
+        ]
+        assert self.terms(terms=u'deploy', since=u'2014-12-02', exclude=[u'bar']) == [
+            (u'#foo', u'2014-12-02', u'09:00:00'),
+        ]
+        assert self.terms(terms=u'deploy', limit=2, offset=1) == [
+            (u'#foo', u'2014-12-02', u'09:00:00'),
+            (u'#foo', u'2014-12-01', u'10:00:09'),
+        ]
+        assert self.terms(terms=u'café') == [(u'#foo', u'2014-12-01', u'10:00:09')]
+
+    def test_update_is_incremental(self, tmpdir):
+        self.setup_logs(tmpdir)
+        logfile = self.foo.join('2014-12-02.txt')
+
+        # Partial lines are left until they are complete
+        logfile.write('09:30:00 - bob - rollback', mode='a')
+        self.index.update(str(logfile))
+        assert self.terms(terms=u'rollback') == []
+
+        logfile.write(' done\n', mode='a')
+        self.index.update(str(logfile))
+        self.index.backfill()
+
+        assert self.terms(terms=u'rollback') == [(u'#foo', u'2014-12-02', u'09:30:00')]
+        assert len(self.terms(terms=u'worked')) == 1
+
+    def test_compressed_logs_are_not_reindexed(self, tmpdir):
+        self.setup_logs(tmpdir)
+        logfile = self.foo.join('2014-12-02.txt')
+        logfile.write('09:30:00 - bob - rollback done\n', mode='a')
+        log.compress_channel_log(str(logfile))
+
+        self.index.backfill()
+        self.index.backfill()
+
+        assert len(self.terms(terms=u'worked')) == 1
+        assert self.terms(terms=u'rollback') == [(u'#foo', u'2014-12-02', u'09:30:00')]
+
+    def test_indexes_binary_logs(self, tmpdir):
+        self.setup_logs(tmpdir)
+        logfile = self.log_dir.mkdir('#baz').join('2014-12-01.log')
+        logfile.write(log.encode_record(1417392000, u'dave', u'binary\ndeploy') + 'partial', mode='wb')
+
+        self.index.backfill()
+        self.index.backfill()
+
+        assert self.index.search(u'binary') == [{
+            'channel': u'#baz',
+            'date': u'2014-12-01',
+            'time': u'00:00:00',
+            'nick': u'dave',
+            'message': u'binary\ndeploy',
+        }]
+
+    def test_update_in_batches(self, tmpdir):
+        self.setup_logs(tmpdir)
+        logfile = self.foo.join('2014-12-03.txt')
+        logfile.write(''.join('10:00:{0:02d} - bob - batch {0}\n...more\n'.format(i) for i in range(5)))
+
+        with patch.object(search, 'BATCH_SIZE', 3):
+            with patch.object(self.index, 'lock', wraps=self.index.lock) as lock:
+                self.index.update(str(logfile))
+
+        # The lock is released between batches, and messages are not split across them
+        assert lock.__enter__.call_count == 4
+        assert len(self.terms(terms=u'batch')) == 5
+        assert self.index.search(u'"batch 4"')[0]['message'] == u'batch 4\n...more'
+
+    def test_read_only(self, tmpdir):
+        self.setup_logs(tmpdir)
+        path = str(tmpdir.join('search.sqlite3'))
+        reader = search.SearchIndex(str(self.log_dir), path, read_only=True)
+
+        logfile = self.foo.join('2014-12-02.txt')
+        logfile.write('09:30:00 - bob - rollback done\n', mode='a')
+        reader.update(str(logfile))
+        reader.backfill()
+        assert reader.search(u'rollback') == []
+        assert len(reader.search(u'deploy')) == 5
+
+        # Writes are refused by the database too
+        with pytest.raises(search.sqlite3.OperationalError):
+            with reader.db:
+                reader.db.execute('DELETE FROM messages')
+
+    def test_read_only_before_created(self, tmpdir):
+        reader = search.SearchIndex(str(tmpdir), str(tmpdir.join('search.sqlite3')), read_only=True)
+        assert reader.search(u'deploy') == []
+
+
+def test_line_batches():
+    data = '00:00:00 - foo - a\nb\nc\n00:00:01 - foo - d\n00:00:02 - foo - e\n'
+    assert list(search.line_batches(data, 2)) == [
+        (['00:00:00 - foo - a\n', 'b\n', 'c\n'], 23),
+        (['00:00:01 - foo - d\n', '00:00:02 - foo - e\n'], 38),
+    ]
@@ -0,0 +1,95 @@
+# -*- coding: utf8 -*-
+from mock import Mock, patch
+
+from helga import suppress
+from helga.comm.base import BaseClient
+
+
+class TestMessageSuppressor(object):
+
+    def setup(self):
+        self.suppressor = suppress.MessageSuppressor()
+        self.client = BaseClient()
+        self.client.nickname = 'helga'
+        self.settings = patch.multiple(suppress.settings, create=True, MESSAGE_DEDUP_WINDOW=5,
+                                       BOT_NICKS=['relaybot', 'OtherBot'], BOT_LOOP_LENGTH=4,
+                                       BOT_LOOP_WINDOW=30, CHANNEL_HISTORY_SIZE=100)
+        self.settings.start()
+
+    def teardown(self):
+        self.settings.stop()
+
+    def check(self, nick, message, channel='#bots'):
+        return self.suppressor.check(self.client, channel, nick, message)
+
+    def test_normalize(self):
+        assert suppress.normalize('  Hello   THERE  ') == u'hello there'
+        assert suppress.normalize(u'☃  snow') == u'☃ snow'
+
+    def test_repeats(self):
+        with patch.object(suppress.time, 'time', return_value=100):
+            assert self.check('alice', 'helga ping') is None
+            assert self.check('alice', 'Helga  PING') == 'repeat'
+
+            # Different nick, channel or text are not repeats
+            assert self.check('bob', 'helga ping') is None
+            assert self.check('alice', 'helga ping', channel='#other') is None
+            assert self.check('alice', 'helga pong') is None
+
+        # The window slides while repeats continue
+        with patch.object(suppress.time, 'time', return_value=104):
+            assert self.check('alice', 'helga ping') == 'repeat'
+        with patch.object(suppress.time, 'time', return_value=109.5):
+            assert self.check('alice', 'helga ping') is None
+
+    def test_repeats_disabled(self):
+        suppress.settings.MESSAGE_DEDUP_WINDOW = 0
+        assert self.check('alice', 'helga ping') is None
+        assert self.check('alice', 'helga ping') is None
+
+    def test_echo(self):
+        assert self.check('Helga', 'pong') == 'echo'
+
+    def test_bot_loop(self):
+        with patch.object(suppress.time, 'time', return_value=100):
+            for nick, message in [('relaybot', 'a'), ('helga', 'b'), ('relaybot', 'c')]:
+                self.client.record_message('#bots', nick, message)
+                assert self.check(nick, message) in (None, 'echo')
+
+            # The fourth consecutive bot message is a loop
+            self.client.record_message('#bots', 'helga', 'd')
+            self.client.record_message('#bots', 'relaybot', 'e')
+            assert self.check('relaybot', 'e') == 'loop'
+
+    def test_bot_loop_requires_only_bots(self):
+        for nick in ('alice', 'relaybot', 'helga', 'relaybot', 'helga'):
+            self.client.record_message('#bots', nick, nick)
+        assert self.check('relaybot', 'f') == 'loop'
+
+        self.client.record_message('#bots', 'alice', 'g')
+        self.client.record_message('#bots', 'relaybot', 'h')
+        assert self.check('relaybot', 'h') is None
+
+    def test_bot_loop_requires_more_than_one_bot(self):
+        for message in 'abcd':
+            self.client.record_message('#bots', 'otherbot', message)
+        assert self.check('otherbot', 'e') is None
+
+    def test_bot_loop_requires_window(self):
+        with patch('helga.comm.base.time.time', return_value=100):
+            for nick in ('relaybot', 'helga', 'relaybot', 'helga'):
+                self.client.record_message('#bots', nick, nick)
+
+        with patch.object(suppress.time, 'time', return_value=131):
+            assert self.check('relaybot', 'x') is None
+        with patch.object(suppress.time, 'time', return_value=129):
+            assert self.check('relaybot', 'y') == 'loop'
+
+    def test_check_counts_suppressed(self):
+        with patch.object(suppress, 'metrics') as metrics:
+            self.check('helga', 'pong')
+            metrics.messages_suppressed.inc.assert_called_with(reason='echo')
+
+            metrics.reset_mock()
+            self.check('alice', 'hi')
+            assert not metrics.messages_suppressed.inc.called
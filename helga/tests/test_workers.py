@@ -0,0 +1,281 @@
+# -*- coding: utf8 -*-
+import pytest
+
+from mock import Mock, patch
+
+from helga import workers
+from helga.plugins import operator
+
+
+def test_encode_decode():
+    frames = [['message', 1, u'#foo', u'bar', u'☃', u'helga'], ['plugins', {}]]
+    data = ''.join(map(workers.encode, frames))
+
+    assert workers.FrameDecoder().feed(data) == frames
+
+
+def test_encode_invalid_utf8():
+    # A latin-1 encoded IRC message
+    data = workers.encode(['message', 1, '#foo', 'bar', u'café'.encode('latin-1'), 'helga'])
+    assert workers.FrameDecoder().feed(data) == [['message', 1, u'#foo', u'bar', u'caf\ufffd', u'helga']]
+
+
+def test_decode_partial_frames():
+    decoder = workers.FrameDecoder()
+    data = workers.encode(['call', 'msg', ['#foo', 'hi']])
+
+    assert decoder.feed(data[:2]) == []
+    assert decoder.feed(data[2:7]) == []
+    assert decoder.feed(data[7:] + data[:3]) == [['call', 'msg', ['#foo', 'hi']]]
+    assert decoder.buffer == data[:3]
+
+
+def test_shard_is_stable():
+    assert workers.shard(u'#foo', 4) == workers.shard(u'#FOO', 4)
+    assert all(0 <= workers.shard(u'#chan{0}'.format(i), 3) < 3 for i in range(50))
+    assert workers.shard(u'#☃', 1) == 0
+
+
+class TestWorkerPool(object):
+
+    def setup(self):
+        self.pool = workers.WorkerPool(2)
+        self.pool.workers = [Mock(index=0), Mock(index=1)]
+
+    def test_dispatch_sends_to_channel_shard(self):
+        d = self.pool.dispatch(u'#foo', u'bar', u'baz', u'helga')
+        index = workers.shard(u'#foo', 2)
+
+        self.pool.workers[index].send.assert_called_with(['message', 1, u'#foo', u'bar', u'baz', u'helga'])
+        assert not self.pool.workers[1 - index].send.called
+        assert self.pool.pending[1] == (index, d)
+
+    def test_responses_fire_deferred(self):
+        results = []
+        d = self.pool.dispatch(u'#foo', u'bar', u'baz', u'helga')
+        d.addCallback(results.append)
+
+        self.pool.frame_received(self.pool.workers[0],
+                                 ['responses', 1, u'#foo', u'bar', u'baz', [u'qux']])
+
+        assert results == [(u'#foo', u'bar', u'baz', [u'qux'])]
+        assert self.pool.pending == {}
+
+    @patch('helga.workers.reactor')
+    def test_dispatch_times_out(self, reactor):
+        failures = []
+        with patch.object(workers.settings, 'WORKER_TIMEOUT', 5, create=True):
+            d = self.pool.dispatch(u'#foo', u'bar', u'baz', u'helga')
+        d.addErrback(failures.append)
+
+        delay, timeout = reactor.callLater.call_args[0][:2]
+        assert delay == 5
+        timeout()
+
+        assert failures[0].check(workers.defer.TimeoutError)
+        assert self.pool.pending == {}
+
+    @patch('helga.workers.registry')
+    def test_plugins_reported_by_worker(self, registry):
+        registry.enabled_plugins = {'#foo': set(['a'])}
+        self.pool.frame_received(self.pool.workers[0], ['plugins', {'#foo': ['a', 'b']}])
+        assert registry.enabled_plugins == {'#foo': set(['a', 'b'])}
+
+    def test_unknown_response_ignored(self):
+        self.pool.frame_received(self.pool.workers[0], ['responses', 42, u'#foo', u'bar', u'baz', []])
+        assert self.pool.pending == {}
+
+    def test_call_proxies_to_client(self):
+        self.pool.client = Mock()
+        self.pool.frame_received(self.pool.workers[0], ['call', 'msg', [u'#foo', u'hi']])
+        self.pool.client.msg.assert_called_with(u'#foo', u'hi')
+
+    def test_coordinator_rejects_unsupported_function(self):
+        self.pool.client = Mock()
+        with patch('os.remove') as remove:
+            self.pool.frame_received(self.pool.workers[0], ['coordinator', 'os.remove', u'#foo', [u'/tmp/x']])
+        assert not remove.called
+        assert not self.pool.client.msg.called
+
+    def test_call_rejects_unsupported_method(self):
+        self.pool.client = Mock()
+        self.pool.frame_received(self.pool.workers[0], ['call', 'quit', []])
+        assert not self.pool.client.quit.called
+
+    @patch('helga.workers.reactor')
+    def test_attach(self, reactor):
+        client = Mock()
+        self.pool.attach(client)
+
+        assert self.pool.client is client
+        assert client.workers is self.pool
+        reactor.callLater.assert_called_with(0, self.pool.sync_plugins)
+
+    @patch('helga.workers.registry')
+    def test_sync_plugins(self, registry):
+        registry.enabled_plugins = {'#foo': set(['b', 'a'])}
+        self.pool.sync_plugins()
+
+        for worker in self.pool.workers:
+            worker.send.assert_called_with(['plugins', {'#foo': ['a', 'b']}])
+
+    @patch('helga.workers.reactor')
+    def test_worker_ended_fails_pending_and_respawns(self, reactor):
+        self.pool.running = True
+        failures = []
+
+        for channel in (u'#foo', u'#bar', u'#baz', u'#qux'):
+            self.pool.dispatch(channel, u'nick', u'message', u'helga').addErrback(failures.append)
+
+        ended = self.pool.workers[0]
+        expected = sum(1 for index, _ in self.pool.pending.values() if index == 0)
+        self.pool.worker_ended(ended, Exception('boom'))
+
+        assert len(failures) == expected
+        assert self.pool.workers[0] is None
+        assert all(index == 1 for index, _ in self.pool.pending.values())
+        assert reactor.callLater.call_args[0][1:] == (self.pool.spawn, 0)
+
+    def test_dispatch_fails_for_stopped_worker(self):
+        failures = []
+        self.pool.workers = [None, None]
+        self.pool.dispatch(u'#foo', u'bar', u'baz', u'helga').addErrback(failures.append)
+
+        assert len(failures) == 1
+        assert self.pool.pending == {}
+
+    @patch('helga.workers.reactor')
+    def test_worker_ended_while_stopping(self, reactor):
+        self.pool.running = False
+        self.pool.worker_ended(self.pool.workers[0], Exception('boom'))
+        assert not reactor.callLater.called
+
+    def test_stop(self):
+        self.pool.running = True
+        self.pool.stop()
+
+        assert not self.pool.running
+        for worker in self.pool.workers:
+            worker.transport.closeChildFD.assert_called_with(workers.WORKER_READ_FD)
+
+
+class TestWorker(object):
+
+    def setup(self):
+        self.worker = workers.Worker()
+        self.worker.transport = Mock()
+
+    def _sent(self):
+        data = ''.join(c[0][0] for c in self.worker.transport.write.call_args_list)
+        return workers.FrameDecoder().feed(data)
+
+    @patch('helga.workers.registry')
+    def test_message(self, registry):
+        registry.enabled_plugins = {u'#foo': set()}
+        registry.default_channel_plugins = set()
+        registry.preprocess.return_value = (u'#foo', u'bar', u'BAZ')
+        registry.process.return_value = [u'qux']
+
+        self.worker.dataReceived(workers.encode(['message', 7, u'#foo', u'bar', u'baz', u'helga_']))
+
+        registry.preprocess.assert_called_with(self.worker.client, u'#foo', u'bar', u'baz')
+        registry.process.assert_called_with(self.worker.client, u'#foo', u'bar', u'BAZ')
+        assert self.worker.client.nickname == u'helga_'
+        assert self.worker.client.last_message[u'#foo'][u'bar'] == u'BAZ'
+        assert [(r.nick, r.message) for r in self.worker.client.recent_messages(u'#foo')] == [
+            (u'helga_', u'qux'),
+            (u'bar', u'BAZ'),
+        ]
+        assert self._sent() == [['responses', 7, u'#foo', u'bar', u'BAZ', [u'qux']]]
+
+    @patch('helga.workers.registry')
+    def test_message_responds_when_processing_fails(self, registry):
+        registry.enabled_plugins = {u'#foo': set()}
+        registry.default_channel_plugins = set()
+        registry.preprocess.side_effect = Exception
+
+        self.worker.dataReceived(workers.encode(['message', 7, u'#foo', u'bar', u'baz', u'helga']))
+        assert self._sent() == [['responses', 7, u'#foo', u'bar', u'baz', []]]
+
+    @patch('helga.workers.registry')
+    def test_message_reports_changed_plugins(self, registry):
+        registry.default_channel_plugins = set(['ping'])
+        self.worker.dataReceived(workers.encode(['plugins', {'#foo': ['help']}]))
+
+        def enable(client, channel, nick, message):
+            if channel == u'#foo':
+                registry.enabled_plugins[channel] = set(['help', 'ping'])
+            return []
+
+        registry.preprocess.side_effect = lambda client, *args: args
+        registry.process.side_effect = enable
+        self.worker.dataReceived(workers.encode(['message', 1, u'#foo', u'bar', u'baz', u'helga']))
+        self.worker.dataReceived(workers.encode(['message', 2, u'#foo', u'bar', u'baz', u'helga']))
+
+        # Channels with unchanged plugins are not reported
+        self.worker.dataReceived(workers.encode(['message', 3, u'#bar', u'bar', u'baz', u'helga']))
+
+        assert [frame for frame in self._sent() if frame[0] == 'plugins'] == [
+            ['plugins', {u'#foo': [u'help', u'ping']}]]
+
+    @patch('helga.workers.registry')
+    def test_plugins(self, registry):
+        registry.default_channel_plugins = set(['ping'])
+        self.worker.dataReceived(workers.encode(['plugins', {'#foo': ['help']}]))
+
+        assert registry.enabled_plugins['#foo'] == set(['help'])
+        assert registry.enabled_plugins['#bar'] == set(['ping'])
+
+    @pytest.mark.parametrize('method', workers.PROXIED_METHODS)
+    def test_client_proxies_calls(self, method):
+        getattr(self.worker.client, method)(u'#foo', u'☃')
+        assert self._sent() == [['call', method, [u'#foo', u'☃']]]
+
+    def test_call_in_coordinator(self):
+        with pytest.raises(workers.ResponseNotReady):
+            workers.call_in_coordinator(self.worker.client, u'#foo', operator.lag_summary)
+        assert self._sent() == [['coordinator', 'helga.plugins.operator.lag_summary', u'#foo', []]]
+
+    def test_call_in_coordinator_outside_worker(self):
+        assert workers.call_in_coordinator(Mock(), u'#foo', lambda *args: args, 1, 2) == (1, 2)
+
+    @patch('helga.plugins.operator.lag')
+    def test_operator_lag_answered_by_coordinator(self, lag):
+        self.worker.client.operators = set([u'me'])
+        with pytest.raises(workers.ResponseNotReady):
+            operator.operator(self.worker.client, u'#foo', u'me', u'!op lag', u'op', [u'lag'])
+        assert not lag.get_lag_monitor.called
+
+        # The coordinator, with its own lag monitor, answers on the channel
+        pool = workers.WorkerPool(1)
+        pool.client = Mock()
+        lag.get_lag_monitor.return_value.summary.return_value = u'Reactor lag'
+        for frame in self._sent():
+            pool.frame_received(Mock(index=0), frame)
+        pool.client.msg.assert_called_with(u'#foo', u'Reactor lag')
+
+    @patch('helga.plugins.operator.profiler')
+    def test_operator_profile_run_by_coordinator(self, profiler):
+        self.worker.client.operators = set([u'me'])
+        with pytest.raises(workers.ResponseNotReady):
+            operator.operator(self.worker.client, u'me', u'me', u'!op profile stop', u'op',
+                              [u'profile', u'stop'])
+        assert not profiler.get_profiler.called
+
+        pool = workers.WorkerPool(1)
+        pool.client = Mock()
+        profiler.get_profiler.return_value.stop.return_value = False
+        for frame in self._sent():
+            pool.frame_received(Mock(index=0), frame)
+        pool.client.msg.assert_called_with(u'me', u'No profile is running')
+
+    def test_dispatch_latin1_message(self):
+        pool = workers.WorkerPool(1)
+        pool.workers = [Mock(index=0)]
+        pool.workers[0].send.side_effect = workers.encode
+
+        # Encoding the frame does not fail the dispatch
+        d = pool.dispatch('#foo', 'bar', u'café'.encode('latin-1'), 'helga')
+        assert pool.pending
+        d.addErrback(lambda failure: None)
+        d.cancel()
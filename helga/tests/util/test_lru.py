@@ -0,0 +1,127 @@
+import datetime
+
+import freezegun
+import pytest
+
+from helga.util.lru import LRUDict
+
+
+def test_evicts_least_recently_used():
+    d = LRUDict(maxlen=2)
+    d['foo'] = 1
+    d['bar'] = 2
+
+    # Reading counts as use
+    assert d['foo'] == 1
+
+    d['baz'] = 3
+    assert sorted(d.keys()) == ['baz', 'foo']
+
+
+def test_no_limit():
+    d = LRUDict()
+    for i in range(100):
+        d[i] = i
+    assert len(d) == 100
+
+
+def test_default_factory():
+    d = LRUDict(default_factory=dict)
+    d['#foo']['sduncan'] = 'test'
+    assert d['#foo'] == {'sduncan': 'test'}
+
+
+def test_missing_key_raises_without_default_factory():
+    with pytest.raises(KeyError):
+        LRUDict()['foo']
+
+
+def test_get_does_not_create():
+    d = LRUDict(default_factory=dict)
+    assert d.get('foo') is None
+    assert d.get('foo', 'bar') == 'bar'
+    assert 'foo' not in d
+
+
+def test_ttl_expires_unused_keys():
+    with freezegun.freeze_time('2014-10-31 08:00:00') as frozen:
+        d = LRUDict(ttl=60)
+        d['foo'] = 1
+        d['bar'] = 2
+
+        frozen.tick(delta=datetime.timedelta(seconds=30))
+        assert d['foo'] == 1
+
+        frozen.tick(delta=datetime.timedelta(seconds=45))
+        assert 'bar' not in d
+        assert d.keys() == ['foo']
+
+
+def test_delitem():
+    d = LRUDict()
+    d['foo'] = 1
+    del d['foo']
+    assert len(d) == 0
+
+
+def test_evicts_beyond_maxsize():
+    d = LRUDict(maxsize=10)
+    d['foo'] = 'a' * 4
+    d['bar'] = 'b' * 4
+    assert d.size == 8
+
+    # Replacing a value counts only its new size
+    d['bar'] = 'b' * 5
+    assert d.size == 9
+
+    d['baz'] = 'c' * 3
+    assert sorted(d.keys()) == ['bar', 'baz']
+    assert d.size == 8
+
+    del d['bar']
+    assert d.size == 3
+
+
+def test_keeps_latest_value_larger_than_maxsize():
+    d = LRUDict(maxsize=10)
+    d['foo'] = 'a' * 4
+    d['bar'] = 'b' * 20
+    assert d.keys() == ['bar']
+    assert d.size == 20
+
+
+def test_maxsize_with_sizeof():
+    d = LRUDict(maxsize=2, sizeof=lambda value: 1)
+    d['foo'] = 'long value'
+    d['bar'] = 'long value'
+    d['baz'] = 'long value'
+    assert sorted(d.keys()) == ['bar', 'baz']
+
+
+def test_iterating_does_not_use_keys():
+    d = LRUDict(maxlen=2, default_factory=int)
+    d['foo'] = 1
+    d['bar'] = 2
+
+    assert d.items() == [('foo', 1), ('bar', 2)]
+    assert d.values() == [1, 2]
+    assert list(d.iteritems()) == [('foo', 1), ('bar', 2)]
+    assert list(d.itervalues()) == [1, 2]
+
+    # Iterating did not move foo ahead of bar
+    d['baz'] = 3
+    assert sorted(d.keys()) == ['bar', 'baz']
+
+
+def test_iterating_does_not_refresh_ttl():
+    with freezegun.freeze_time('2014-10-31 08:00:00') as frozen:
+        d = LRUDict(ttl=60)
+        d['foo'] = 1
+        d['bar'] = 2
+
+        frozen.tick(delta=datetime.timedelta(seconds=59))
+        assert dict(d.items()) == {'foo': 1, 'bar': 2}
+
+        frozen.tick(delta=datetime.timedelta(seconds=2))
+        assert d.items() == []
+        assert d.values() == []
@@ -1,10 +1,18 @@
 # -*- coding: utf8 -*-
+import json
 import types
 
-from mock import Mock
+from cStringIO import StringIO
 from unittest import TestCase
 
+import freezegun
+import pytest
+
+from mock import Mock, call, patch
+
 from helga import settings
+from helga.plugins.webhooks import HttpError
+from helga.webhooks import announcements
 from helga.webhooks.announcements import announce
 
 
@@ -43,3 +51,75 @@ class AnnouncementTestCase(TestCase):
         self.request.args['message'] = ['bar']
         assert 'Message Sent' == announce(self.request, self.client, '#foo')
         self.client.msg.assert_called_with('#foo', 'bar')
+
+
+class BatchAnnouncementTestCase(TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.request = Mock(args={})
+        self.request.getUser.return_value = 'user'
+        self.request.getPassword.return_value = 'password'
+        settings.WEBHOOKS_CREDENTIALS = [('user', 'password')]
+        announcements._recent.clear()
+
+    def post(self, body):
+        self.request.content = StringIO(body if isinstance(body, str) else json.dumps(body))
+        return announcements.announce_batch(self.request, self.client)
+
+    def test_announces_all(self):
+        response = self.post([{'channel': 'foo', 'message': 'bar'},
+                              {'channel': '#baz', 'message': u'☃'}])
+
+        assert json.loads(response) == {'accepted': 2, 'skipped': 0}
+        self.request.setResponseCode.assert_called_with(202)
+        assert self.client.msg.call_args_list == [call('#foo', 'bar'), call('#baz', u'☃')]
+
+    def test_skips_duplicates(self):
+        with patch.object(settings, 'WEBHOOKS_ANNOUNCE_DEDUP_WINDOW', 60):
+            with freezegun.freeze_time('2014-12-01 12:00:00'):
+                response = self.post([{'channel': 'foo', 'message': 'bar'},
+                                      {'channel': '#foo', 'message': 'bar'},
+                                      {'channel': 'baz', 'message': 'bar'}])
+                assert json.loads(response) == {'accepted': 2, 'skipped': 1}
+
+            with freezegun.freeze_time('2014-12-01 12:00:59'):
+                assert json.loads(self.post([{'channel': 'foo', 'message': 'bar'}]))['accepted'] == 0
+
+            with freezegun.freeze_time('2014-12-01 12:01:01'):
+                assert json.loads(self.post([{'channel': 'foo', 'message': 'bar'}]))['accepted'] == 1
+
+    def test_dedup_disabled(self):
+        with patch.object(settings, 'WEBHOOKS_ANNOUNCE_DEDUP_WINDOW', 0):
+            response = self.post([{'channel': 'foo', 'message': 'bar'}] * 2)
+            assert json.loads(response) == {'accepted': 2, 'skipped': 0}
+
+    def test_invalid_json(self):
+        with pytest.raises(HttpError):
+            self.post('not json')
+
+    def test_requires_list(self):
+        with pytest.raises(HttpError):
+            self.post({'channel': 'foo', 'message': 'bar'})
+
+    def test_invalid_announcement_sends_nothing(self):
+        with pytest.raises(HttpError):
+            self.post([{'channel': 'foo', 'message': 'bar'}, {'channel': 'foo'}])
+        assert not self.client.msg.called
+
+    def test_invalid_announcement_values(self):
+        invalid = [
+            {'channel': 5, 'message': 'bar'},
+            {'channel': 'foo', 'message': ['bar']},
+            {'channel': 'foo', 'message': None},
+            {'channel': '', 'message': 'bar'},
+            'foo',
+        ]
+
+        for announcement in invalid:
+            with pytest.raises(HttpError) as exc:
+                self.post([{'channel': 'foo', 'message': 'bar'}, announcement])
+            assert exc.value.status == '400'
+            assert 'Announcement 1' in exc.value.message
+
+        assert not self.client.msg.called
@@ -1,11 +1,24 @@
 # coding: utf-8
+import freezegun
 import pytest
 
-from mock import Mock
+from mock import Mock, patch
+from twisted.web.http import CACHED
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
 
+from helga import log, search
 from helga.webhooks import logger
 
 
+def make_catalog(monkeypatch, entries):
+    catalog = log.ChannelLogCatalog('/path/to/logs')
+    for channel, date in entries:
+        catalog.add(channel, date)
+    monkeypatch.setattr(logger, 'get_channel_log_catalog', lambda: catalog)
+    return catalog
+
+
 class TestIndexView(object):
 
     def setup(self):
@@ -15,15 +28,12 @@ class TestIndexView(object):
         assert self.view.title() == 'Channel Logs'
 
     def test_channels(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
-        logger.os.listdir.return_value = ['#foo', '#bar', '#baz']
+        make_catalog(monkeypatch, [('#foo', '2014-12-01'), ('#bar', '2014-12-01'), ('#baz', '2014-12-01')])
 
         assert list(self.view.channels()) == ['bar', 'baz', 'foo']
 
     def test_channels_empty_for_no_logs(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
-        logger.os.path.isdir.return_value = False
-        logger.os.listdir.side_effect = OSError
+        make_catalog(monkeypatch, [])
 
         try:
             retval = list(self.view.channels())
@@ -33,17 +43,22 @@ class TestIndexView(object):
             assert retval == []
 
     def test_channels_hides_blacklist(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
+        make_catalog(monkeypatch, [('#foo', '2014-12-01'), ('#bar', '2014-12-01'), ('#baz', '2014-12-01')])
 
         # Should handle with or without leading '#'
         monkeypatch.setattr(logger, 'settings', Mock(
             CHANNEL_LOGGING_HIDE_CHANNELS=['#foo', 'bar']
         ))
 
-        logger.os.listdir.return_value = ['#foo', '#bar', '#baz']
-
         assert list(self.view.channels()) == ['baz']
 
+    def test_channels_does_not_read_log_dir(self, monkeypatch):
+        make_catalog(monkeypatch, [('#foo', '2014-12-01')])
+        monkeypatch.setattr(log, 'os', Mock())
+
+        assert list(self.view.channels()) == ['foo']
+        assert not log.os.listdir.called
+
 
 class TestChannelIndexView(object):
 
@@ -54,14 +69,13 @@ class TestChannelIndexView(object):
         assert self.view.title() == '#foo Channel Logs'
 
     def test_dates(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
-        logger.os.path.isdir.return_value = True
-        logger.os.listdir.return_value = [
-            '2010-12-01.txt',
-            '2011-12-01.txt',
-            '2012-12-01.txt',
-            '2012-10-31.txt',
-        ]
+        make_catalog(monkeypatch, [
+            ('#foo', '2010-12-01'),
+            ('#foo', '2011-12-01'),
+            ('#foo', '2012-12-01'),
+            ('#foo', '2012-10-31'),
+            ('#bar', '2013-01-01'),
+        ])
 
         assert list(self.view.dates()) == [
             '2012-12-01',
@@ -69,10 +83,25 @@ class TestChannelIndexView(object):
             '2011-12-01',
             '2010-12-01',
         ]
+        assert self.view.previous_page() is None
+        assert self.view.next_page() is None
+        assert self.view.showing() == 'Logs 1-4 of 4'
+
+    def test_dates_paginated(self, monkeypatch):
+        make_catalog(monkeypatch, [('#foo', '2014-12-{0:02d}'.format(day)) for day in range(1, 11)])
+        self.view = logger.ChannelIndex('foo', offset=4, limit=4)
+
+        assert self.view.dates() == ['2014-12-06', '2014-12-05', '2014-12-04', '2014-12-03']
+        assert self.view.previous_page() == '/logger/foo?offset=0&limit=4'
+        assert self.view.next_page() == '/logger/foo?offset=8&limit=4'
+        assert self.view.showing() == 'Logs 5-8 of 10'
+
+        self.view = logger.ChannelIndex('foo', offset=8, limit=4)
+        assert self.view.dates() == ['2014-12-02', '2014-12-01']
+        assert self.view.next_page() is None
 
     def test_dates_404(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
-        logger.os.path.isdir.return_value = False
+        make_catalog(monkeypatch, [('#bar', '2014-12-01')])
 
         with pytest.raises(logger.HttpError):
             list(self.view.dates())
@@ -86,9 +115,8 @@ class TestChannelLogView(object):
     def test_title(self):
         assert self.view.title() == '#foo Channel Logs for 2014-12-01'
 
-    def test_messages_404(self, monkeypatch):
-        monkeypatch.setattr(logger, 'os', Mock())
-        logger.os.path.isfile.return_value = False
+    def test_messages_404(self, tmpdir):
+        logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
 
         with pytest.raises(logger.HttpError):
             list(self.view.messages())
@@ -163,28 +191,175 @@ class TestChannelLogView(object):
             }
         ]
 
-    def test_download(self, tmpdir):
-        request = Mock()
+    def _write_log(self, tmpdir, count):
+        logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+        file = tmpdir.mkdir('#foo').join('2014-12-01.txt')
+        file.write(''.join('00:{0:02d}:00 - foo - message {0}\n'.format(i) for i in range(count)))
+        return file
+
+    def test_messages_paginated(self, tmpdir):
+        self._write_log(tmpdir, 10)
+        view = logger.ChannelLog('foo', '2014-12-01', offset=4, limit=3)
+
+        assert [m['message'] for m in view.messages()] == ['message 4', 'message 5', 'message 6']
+        assert view.showing() == 'Messages 5-7 of 10'
+        assert view.previous_page() == '/logger/foo/2014-12-01?offset=1&limit=3'
+        assert view.next_page() == '/logger/foo/2014-12-01?offset=7&limit=3'
+
+    def test_messages_last_page(self, tmpdir):
+        self._write_log(tmpdir, 10)
+        view = logger.ChannelLog('foo', '2014-12-01', offset=8, limit=3)
+
+        assert [m['message'] for m in view.messages()] == ['message 8', 'message 9']
+        assert view.next_page() is None
+
+    def test_messages_time_range(self, tmpdir):
+        self._write_log(tmpdir, 10)
+        view = logger.ChannelLog('foo', '2014-12-01', start='00:02', end='00:05:00', limit=2)
+
+        assert [m['message'] for m in view.messages()] == ['message 2', 'message 3']
+        assert view.next_page() == '/logger/foo/2014-12-01?offset=4&limit=2&end=00%3A05%3A00'
+
+        view = logger.ChannelLog('foo', '2014-12-01', offset=4, end='00:05:00', limit=2)
+        assert [m['message'] for m in view.messages()] == ['message 4']
+        assert view.next_page() is None
+
+    def _write_download(self, tmpdir):
         contents = ('00:00:00 - foo - this is what i said\n'
                     '12:01:35 - bar - another thing i said\n'
                     '16:17:18 - baz - this - has - delimiters\n'
-                    u'21:22:23 - qux - ☃'.encode('utf-8'))
+                    u'21:22:23 - qux - ☃\n'.encode('utf-8'))
 
         logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
 
         # Create tmp file
         file = tmpdir.mkdir('#foo').join('2014-12-01.txt')
         file.write(contents, mode='wb')
+        return contents
+
+    def test_download(self, tmpdir):
+        contents = self._write_download(tmpdir)
+        request = DummyRequest([])
+
+        assert self.view.download(request) is NOT_DONE_YET
+        assert ''.join(request.written) == contents
+        assert request.responseHeaders.getRawHeaders('Content-Type') == ['text/plain']
+        assert request.responseHeaders.getRawHeaders('Content-Length') == [str(len(contents))]
+        assert request.responseHeaders.getRawHeaders('Content-Disposition') == [
+            'attachment; filename=2014-12-01.txt'
+        ]
+
+    def test_download_range(self, tmpdir):
+        contents = self._write_download(tmpdir)
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Range', ['bytes=11-13'])
+
+        self.view.download(request)
+
+        assert request.responseCode == 206
+        assert ''.join(request.written) == contents[11:14]
+
+    def test_download_not_modified(self, tmpdir):
+        self._write_download(tmpdir)
+        request = Mock()
+        request.setETag.return_value = CACHED
+
+        assert self.view.download(request) == ''
+        etag = request.setETag.call_args[0][0]
+        assert etag.startswith('"') and etag.endswith('"')
+
+    def test_download_compressed(self, tmpdir):
+        contents = self._write_download(tmpdir)
+        path = str(tmpdir.join('#foo', '2014-12-01.txt'))
+        log.compress_channel_log(path)
+
+        request = DummyRequest([])
+        request.requestHeaders.setRawHeaders('Accept-Encoding', ['gzip, deflate'])
+        self.view.download(request)
+
+        assert request.responseHeaders.getRawHeaders('Content-Encoding') == ['gzip']
+        with open(path + '.gz', 'rb') as fp:
+            assert ''.join(request.written) == fp.read()
+
+        request = DummyRequest([])
+        self.view.download(request)
+
+        assert not request.responseHeaders.hasHeader('Content-Encoding')
+        assert ''.join(request.written) == contents
+
+    def test_messages_compressed(self, tmpdir):
+        self._write_log(tmpdir, 3)
+        log.compress_channel_log(str(tmpdir.join('#foo', '2014-12-01.txt')))
+
+        assert [m['message'] for m in self.view.messages()] == ['message 0', 'message 1', 'message 2']
+
+    def test_download_binary(self, tmpdir):
+        logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+        tmpdir.mkdir('#foo').join('2014-12-01.log').write(
+            log.encode_record(1417392000, u'foo', u'multi\nline') + log.encode_record(1417392001, u'bar', u'☃'),
+            mode='wb')
+        request = DummyRequest([])
+
+        assert self.view.download(request) is NOT_DONE_YET
+        assert request.finished
+        assert ''.join(request.written) == u'00:00:00 - foo - multi\nline\n00:00:01 - bar - ☃\n'.encode('utf-8')
+
+    def test_download_binary_in_chunks(self, tmpdir):
+        logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+        tmpdir.mkdir('#foo').join('2014-12-01.log').write(
+            ''.join(log.encode_record(1417392000 + i, u'foo', u'line') for i in range(3)), mode='wb')
+        request = DummyRequest([])
+
+        with patch.object(logger, 'EXPORT_CHUNK_LINES', 2):
+            assert self.view.download(request) is NOT_DONE_YET
+
+        assert request.finished
+        assert request.written == ['00:00:00 - foo - line\n00:00:01 - foo - line\n',
+                                   '00:00:02 - foo - line\n']
+
+    def test_export_producer_stopped(self):
+        request = Mock()
+        lines = Mock()
+        producer = logger.ExportProducer(request, lines)
+
+        producer.stopProducing()
+        producer.resumeProducing()
+
+        lines.close.assert_called_with()
+        assert not request.write.called
 
-        assert self.view.download(request) == contents
-        request.setHeader.assert_any_call('Content-Type', 'text/plain')
-        request.setHeader.assert_any_call('Content-Disposition', 'attachment; filename=2014-12-01.txt')
+    def test_download_404(self, tmpdir):
+        logger.settings.CHANNEL_LOGGING_DIR = str(tmpdir)
+
+        with pytest.raises(logger.HttpError):
+            self.view.download(DummyRequest([]))
+
+
+class TestTemplates(object):
+
+    def test_expands_partials(self, tmpdir):
+        tmpdir.join('page.mustache').write('{{> header }}\n<p>{{ body }}</p>\n    {{> footer }}\n')
+        tmpdir.join('header.mustache').write('<h1>{{ title }}</h1>\n')
+        tmpdir.join('footer.mustache').write('<hr>\n')
+
+        templates = logger.Templates(str(tmpdir))
+        assert templates.read('page') == u'<h1>{{ title }}</h1>\n<p>{{ body }}</p>\n<hr>\n'
+
+    def test_parses_once(self, tmpdir):
+        tmpdir.join('page.mustache').write('<p>{{ body }}</p>')
+        templates = logger.Templates(str(tmpdir))
+        view = type('Page', (object,), {'body': '<b>'})()
+
+        with patch.object(templates, 'read', wraps=templates.read):
+            assert templates.render(view) == '<p>&lt;b&gt;</p>'
+            assert templates.render(view) == '<p>&lt;b&gt;</p>'
+            assert templates.read.call_count == 1
 
 
 class TestWebhook(object):
 
     def setup(self):
-        self.request = Mock()
+        self.request = Mock(args={})
         logger.settings.CHANNEL_LOGGING = True
 
     def test_raises_501(self):
@@ -227,11 +402,110 @@ class TestWebhook(object):
         assert '<td>foo</td>' in response
         assert '<td><pre>this is what i said</pre></td>' in response
 
+    def test_renders_channel_log_page(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+        self.request.args = {'offset': ['1'], 'limit': ['10']}
+        response = logger.logger(self.request, None, 'foo', '2014-12-01')
+
+        assert 'this is what i said' not in response
+        assert '<a href="/logger/foo/2014-12-01?offset=0&amp;limit=10">' in response
+
+    def test_renders_channel_log_limit_too_large(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+        self.request.args = {'limit': [str(logger.MAX_PAGE_LIMIT + 1)]}
+
+        with pytest.raises(logger.HttpError) as exc:
+            logger.logger(self.request, None, 'foo', '2014-12-01')
+        assert exc.value.status == '400'
+
+        with pytest.raises(logger.HttpError):
+            logger.logger(self.request, None, 'foo')
+
+    def test_renders_channel_log_invalid_time(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+        self.request.args = {'start': ['noon']}
+
+        with pytest.raises(logger.HttpError):
+            logger.logger(self.request, None, 'foo', '2014-12-01')
+
+    def test_caches_past_channel_log(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+
+        with patch.object(logger, '_page_cache', {}):
+            with patch.object(logger.templates, 'render', wraps=logger.templates.render):
+                first = logger.logger(self.request, None, 'foo', '2014-12-01')
+                second = logger.logger(self.request, None, 'foo', '2014-12-01')
+
+                assert first == second
+                assert logger.templates.render.call_count == 1
+
+                # A changed file is rendered again
+                tmpdir.join('#foo', '2014-12-01.txt').write('\n00:00:01 - foo - more', mode='a')
+                assert 'more' in logger.logger(self.request, None, 'foo', '2014-12-01')
+                assert logger.templates.render.call_count == 2
+
+    def test_page_cache_bounded_by_size(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+        tmpdir.join('#foo', '2014-12-02.txt').write('00:00:00 - foo - bar')
+        cache = logger.LRUDict(maxsize=1)
+
+        with patch.object(logger, '_page_cache', cache):
+            logger.logger(self.request, None, 'foo', '2014-12-01')
+            logger.logger(self.request, None, 'foo', '2014-12-02')
+
+        assert len(cache) == 1
+        assert cache.size == len(cache.values()[0])
+
+    def test_does_not_cache_todays_channel_log(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+
+        with freezegun.freeze_time('2014-12-01 12:00'):
+            assert logger.ChannelLog('foo', '2014-12-01').cache_key() is None
+
+            # Missing logs are not cached either
+            assert logger.ChannelLog('foo', '2014-11-30').cache_key() is None
+
+        with freezegun.freeze_time('2014-12-02 00:00'):
+            assert logger.ChannelLog('foo', '2014-12-01').cache_key() is not None
+
+    def test_renders_search(self, tmpdir):
+        self._mock_log_dir(tmpdir)
+        logger.settings.CHANNEL_LOGGING_SEARCH = True
+        self.request.args = {'q': ['said'], 'channel': ['foo'], 'limit': ['1']}
+        tmpdir.join('#foo', '2014-12-01.txt').write('\n', mode='a')
+
+        index = search.SearchIndex(str(tmpdir), str(tmpdir.join('.search.sqlite3')))
+        index.backfill()
+
+        with patch.object(logger, 'get_search_index', return_value=index):
+            response = logger.search(self.request, None)
+
+        assert '<title>Search Channel Logs</title>' in response
+        assert '<td><a href="/logger/foo/2014-12-01?start=00:00:00">2014-12-01 00:00:00</a></td>' in response
+        assert '<td><pre>this is what i said</pre></td>' in response
+
+    def test_search_raises_501(self):
+        logger.settings.CHANNEL_LOGGING_SEARCH = False
+        with pytest.raises(logger.HttpError):
+            logger.search(self.request, None)
+
+    def test_search_invalid_date(self):
+        logger.settings.CHANNEL_LOGGING_SEARCH = True
+        self.request.args = {'q': ['said'], 'since': ['yesterday']}
+
+        with pytest.raises(logger.HttpError):
+            logger.search(self.request, None)
+
     def test_renders_channel_log_as_text(self, tmpdir):
         self._mock_log_dir(tmpdir)
-        response = logger.logger(self.request, None, 'foo', '2014-12-01', as_text=True)
-        self.request.setHeader.assert_any_call('Content-Type', 'text/plain')
-        self.request.setHeader.assert_any_call('Content-Disposition', 'attachment; filename=2014-12-01.txt')
+        request = DummyRequest([])
+        response = logger.logger(request, None, 'foo', '2014-12-01', as_text=True)
+
+        assert response is NOT_DONE_YET
+        assert request.responseHeaders.getRawHeaders('Content-Type') == ['text/plain']
+        assert request.responseHeaders.getRawHeaders('Content-Disposition') == [
+            'attachment; filename=2014-12-01.txt'
+        ]
 
         # Output asserts
-        assert response == '00:00:00 - foo - this is what i said'
+        assert ''.join(request.written) == '00:00:00 - foo - this is what i said'
@@ -0,0 +1,146 @@
+# coding: utf-8
+from mock import patch
+
+from helga import log
+from helga.webhooks.logger import index
+
+
+class TestLogIndex(object):
+
+    def test_indexes_message_offsets(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n...two\n00:00:05 - bar - three\n')
+
+        log = index.LogIndex(str(file))
+        log.update()
+
+        assert list(log.offsets) == [0, 28]
+        assert log.times == ['00:00:00', '00:00:05']
+        assert log.messages(1, 2) == [{'time': '00:00:05', 'nick': 'bar', 'message': 'three'}]
+
+    def test_update_is_incremental(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n00:00:0')
+
+        log = index.LogIndex(str(file))
+        log.update()
+        assert len(log) == 1
+
+        # The partial line is rescanned once it is complete
+        file.write('5 - bar - two\n', mode='a')
+        log.update()
+
+        assert log.times == ['00:00:00', '00:00:05']
+        assert log.messages(0, 5) == [
+            {'time': '00:00:00', 'nick': 'foo', 'message': 'one'},
+            {'time': '00:00:05', 'nick': 'bar', 'message': 'two'},
+        ]
+
+    def test_update_reindexes_truncated_file(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n00:00:05 - bar - two\n')
+
+        log = index.LogIndex(str(file))
+        log.update()
+
+        file.write('00:00:09 - baz - three\n')
+        log.update()
+
+        assert log.times == ['00:00:09']
+
+    def test_find(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n00:05:00 - bar - two\n00:10:00 - baz - three\n')
+
+        log = index.LogIndex(str(file))
+        log.update()
+
+        assert log.find('00:05') == 1
+        assert log.find('00:05:01') == 2
+        assert log.find('23:00') == 3
+
+    def test_get_index_is_cached(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n')
+
+        assert index.get_index(str(file)) is index.get_index(str(file))
+
+    def test_indexes_compressed_log(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write('00:00:00 - foo - one\n00:00:05 - bar - two\n')
+        log.compress_channel_log(str(file))
+
+        logindex = index.LogIndex(str(file) + '.gz')
+        logindex.update()
+
+        assert list(logindex.offsets) == [0, 21]
+        assert logindex.messages(1, 2) == [{'time': '00:00:05', 'nick': 'bar', 'message': 'two'}]
+
+    def test_compressed_log_reads_from_member(self, tmpdir):
+        file = tmpdir.join('2014-12-01.txt')
+        file.write(''.join('00:00:{0:02d} - foo - message {0}\n'.format(i) for i in range(10)))
+        with patch.object(log, 'GZIP_MEMBER_SIZE', 60):
+            log.compress_channel_log(str(file))
+
+        logindex = index.LogIndex(str(file) + '.gz')
+        logindex.update()
+
+        assert len(logindex) == 10
+        assert len(logindex.member_offsets) == 4
+        assert list(logindex.member_starts) == [0, 81, 162, 243]
+
+        # Only the member holding the messages is decompressed
+        starts = []
+
+        def read_gzip_members(fp):
+            starts.append(fp.tell())
+            return log.read_gzip_members(fp)
+
+        with patch.object(index, 'read_gzip_members', read_gzip_members):
+            assert logindex.messages(7, 9) == [
+                {'time': '00:00:07', 'nick': 'foo', 'message': 'message 7'},
+                {'time': '00:00:08', 'nick': 'foo', 'message': 'message 8'},
+            ]
+        assert starts == [logindex.member_offsets[2]]
+
+
+class TestBinaryLogIndex(object):
+
+    def write_log(self, tmpdir, records):
+        logfile = tmpdir.join('2014-12-01.log')
+        entries = []
+        with open(str(logfile), 'ab') as fp:
+            for created, nick, message in records:
+                fp.seek(0, 2)
+                entries.append(log.BINARY_INDEX_ENTRY.pack(fp.tell()))
+                fp.write(log.encode_record(created, nick, message))
+        tmpdir.join('2014-12-01.idx').write(''.join(entries), mode='ab')
+        return str(logfile)
+
+    def test_messages_and_find(self, tmpdir):
+        path = self.write_log(tmpdir, [
+            (1417392000, u'foo', u'one\n00:00:01 - not - a message'),
+            (1417392300, u'bar', u'two'),
+            (1417392600, u'baz', u'three'),
+        ])
+
+        logindex = index.get_index(path)
+
+        assert isinstance(logindex, index.BinaryLogIndex)
+        assert len(logindex) == 3
+        assert logindex.messages(0, 1) == [
+            {'time': '00:00:00', 'nick': u'foo', 'message': u'one\n00:00:01 - not - a message'},
+        ]
+        assert logindex.find('00:05') == 1
+        assert logindex.find('00:05:01') == 2
+        assert logindex.find('01:00') == 3
+
+    def test_update_is_incremental(self, tmpdir):
+        path = self.write_log(tmpdir, [(1417392000, u'foo', u'one')])
+        logindex = index.BinaryLogIndex(path)
+        logindex.update()
+
+        self.write_log(tmpdir, [(1417392001, u'bar', u'two')])
+        logindex.update()
+
+        assert [m['message'] for m in logindex.messages(0, 10)] == [u'one', u'two']
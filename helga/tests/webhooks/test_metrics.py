@@ -0,0 +1,12 @@
+from mock import Mock, patch
+
+from helga.webhooks import metrics
+
+
+@patch('helga.webhooks.metrics.render')
+def test_metrics(render):
+    request = Mock()
+    render.return_value = 'foo 1.0\n'
+
+    assert metrics.metrics(request, Mock()) == 'foo 1.0\n'
+    request.setHeader.assert_called_with('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,79 @@
+import pytest
+
+from mock import Mock, patch
+
+from helga import settings
+from helga.plugins.webhooks import HttpError
+from helga.webhooks import profile
+
+
+def make_request(**args):
+    request = Mock(args=args)
+    request.getUser.return_value = 'user'
+    request.getPassword.return_value = 'password'
+    return request
+
+
+@pytest.fixture(autouse=True)
+def credentials():
+    with patch.object(settings, 'WEBHOOKS_CREDENTIALS', [('user', 'password')], create=True):
+        yield
+
+
+@patch('helga.webhooks.profile.get_profiler')
+def test_profile(get_profiler):
+    request = make_request()
+    get_profiler.return_value.collapsed.return_value = 'MainThread;run 1\n'
+
+    assert profile.profile(request, Mock()) == 'MainThread;run 1\n'
+    request.setHeader.assert_called_with('Content-Type', 'text/plain; charset=utf-8')
+
+
+@patch('helga.webhooks.profile.get_profiler')
+def test_profile_not_recorded(get_profiler):
+    get_profiler.return_value.started = None
+
+    with pytest.raises(HttpError):
+        profile.profile(make_request(), Mock())
+
+
+@patch('helga.webhooks.profile.get_profiler')
+def test_start_profile(get_profiler):
+    request = make_request(seconds=['30'])
+    control = profile.control_profile
+
+    assert control(request, Mock(), 'start') == 'Profile started'
+    get_profiler.return_value.start.assert_called_with(30)
+    request.setResponseCode.assert_called_with(202)
+
+    request.args = {}
+    control(request, Mock(), 'start')
+    get_profiler.return_value.start.assert_called_with(profile.DEFAULT_DURATION)
+
+    request.args = {'seconds': ['0']}
+    control(request, Mock(), 'start')
+    get_profiler.return_value.start.assert_called_with(None)
+
+
+@patch('helga.webhooks.profile.get_profiler')
+def test_start_profile_errors(get_profiler):
+    control = profile.control_profile
+
+    for seconds in ('foo', '-1'):
+        with pytest.raises(HttpError):
+            control(make_request(seconds=[seconds]), Mock(), 'start')
+
+    get_profiler.return_value.start.return_value = False
+    with pytest.raises(HttpError):
+        control(make_request(), Mock(), 'start')
+
+
+@patch('helga.webhooks.profile.get_profiler')
+def test_stop_profile(get_profiler):
+    control = profile.control_profile
+    get_profiler.return_value.status.return_value = 'Profiled 3 samples over 1 seconds'
+    assert control(make_request(), Mock(), 'stop') == 'Profiled 3 samples over 1 seconds'
+
+    get_profiler.return_value.stop.return_value = False
+    with pytest.raises(HttpError):
+        control(make_request(), Mock(), 'stop')
@@ -0,0 +1,140 @@
+"""
+Bounded mapping types for long-lived state
+"""
+import time
+
+from collections import MutableMapping, OrderedDict
+
+
+class LRUDict(MutableMapping):
+    """
+    A dictionary that holds at most a fixed number of keys, evicting the least recently used
+    key when full, and that optionally expires keys that have not been used within some number
+    of seconds. Both reading and writing a key count as using it, but iterating does not. Like ``collections.defaultdict``,
+    an optional ``default_factory`` callable creates values for missing keys on item access::
+
+        recent = LRUDict(maxlen=2, default_factory=dict)
+        recent['#foo']['sduncan'] = 'test'
+        recent['#bar']['sduncan'] = 'test'
+        recent['#baz']['sduncan'] = 'test'
+        assert '#foo' not in recent
+    """
+
+    def __init__(self, maxlen=None, ttl=None, default_factory=None, maxsize=None, sizeof=len):
+        """
+        :param maxlen: the maximum number of keys to hold, or None for no limit
+        :param ttl: the number of seconds after which an unused key expires, or None for no expiry
+        :param default_factory: an optional callable used to create values for missing keys
+        :param maxsize: the maximum total size of the values held, or None for no limit. The
+                        least recently used keys are evicted until the total is within this
+                        size, other than the most recently set key.
+        :param sizeof: a callable returning the size of a value, by default its length
+        """
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self.default_factory = default_factory
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+
+        #: The total size of the values held, if ``maxsize`` is set
+        self.size = 0
+
+        # Ordered least to most recently used: key -> (last used time, value)
+        self._data = OrderedDict()
+
+    def _remove(self, key):
+        _, value = self._data.pop(key)
+        if self.maxsize is not None:
+            self.size -= self.sizeof(value)
+
+    def _expire(self):
+        """
+        Drop keys that have not been used within ``ttl`` seconds. Since keys are ordered by
+        last use, this only ever has to look at the oldest keys.
+        """
+        if self.ttl is None:
+            return
+
+        cutoff = time.time() - self.ttl
+        while self._data:
+            key = next(iter(self._data))
+            if self._data[key][0] > cutoff:
+                break
+            self._remove(key)
+
+    def _touch(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (time.time(), value)
+
+    def __getitem__(self, key):
+        self._expire()
+
+        try:
+            _, value = self._data[key]
+        except KeyError:
+            if self.default_factory is None:
+                raise
+            value = self.default_factory()
+            self[key] = value
+        else:
+            self._touch(key, value)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._expire()
+        if key in self._data:
+            self._remove(key)
+        self._touch(key, value)
+
+        if self.maxlen is not None:
+            while len(self._data) > self.maxlen:
+                self._remove(next(iter(self._data)))
+
+        if self.maxsize is not None:
+            self.size += self.sizeof(value)
+            while self.size > self.maxsize and len(self._data) > 1:
+                self._remove(next(iter(self._data)))
+
+    def __delitem__(self, key):
+        self._remove(key)
+
+    def __contains__(self, key):
+        self._expire()
+        return key in self._data
+
+    def __iter__(self):
+        self._expire()
+        return iter(self._data.keys())
+
+    def __len__(self):
+        self._expire()
+        return len(self._data)
+
+    # Iterating values does not count as using their keys, so unlike the MutableMapping
+    # versions these read the underlying data rather than going through __getitem__
+
+    def items(self):
+        self._expire()
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def values(self):
+        self._expire()
+        return [value for _, value in self._data.values()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def get(self, key, default=None):
+        """
+        Get the value for a key without creating it using ``default_factory``
+        """
+        if key in self:
+            return self[key]
+        return default
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, dict(self.items()))
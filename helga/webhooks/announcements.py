@@ -1,9 +1,25 @@
-from helga import log
-from helga.plugins.webhooks import authenticated, route
+import json
+import time
+
+from helga import log, settings
+from helga.plugins.webhooks import authenticated, route, HttpError
+from helga.util.lru import LRUDict
 
 
 logger = log.getLogger(__name__)
 
+#: The maximum number of recently announced messages remembered for deduplication
+RECENT_ANNOUNCEMENTS_SIZE = 1000
+
+# The time each recently announced (channel, message) pair was last announced
+_recent = LRUDict(maxlen=RECENT_ANNOUNCEMENTS_SIZE)
+
+
+def _format_channel(channel):
+    if not channel.startswith('#'):
+        channel = '#{0}'.format(channel)
+    return channel
+
 
 @route('/announce/(?P<channel>[\w\-_]+)', methods=['POST'])
 @authenticated
@@ -12,8 +28,7 @@ def announce(request, irc_client, channel):
     An endpoint for announcing a message on a channel. POST only, must
     provide a single data param 'message'
     """
-    if not channel.startswith('#'):
-        channel = '#{0}'.format(channel)
+    channel = _format_channel(channel)
 
     message = request.args.get('message', [''])[0]
     if not message:
@@ -25,3 +40,56 @@ def announce(request, irc_client, channel):
 
     # Return accepted
     return 'Message Sent'
+
+
+@route('/announce/?$', methods=['POST'])
+@authenticated
+def announce_batch(request, irc_client):
+    """
+    An endpoint for announcing many messages at once. POST only, the request body must be
+    a JSON list of objects with 'channel' and 'message' string values. Messages identical to one announced
+    on the same channel within :data:`~helga.settings.WEBHOOKS_ANNOUNCE_DEDUP_WINDOW` seconds are
+    skipped. Responds with a JSON object of the number of messages accepted and skipped.
+    """
+    try:
+        announcements = json.loads(request.content.read())
+    except ValueError:
+        raise HttpError(400, 'Request body must be JSON')
+
+    if not isinstance(announcements, list):
+        raise HttpError(400, 'Request body must be a JSON list')
+
+    # Validate everything before sending anything, so a bad batch can be safely retried
+    pairs = []
+    for i, announcement in enumerate(announcements):
+        try:
+            channel, message = announcement['channel'], announcement['message']
+        except (KeyError, TypeError):
+            raise HttpError(400, 'Announcement {0} requires a channel and message'.format(i))
+
+        if not isinstance(channel, basestring) or not isinstance(message, basestring):
+            raise HttpError(400, 'Announcement {0} channel and message must be strings'.format(i))
+
+        if not channel or not message:
+            raise HttpError(400, 'Announcement {0} requires a channel and message'.format(i))
+
+        pairs.append((_format_channel(channel), message))
+
+    window = getattr(settings, 'WEBHOOKS_ANNOUNCE_DEDUP_WINDOW', 0)
+    accepted = 0
+
+    for key in pairs:
+        now = time.time()
+        if window and now - _recent.get(key, 0) < window:
+            continue
+        _recent[key] = now
+        accepted += 1
+
+        # Messages are queued by the client's own outbound rate limiting
+        irc_client.msg(*key)
+
+    logger.info('Announced %d of %d messages', accepted, len(pairs))
+
+    request.setResponseCode(202)
+    request.setHeader('Content-Type', 'application/json')
+    return json.dumps({'accepted': accepted, 'skipped': len(pairs) - accepted})
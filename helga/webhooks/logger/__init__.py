@@ -1,15 +1,89 @@
+import codecs
+import datetime
 import os
 import re
+import urllib
 
-from collections import deque
-from itertools import imap
+from itertools import imap, islice
 from operator import methodcaller
 
 import pystache
 
+from pystache.locator import Locator
+from twisted.web import http, server, static
+
 from helga import settings
+from helga.log import (export_binary_channel_log, find_channel_log, get_channel_log_catalog,
+                       open_channel_log)
 from helga.plugins.webhooks import HttpError, route
-from helga.util.encodings import to_unicode
+from helga.search import get_search_index
+from helga.util.lru import LRUDict
+from helga.webhooks.logger.index import get_index
+
+
+#: The maximum number of rendered channel log pages to keep in memory
+PAGE_CACHE_SIZE = 128
+
+#: The maximum total length, in characters, of the rendered channel log pages kept in memory
+PAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+#: The number of lines of a binary channel log exported for download at a time
+EXPORT_CHUNK_LINES = 1000
+
+#: The number of dates listed on each page of a channel index
+DATES_PAGE_SIZE = 100
+
+#: The largest page size that may be requested with the ``limit`` query param. Larger pages
+#: would read and render most of a log file at once.
+MAX_PAGE_LIMIT = 5000
+
+
+class Templates(object):
+    """
+    The logger mustache templates, each read from disk and parsed only once. Partials are
+    expanded into the templates that include them when loaded, since pystache would
+    otherwise read and parse partials every time a template is rendered.
+    """
+
+    partial_pat = re.compile(r'^[ \t]*\{\{>\s*(\w+)\s*\}\}[ \t]*\n?', re.M)
+
+    def __init__(self, template_dir):
+        """
+        :param template_dir: the directory containing ``.mustache`` templates
+        """
+        self.template_dir = template_dir
+        self.renderer = pystache.renderer.Renderer()
+        self.locator = Locator()
+        self.parsed = {}
+
+    def read(self, name):
+        """
+        Read a template, with any partials it includes expanded
+
+        :param name: the template name, i.e. 'channel_log'
+        """
+        path = os.path.join(self.template_dir, '{0}.mustache'.format(name))
+        with codecs.open(path, encoding='utf-8') as fp:
+            template = fp.read()
+        return self.partial_pat.sub(lambda match: self.read(match.group(1)), template)
+
+    def render(self, view):
+        """
+        Render a view object with the template named for its class, i.e. 'channel_log'
+        for a ``ChannelLog`` object
+
+        :param view: the rendered object
+        """
+        name = self.locator.make_template_name(view)
+        if name not in self.parsed:
+            self.parsed[name] = pystache.parse(self.read(name))
+        return self.renderer.render(self.parsed[name], view)
+
+
+templates = Templates(os.path.dirname(os.path.abspath(__file__)))
+
+# Rendered pages of past channel logs, which will not change
+_page_cache = LRUDict(maxlen=PAGE_CACHE_SIZE, maxsize=PAGE_CACHE_BYTES)
 
 
 class Index(object):
@@ -22,57 +96,97 @@ class Index(object):
         return u'Channel Logs'
 
     def channels(self):
-        log_dir = settings.CHANNEL_LOGGING_DIR
         lstrip = methodcaller('lstrip', '#')
         hidden = set(imap(lstrip, settings.CHANNEL_LOGGING_HIDE_CHANNELS))
 
-        if not os.path.isdir(log_dir):
-            raise StopIteration
-
-        for chan in imap(lstrip, sorted(os.listdir(log_dir))):
-            if chan in hidden:
+        for chan in imap(lstrip, get_channel_log_catalog().channels()):
+            # Skip hidden files, like the search index
+            if chan in hidden or chan.startswith('.'):
                 continue
             yield chan
 
 
 class ChannelIndex(object):
     """
-    Rendered object for the logger channel index page meant to show the full list
-    of log files (UTC dates) for a given IRC channel.
+    Rendered object for the logger channel index page meant to show a page of the
+    list of log files (UTC dates) for a given IRC channel, most recent first.
     """
 
-    def __init__(self, channel):
+    def __init__(self, channel, offset=0, limit=None):
         self.channel = channel
+        self.offset = offset
+        self.limit = limit or DATES_PAGE_SIZE
+        self._dates = None
 
     def title(self):
         return u'#{0} Channel Logs'.format(self.channel)
 
+    def all_dates(self):
+        """
+        Every date the channel has a log for, most recent first
+        """
+        if self._dates is None:
+            self._dates = get_channel_log_catalog().dates('#{0}'.format(self.channel))
+            if self._dates is None:
+                raise HttpError(404)
+        return self._dates
+
     def dates(self):
-        channel = '#{0}'.format(self.channel)
-        basedir = os.path.join(settings.CHANNEL_LOGGING_DIR, channel)
+        return self.all_dates()[self.offset:self.offset + self.limit]
 
-        if not os.path.isdir(basedir):
-            raise HttpError(404)
+    def _page_url(self, offset):
+        params = [('offset', offset), ('limit', self.limit)]
+        return '/logger/{0}?{1}'.format(self.channel, urllib.urlencode(params))
+
+    def previous_page(self):
+        """
+        URL of the page of more recent dates, or None if this is the first page
+        """
+        if self.offset <= 0:
+            return None
+        return self._page_url(max(0, self.offset - self.limit))
 
-        for date in sorted(os.listdir(basedir), reverse=True):
-            yield date.replace('.txt', '')
+    def next_page(self):
+        """
+        URL of the page of older dates, or None if this is the last page
+        """
+        if self.offset + self.limit >= len(self.all_dates()):
+            return None
+        return self._page_url(self.offset + self.limit)
+
+    def showing(self):
+        """
+        Description of the dates shown on this page
+        """
+        total = len(self.all_dates())
+        if self.offset >= total:
+            return u'No logs'
+        return u'Logs {0}-{1} of {2}'.format(self.offset + 1, min(self.offset + self.limit, total), total)
 
 
 class ChannelLog(object):
     """
-    Rendered object for displaying the full contents of a channel log for a
-    given channel and date.
+    Rendered object for displaying a page of the contents of a channel log for a
+    given channel and date. Pages start either at a message offset or at the first
+    message logged at or after a ``HH:MM:SS`` start time, and optionally end before
+    the first message logged at or after an end time.
     """
 
-    def __init__(self, channel, date):
+    def __init__(self, channel, date, offset=0, limit=None, start=None, end=None):
         self.channel_name = channel
         self.date = date
         self.logfile = '{0}.txt'.format(self.date)
         self.channel = '#{0}'.format(self.channel_name)
+        self.offset = offset
+        self.limit = limit or getattr(settings, 'CHANNEL_LOGGING_PAGE_SIZE', 500)
+        self.start = start
+        self.end = end
+        self._page = None
 
     @property
     def logfile_path(self):
-        return os.path.join(settings.CHANNEL_LOGGING_DIR, self.channel, self.logfile)
+        basedir = os.path.join(settings.CHANNEL_LOGGING_DIR, self.channel)
+        return find_channel_log(basedir, self.date) or os.path.join(basedir, self.logfile)
 
     def title(self):
         """
@@ -80,56 +194,319 @@ class ChannelLog(object):
         """
         return u'{0} Channel Logs for {1}'.format(self.channel, self.date)
 
-    def messages(self):
+    def cache_key(self):
         """
-        Generator for logged channel messages as a dictionary
-        of the message time, message nick, and message contents
+        Returns a key identifying the rendered contents of this page, or None if the page
+        should not be cached because it shows the log of the current UTC day
         """
+        if self.date >= datetime.datetime.utcnow().strftime('%Y-%m-%d'):
+            return None
+
+        try:
+            stat = os.stat(self.logfile_path)
+        except OSError:
+            return None
+
+        return (self.logfile_path, stat.st_mtime, stat.st_size,
+                self.offset, self.limit, self.start, self.end)
+
+    def page(self):
+        """
+        Returns a three-tuple of the log index, and the positions of the first message
+        and after the last message of this page
+        """
+        if self._page is not None:
+            return self._page
+
         if not os.path.isfile(self.logfile_path):
             raise HttpError(404)
 
-        line_pat = re.compile(r'^(\d{2}:?){3} - \w+ - .*$')
-        message = u''
-        log = deque()
-
-        # XXX: This is kind of terrible. Some things will log only a single time
-        # if the message sent over IRC has newlines. So we have to read in reverse
-        # and construct the response list
-        with open(self.logfile_path, 'r') as fp:
-            for line in imap(to_unicode, reversed(fp.readlines())):
-                if not line_pat.match(line):
-                    message = u''.join((line, message))
-                    continue
-
-                parts = line.strip().split(u' - ')
-                time = parts.pop(0)
-                nick = parts.pop(0)
-                message = u'\n'.join((u' - '.join(parts), message))
-                log.appendleft({
-                    'time': time,
-                    'nick': nick,
-                    'message': message.rstrip(u'\n'),
-                })
-                message = ''
-
-        if message:
-            log.appendleft({
-                'time': '',
-                'nick': '',
-                'message': message,
-            })
-
-        return log
+        index = get_index(self.logfile_path)
+        first = self.offset if self.start is None else index.find(self.start)
+        stop = len(index) if self.end is None else index.find(self.end)
+
+        self._page = (index, first, min(first + self.limit, stop))
+        return self._page
+
+    def messages(self):
+        """
+        Logged channel messages of this page as a list of dictionaries
+        of the message time, message nick, and message contents
+        """
+        index, first, last = self.page()
+        return index.messages(first, last)
+
+    def _page_url(self, offset):
+        params = [('offset', offset), ('limit', self.limit)]
+        if self.end is not None:
+            params.append(('end', self.end))
+        return '/logger/{0}/{1}?{2}'.format(self.channel_name, self.date, urllib.urlencode(params))
+
+    def previous_page(self):
+        """
+        URL of the previous page of messages, or None if this is the first page
+        """
+        index, first, last = self.page()
+        if first <= 0:
+            return None
+        return self._page_url(max(0, first - self.limit))
+
+    def next_page(self):
+        """
+        URL of the next page of messages, or None if this is the last page
+        """
+        index, first, last = self.page()
+        stop = len(index) if self.end is None else index.find(self.end)
+        if last >= stop:
+            return None
+        return self._page_url(last)
+
+    def showing(self):
+        """
+        Description of the messages shown on this page
+        """
+        index, first, last = self.page()
+        if first >= last:
+            return u'No messages'
+        return u'Messages {0}-{1} of {2}'.format(first + 1, last, len(index))
 
     def download(self, request):
         """
-        Offers this logfile as a download
+        Offers this logfile as a download, streamed from disk. Supports range requests,
+        and conditional requests using the ``ETag`` or ``Last-Modified`` of the file.
+        Compressed logs are sent as is to clients that accept gzip encoding, and are
+        otherwise decompressed as they are sent, without range request support.
         """
-        request.setHeader('Content-Type', 'text/plain')
+        path = self.logfile_path
+        if not os.path.isfile(path):
+            raise HttpError(404)
+
+        stat = os.stat(path)
+        compressed = path.endswith('.gz')
+        gzip_accepted = compressed and 'gzip' in (request.getHeader('Accept-Encoding') or '')
+
         request.setHeader('Content-Disposition',
                           'attachment; filename={0}'.format(self.logfile))
-        with open(self.logfile_path, 'r') as fp:
-            return '\n'.join(line.strip() for line in fp.readlines())
+
+        etag = '{0:x}-{1:x}'.format(stat.st_size, int(stat.st_mtime))
+        if compressed:
+            request.setHeader('Vary', 'Accept-Encoding')
+            etag += '-gzip' if gzip_accepted else '-identity'
+
+        if request.setETag('"{0}"'.format(etag)) is http.CACHED:
+            return ''
+
+        if path.endswith('.log'):
+            return self._download_export(request, path, stat)
+
+        if compressed and not gzip_accepted:
+            if request.setLastModified(stat.st_mtime) is http.CACHED:
+                return ''
+            request.setHeader('Content-Type', 'text/plain')
+            static.NoRangeStaticProducer(request, open_channel_log(path)).start()
+            return server.NOT_DONE_YET
+
+        logfile = static.File(path)
+        logfile.type, logfile.encoding = 'text/plain', ('gzip' if compressed else None)
+        return logfile.render(request)
+
+    def _download_export(self, request, path, stat):
+        """
+        Sends a binary log exported to the plain text format
+        """
+        if request.setLastModified(stat.st_mtime) is http.CACHED:
+            return ''
+
+        request.setHeader('Content-Type', 'text/plain')
+        ExportProducer(request, export_binary_channel_log(path)).start()
+        return server.NOT_DONE_YET
+
+
+class ExportProducer(object):
+    """
+    A pull producer writing exported channel log lines to a request :data:`EXPORT_CHUNK_LINES`
+    lines at a time, as the client reads them, so a large download never blocks the reactor
+    for longer than it takes to export one chunk
+    """
+
+    def __init__(self, request, lines):
+        """
+        :param request: the request to write to
+        :param lines: an iterator of byte string lines, see :func:`helga.log.export_binary_channel_log`
+        """
+        self.request = request
+        self.lines = lines
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+
+        chunk = ''.join(islice(self.lines, EXPORT_CHUNK_LINES))
+        if chunk:
+            self.request.write(chunk)
+            return
+
+        self.request.unregisterProducer()
+        self.request.finish()
+        self.stopProducing()
+
+    def stopProducing(self):
+        self.lines.close()
+        self.request = None
+
+
+class Search(object):
+    """
+    Rendered object for the logger search page, showing a page of logged messages
+    matching search terms, most recent first.
+    """
+
+    def __init__(self, terms, channel=None, nick=None, since=None, until=None, offset=0, limit=None):
+        self.terms = terms or u''
+        self.channel = channel or u''
+        self.nick = nick or u''
+        self.since = since or u''
+        self.until = until or u''
+        self.offset = offset
+        self.limit = limit or getattr(settings, 'CHANNEL_LOGGING_PAGE_SIZE', 500)
+        self._results = None
+
+    def title(self):
+        return u'Search Channel Logs'
+
+    def results(self):
+        """
+        Matching messages as a list of dictionaries of the message channel, date,
+        time, nick and contents, and a link to the message in the channel log
+        """
+        if self._results is not None:
+            return self._results
+
+        # Fetch one extra result to know if there is a next page
+        results = get_search_index().search(self.terms,
+                                            channel=self.channel,
+                                            nick=self.nick,
+                                            since=self.since,
+                                            until=self.until,
+                                            limit=self.limit + 1,
+                                            offset=self.offset,
+                                            exclude=settings.CHANNEL_LOGGING_HIDE_CHANNELS)
+
+        for result in results:
+            result['channel_name'] = result['channel'].lstrip(u'#')
+            result['link'] = u'/logger/{0}/{1}'.format(result['channel_name'], result['date'])
+            if result['time']:
+                result['link'] += u'?start={0}'.format(result['time'])
+
+        self._has_next = len(results) > self.limit
+        self._results = results[:self.limit]
+        return self._results
+
+    def _page_url(self, offset):
+        params = [('q', self.terms), ('channel', self.channel), ('nick', self.nick),
+                  ('since', self.since), ('until', self.until), ('offset', offset), ('limit', self.limit)]
+        return '/logger/search?{0}'.format(urllib.urlencode([(k, v) for k, v in params if v]))
+
+    def previous_page(self):
+        """
+        URL of the previous page of results, or None if this is the first page
+        """
+        if not self.terms or self.offset <= 0:
+            return None
+        return self._page_url(max(0, self.offset - self.limit))
+
+    def next_page(self):
+        """
+        URL of the next page of results, or None if this is the last page
+        """
+        if not self.terms:
+            return None
+        self.results()
+        if not self._has_next:
+            return None
+        return self._page_url(self.offset + self.limit)
+
+    def showing(self):
+        """
+        Description of the results shown on this page
+        """
+        if not self.terms:
+            return u''
+        results = self.results()
+        if not results:
+            return u'No results'
+        return u'Results {0}-{1}'.format(self.offset + 1, self.offset + len(results))
+
+
+def _query_int(request, name, default=None):
+    try:
+        return max(0, int(request.args[name][0]))
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+def _query_limit(request):
+    """
+    Returns the page size requested with the ``limit`` query param, or None for the default
+
+    :raises: :exc:`~helga.plugins.webhooks.HttpError` if the page size is larger than
+             :data:`MAX_PAGE_LIMIT`, or the configured page size if that is larger
+    """
+    limit = _query_int(request, 'limit')
+    maximum = max(MAX_PAGE_LIMIT, getattr(settings, 'CHANNEL_LOGGING_PAGE_SIZE', 500))
+
+    if limit is not None and limit > maximum:
+        raise HttpError(400, 'Param limit must be at most {0}'.format(maximum))
+    return limit
+
+
+def _query_time(request, name):
+    try:
+        value = request.args[name][0]
+    except (KeyError, IndexError):
+        return None
+
+    if not re.match(r'^\d{2}(:\d{2}){1,2}$', value):
+        raise HttpError(400, 'Invalid time {0}, expected HH:MM or HH:MM:SS'.format(name))
+    return value
+
+
+def _query_date(request, name):
+    try:
+        value = request.args[name][0]
+    except (KeyError, IndexError):
+        return None
+
+    if value and not re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+        raise HttpError(400, 'Invalid date {0}, expected YYYY-MM-DD'.format(name))
+    return value
+
+
+def _query_str(request, name):
+    try:
+        return request.args[name][0].decode('utf-8', 'ignore')
+    except (KeyError, IndexError):
+        return None
+
+
+@route(r'/logger/search/?$')
+def search(request, irc_client):
+    if not settings.CHANNEL_LOGGING or not getattr(settings, 'CHANNEL_LOGGING_SEARCH', False):
+        raise HttpError(501, 'Channel log search is not enabled')
+
+    page = Search(_query_str(request, 'q'),
+                  channel=_query_str(request, 'channel'),
+                  nick=_query_str(request, 'nick'),
+                  since=_query_date(request, 'since'),
+                  until=_query_date(request, 'until'),
+                  offset=_query_int(request, 'offset', 0),
+                  limit=_query_limit(request))
+
+    request.setHeader('Content-Type', 'text/html')
+    return templates.render(page)
 
 
 @route(r'/logger/?$')
@@ -139,18 +516,30 @@ def logger(request, irc_client, channel=None, date=None, as_text=None):
     if not settings.CHANNEL_LOGGING:
         raise HttpError(501, 'Channel logging is not enabled')
 
-    request.setHeader('Content-Type', 'text/html')
-    renderer = pystache.renderer.Renderer(
-        search_dirs=os.path.dirname(os.path.abspath(__file__))
-    )
+    key = None
 
     if channel is None:
         page = Index()
     elif date is None:
-        page = ChannelIndex(channel)
+        page = ChannelIndex(channel,
+                            offset=_query_int(request, 'offset', 0),
+                            limit=_query_limit(request))
     else:
-        page = ChannelLog(channel, date)
+        page = ChannelLog(channel, date,
+                          offset=_query_int(request, 'offset', 0),
+                          limit=_query_limit(request),
+                          start=_query_time(request, 'start'),
+                          end=_query_time(request, 'end'))
         if as_text is not None:
             return page.download(request)
+        key = page.cache_key()
+
+    request.setHeader('Content-Type', 'text/html')
+
+    if key is None:
+        return templates.render(page)
 
-    return renderer.render(page)
+    rendered = _page_cache.get(key)
+    if rendered is None:
+        rendered = _page_cache[key] = templates.render(page)
+    return rendered
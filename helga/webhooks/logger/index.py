@@ -0,0 +1,281 @@
+"""
+Line offset indexes of channel log files, used to read a single page of a log without
+reading the whole file
+"""
+import os
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from helga.log import (BINARY_INDEX_ENTRY, BINARY_RECORD, LINE_PAT, open_channel_log,
+                       parse_messages, read_gzip_members, read_records, record_message,
+                       record_time)
+from helga.util.lru import LRUDict
+
+
+#: The maximum number of log file indexes to keep in memory
+INDEX_CACHE_SIZE = 64
+
+_indexes = LRUDict(maxlen=INDEX_CACHE_SIZE)
+
+
+def get_index(path):
+    """
+    Get an up to date :class:`LogIndex`, or :class:`BinaryLogIndex` for a binary log file,
+    reusing a cached index if there is one
+
+    :param path: the path to a channel log file
+    """
+    try:
+        index = _indexes[path]
+    except KeyError:
+        index_class = BinaryLogIndex if path.endswith('.log') else LogIndex
+        index = _indexes[path] = index_class(path)
+
+    index.update()
+    return index
+
+
+class LogIndex(object):
+    """
+    The byte offset and time of every message in a channel log file. Since log files for
+    the current day are still being written, the index is updated incrementally, only
+    scanning the part of the file written since it was last updated. Offsets into
+    compressed log files are offsets into their uncompressed contents, and the start of each
+    gzip member is recorded so that reading a page only decompresses the member holding it.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path to a channel log file
+        """
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything indexed so far
+        """
+        #: The byte offset of the first line of each message
+        self.offsets = array('L')
+
+        #: The ``HH:MM:SS`` time of each message, or an empty string if it has none
+        self.times = []
+
+        #: The number of bytes indexed
+        self.size = 0
+
+        #: The uncompressed offset, and file offset, of each gzip member of a compressed log file
+        self.member_starts = array('L')
+        self.member_offsets = array('L')
+
+        # The offset following the last complete line. A partial line at the end of the
+        # file is rescanned on the next update, since it may yet become a new message
+        self._complete = 0
+        self._inode = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def update(self):
+        """
+        Index any part of the log file not yet indexed. If the file was replaced or truncated,
+        it is indexed from the start. Compressed log files never change, so they are only
+        indexed once.
+        """
+        stat = os.stat(self.path)
+
+        if self.path.endswith('.gz'):
+            if stat.st_ino == self._inode:
+                return
+            self.reset()
+            self._inode = stat.st_ino
+        else:
+            if stat.st_ino != self._inode or stat.st_size < self.size:
+                self.reset()
+                self._inode = stat.st_ino
+
+            if stat.st_size == self.size:
+                return
+
+        # Drop anything indexed from a partial line, it may have changed
+        while self.offsets and self.offsets[-1] >= self._complete:
+            self.offsets.pop()
+            self.times.pop()
+
+        pos = self._complete
+        for line in self._read_lines(pos):
+            if LINE_PAT.match(line.rstrip('\n')):
+                self.offsets.append(pos)
+                self.times.append(line[:8])
+            elif not self.offsets:
+                self.offsets.append(pos)
+                self.times.append('')
+
+            pos += len(line)
+            if line.endswith('\n'):
+                self._complete = pos
+
+        self.size = pos
+
+    def _read_lines(self, pos):
+        """
+        Generator of the lines of the log file from an offset. Compressed log files are always
+        read from the start, recording the offsets of their gzip members along the way.
+        """
+        if not self.path.endswith('.gz'):
+            with open_channel_log(self.path) as fp:
+                fp.seek(pos)
+                for line in fp:
+                    yield line
+            return
+
+        partial = ''
+        with open(self.path, 'rb') as fp:
+            for member, data in read_gzip_members(fp):
+                if not self.member_offsets or self.member_offsets[-1] != member:
+                    self.member_starts.append(pos + len(partial))
+                    self.member_offsets.append(member)
+
+                lines = (partial + data).splitlines(True)
+                partial = '' if lines[-1].endswith('\n') else lines.pop()
+                for line in lines:
+                    pos += len(line)
+                    yield line
+
+        if partial:
+            yield partial
+
+    def _read(self, begin, end):
+        """
+        Returns the bytes of the log file between two offsets, decompressing a compressed log
+        file from the start of the gzip member holding the first byte
+        """
+        if not self.member_offsets:
+            with open_channel_log(self.path) as fp:
+                fp.seek(begin)
+                return fp.read(end - begin)
+
+        i = bisect_right(self.member_starts, begin) - 1
+        pos, chunks = self.member_starts[i], []
+
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.member_offsets[i])
+            for _, data in read_gzip_members(fp):
+                chunks.append(data)
+                pos += len(data)
+                if pos >= end:
+                    break
+
+        skip = begin - self.member_starts[i]
+        return ''.join(chunks)[skip:skip + end - begin]
+
+    def find(self, time):
+        """
+        Returns the position of the first message logged at or after a given time
+
+        :param time: a time string, ``HH:MM`` or ``HH:MM:SS``
+        """
+        return bisect_left(self.times, time)
+
+    def messages(self, start, stop):
+        """
+        Reads and parses messages from the log file, only reading the bytes they occupy
+
+        :param start: the position of the first message to read
+        :param stop: the position after the last message to read
+        :returns: a list of message dictionaries, see :func:`helga.log.parse_messages`
+        """
+        stop = min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+
+        begin = self.offsets[start]
+        end = self.offsets[stop] if stop < len(self.offsets) else self.size
+
+        return list(parse_messages(self._read(begin, end).splitlines()))
+
+
+class BinaryLogIndex(object):
+    """
+    The byte offset of every record in a binary channel log file, read from the offset index
+    file written alongside it. Like :class:`LogIndex`, this is updated incrementally.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the path to a binary channel log file
+        """
+        self.path = path
+        self.index_path = os.path.splitext(path)[0] + '.idx'
+
+        #: The byte offset of each record
+        self.offsets = array('L')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def update(self):
+        """
+        Read any offsets added to the index file since it was last read
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+
+        read = len(self.offsets) * BINARY_INDEX_ENTRY.size
+        if size < read:
+            self.offsets = array('L')
+            read = 0
+
+        # Ignore a partially written entry
+        size -= size % BINARY_INDEX_ENTRY.size
+        if size == read:
+            return
+
+        with open(self.index_path, 'rb') as fp:
+            fp.seek(read)
+            data = fp.read(size - read)
+
+        self.offsets.extend(BINARY_INDEX_ENTRY.unpack_from(data, i)[0]
+                            for i in xrange(0, len(data), BINARY_INDEX_ENTRY.size))
+
+    def find(self, time):
+        """
+        Returns the position of the first message logged at or after a given time, only
+        reading the headers of the records it compares
+
+        :param time: a time string, ``HH:MM`` or ``HH:MM:SS``
+        """
+        low, high = 0, len(self.offsets)
+
+        with open(self.path, 'rb') as fp:
+            while low < high:
+                middle = (low + high) // 2
+                fp.seek(self.offsets[middle])
+                created = BINARY_RECORD.unpack(fp.read(BINARY_RECORD.size))[0]
+
+                if record_time(created) < time:
+                    low = middle + 1
+                else:
+                    high = middle
+
+        return low
+
+    def messages(self, start, stop):
+        """
+        Reads messages from the log file, only reading the records they occupy
+
+        :param start: the position of the first message to read
+        :param stop: the position after the last message to read
+        :returns: a list of message dictionaries, see :func:`helga.log.parse_messages`
+        """
+        stop = min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offsets[start])
+            return [record_message(record) for record in islice(read_records(fp), stop - start)]
@@ -0,0 +1,12 @@
+from helga.metrics import render
+from helga.plugins.webhooks import route
+
+
+@route(r'/metrics/?$')
+def metrics(request, irc_client):
+    """
+    An endpoint exposing helga's runtime metrics in the Prometheus text format
+    (see :mod:`helga.metrics`)
+    """
+    request.setHeader('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    return render()
@@ -0,0 +1,46 @@
+from helga.plugins.webhooks import authenticated, route, HttpError
+from helga.profiler import DEFAULT_DURATION, get_profiler
+
+
+@route(r'/profile/?$')
+@authenticated
+def profile(request, irc_client):
+    """
+    An endpoint serving the results of the running or last profile as collapsed stacks
+    (see :mod:`helga.profiler`)
+    """
+    profiler = get_profiler()
+    if profiler.started is None:
+        raise HttpError(404, 'No profile has been recorded')
+
+    request.setHeader('Content-Type', 'text/plain; charset=utf-8')
+    return profiler.collapsed()
+
+
+@route(r'/profile/(?P<action>start|stop)/?$', methods=['POST'])
+@authenticated
+def control_profile(request, irc_client, action):
+    """
+    An endpoint starting or stopping a profile. POST only. When starting, an optional data param
+    'seconds' is the number of seconds to profile for, where zero profiles until stopped.
+    """
+    profiler = get_profiler()
+
+    if action == 'stop':
+        if not profiler.stop():
+            raise HttpError(409, 'No profile is running')
+        return profiler.status()
+
+    try:
+        seconds = int(request.args.get('seconds', [DEFAULT_DURATION])[0])
+    except ValueError:
+        seconds = -1
+
+    if seconds < 0:
+        raise HttpError(400, 'Param seconds must be a non-negative integer')
+
+    if not profiler.start(seconds or None):
+        raise HttpError(409, 'A profile is already running')
+
+    request.setResponseCode(202)
+    return 'Profile started'
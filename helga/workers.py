@@ -0,0 +1,549 @@
+"""
+Multi-process plugin dispatch. When :data:`~helga.settings.WORKER_PROCESSES` is a positive
+integer, the process that holds the chat connection acts as a coordinator and forwards every
+incoming message to one of several worker processes that run the plugin pipeline. Channels are
+sharded across workers so that every message for a given channel is always handled, in order,
+by the same worker. Responses, and any client calls plugins make (``msg``, ``me``, ``join``,
+``leave``), are sent back to the coordinator which relays them over the chat connection.
+
+Coordinator and workers talk over a pair of pipes using length-prefixed JSON frames. Each frame
+is a list whose first item names the frame type:
+
+* ``['message', seq, channel, nick, message, botnick]``: coordinator -> worker, dispatch a message
+* ``['plugins', {channel: [name, ...]}]``: coordinator -> worker, sync channel enabled plugins,
+  or worker -> coordinator, report plugins enabled or disabled on a channel by a plugin
+* ``['responses', seq, channel, nick, message, [response, ...]]``: worker -> coordinator. A worker
+  always responds to a dispatched message, with no responses if processing it failed.
+* ``['call', method, [arg, ...]]``: worker -> coordinator, proxy a client method call
+* ``['coordinator', function, channel, [arg, ...]]``: worker -> coordinator, run one of
+  :data:`COORDINATOR_FUNCTIONS` and send its result to a channel, see :func:`call_in_coordinator`
+
+Since a worker owns all of the channels in its shard, per-channel plugin state lives in that worker.
+Plugins enabled or disabled on the channel of a message, such as with the builtin
+:ref:`builtin.plugins.manager`, are reported back to the coordinator, so that they survive a worker
+restart. A message that a worker does not respond to within :data:`~helga.settings.WORKER_TIMEOUT`
+seconds is given up on.
+
+Other state is kept separately by each process and is not reported to the coordinator. Operator
+commands about the process itself, such as reactor lag (see :mod:`helga.lag`), are answered by the
+coordinator, which holds the chat connection and serves webhooks. Workers only search the channel
+log search index (see :mod:`helga.search`), which the coordinator keeps up to date. In particular,
+the metrics served by the ``metrics`` webhook (see :mod:`helga.metrics`) do not include those updated
+by plugins or the plugin registry in workers, such as plugin timings and cache hits, rate limited
+and suppressed messages. Rate limits (see :mod:`helga.ratelimit`) and message suppression (see
+:mod:`helga.suppress`) still apply as configured, since all messages of a channel go to one worker,
+but a restarted worker starts them afresh. Signals (see :ref:`plugins.signals`) are only ever sent
+in the coordinator process.
+"""
+import importlib
+import json
+import os
+import struct
+import sys
+import zlib
+
+from collections import defaultdict
+
+import smokesignal
+
+from twisted.internet import defer, error, protocol, reactor, stdio
+
+from helga import log, settings
+from helga.comm.base import BaseClient
+from helga.plugins import registry, ResponseNotReady
+from helga.util.encodings import from_unicode, to_unicode
+
+
+logger = log.getLogger(__name__)
+
+
+#: The child file descriptor on which a worker receives frames from the coordinator
+WORKER_READ_FD = 3
+
+#: The child file descriptor on which a worker sends frames to the coordinator
+WORKER_WRITE_FD = 4
+
+#: Client methods that a worker is allowed to proxy to the coordinator's chat client
+PROXIED_METHODS = ('msg', 'me', 'join', 'leave')
+
+#: Functions that a worker is allowed to run in the coordinator, see :func:`call_in_coordinator`
+COORDINATOR_FUNCTIONS = (
+    'helga.plugins.operator.lag_summary',
+    'helga.plugins.operator.control_profiler',
+)
+
+_header = struct.Struct('!I')
+
+
+def _decode_strings(value):
+    """
+    Returns a copy of a frame with every byte string decoded to unicode. Chat clients may pass
+    byte strings that are not valid UTF-8, such as latin-1 IRC messages, so undecodable bytes
+    are replaced rather than failing the frame.
+    """
+    if isinstance(value, str):
+        return to_unicode(value, errors='replace')
+    if isinstance(value, (list, tuple)):
+        return map(_decode_strings, value)
+    if isinstance(value, dict):
+        return dict((_decode_strings(k), _decode_strings(v)) for k, v in value.iteritems())
+    return value
+
+
+def encode(frame):
+    """
+    Encode a frame as a length-prefixed, compact JSON byte string. Byte strings are decoded as
+    UTF-8, replacing any invalid bytes.
+
+    :param frame: a JSON serializable list
+    :returns: a byte string suitable for writing to a worker pipe
+    """
+    payload = json.dumps(_decode_strings(frame), separators=(',', ':'))
+    return _header.pack(len(payload)) + payload
+
+
+class FrameDecoder(object):
+    """
+    Incrementally decodes a stream of bytes into frames created by :func:`encode`
+    """
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        """
+        Feed received bytes to the decoder
+
+        :param data: a byte string read from a worker pipe
+        :returns: a list of complete frames decoded so far
+        """
+        self.buffer += data
+        frames = []
+
+        while len(self.buffer) >= _header.size:
+            length, = _header.unpack_from(self.buffer)
+            end = _header.size + length
+
+            if len(self.buffer) < end:
+                break
+
+            frames.append(json.loads(self.buffer[_header.size:end]))
+            self.buffer = self.buffer[end:]
+
+        return frames
+
+
+def shard(channel, num_workers):
+    """
+    Determine which worker handles a channel. This is stable across processes and restarts.
+
+    :param channel: the channel name
+    :param num_workers: the total number of workers
+    :returns: an integer index of the worker
+    """
+    return (zlib.crc32(from_unicode(channel.lower())) & 0xffffffff) % num_workers
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """
+    The coordinator side of a single worker process. Frames received from the worker
+    are handed back to the owning :class:`WorkerPool`.
+    """
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.decoder = FrameDecoder()
+
+    def send(self, frame):
+        """
+        Send a frame to this worker
+
+        :param frame: a JSON serializable list
+        """
+        self.transport.writeToChild(WORKER_READ_FD, encode(frame))
+
+    def childDataReceived(self, fd, data):
+        if fd != WORKER_WRITE_FD:  # pragma: no cover
+            return
+
+        for frame in self.decoder.feed(data):
+            self.pool.frame_received(self, frame)
+
+    def processEnded(self, reason):
+        self.pool.worker_ended(self, reason)
+
+
+class WorkerPool(object):
+    """
+    Manages a fixed number of worker processes and dispatches messages to them. Each
+    dispatched message returns a deferred that fires with a four-tuple of the channel,
+    nick and message after preprocessing, and a list of plugin responses.
+
+    .. attribute:: workers
+
+        A list of :class:`WorkerProcess`, one for each running worker
+
+    .. attribute:: pending
+
+        A dictionary of in-flight dispatch sequence numbers to two-tuples of the owning
+        worker index and the deferred for that dispatch
+    """
+
+    def __init__(self, num_workers):
+        """
+        :param num_workers: the number of worker processes to run
+        """
+        self.num_workers = num_workers
+        self.client = None
+        self.workers = [None] * num_workers
+        self.pending = {}
+        self.running = False
+        self._seq = 0
+
+    def start(self):
+        """
+        Spawn all worker processes and stop them when the reactor shuts down
+        """
+        logger.info('Starting %s plugin worker processes', self.num_workers)
+        self.running = True
+
+        for index in xrange(self.num_workers):
+            self.spawn(index)
+
+        smokesignal.on('signon', self.attach)
+        reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def attach(self, client):
+        """
+        Attach the pool to a chat client that has signed on. The client will dispatch
+        messages to the pool, and calls proxied by workers are performed with the client.
+        Workers are sent the enabled plugins once all other signon handlers have run.
+
+        :param client: the chat client that has signed on
+        """
+        self.client = client
+        client.workers = self
+        reactor.callLater(0, self.sync_plugins)
+
+    def spawn(self, index):
+        """
+        Spawn a single worker process with the given index. Worker stdout and stderr
+        are shared with the coordinator so that worker logging is not lost.
+
+        :param index: the index of the worker
+        """
+        worker = WorkerProcess(self, index)
+        reactor.spawnProcess(worker,
+                             sys.executable,
+                             args=[sys.executable, '-m', 'helga.bin.worker'],
+                             env=os.environ.copy(),
+                             childFDs={0: 0, 1: 1, 2: 2, WORKER_READ_FD: 'w', WORKER_WRITE_FD: 'r'})
+        self.workers[index] = worker
+
+        # Workers start with the enabled plugins the coordinator knows about
+        worker.send(['plugins', self.enabled_plugins()])
+
+    def stop(self):
+        """
+        Stop all worker processes by closing their pipes
+        """
+        self.running = False
+
+        for worker in filter(None, self.workers):
+            try:
+                worker.transport.closeChildFD(WORKER_READ_FD)
+            except error.ProcessExitedAlready:  # pragma: no cover
+                pass
+
+    def enabled_plugins(self):
+        """
+        A JSON serializable copy of the enabled plugins per channel of the coordinator registry
+        """
+        return dict((channel, sorted(names)) for channel, names in registry.enabled_plugins.iteritems())
+
+    def sync_plugins(self):
+        """
+        Send the enabled plugins per channel of the coordinator registry to all workers. This
+        is used, for example, when plugins are automatically enabled on signon.
+        """
+        plugins = self.enabled_plugins()
+        for worker in filter(None, self.workers):
+            worker.send(['plugins', plugins])
+
+    def dispatch(self, channel, nick, message, botnick):
+        """
+        Dispatch a message to the worker that owns the channel
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param message: the message received
+        :param botnick: the current nick of the bot
+        :returns: a deferred firing with a four-tuple (channel, nick, message, responses)
+        """
+        index = shard(channel, self.num_workers)
+        worker = self.workers[index]
+
+        if worker is None:
+            return defer.fail(RuntimeError('Worker {0} is not running'.format(index)))
+
+        self._seq += 1
+        seq = self._seq
+        d = defer.Deferred(canceller=lambda _: self.pending.pop(seq, None))
+
+        self.pending[seq] = (index, d)
+        worker.send(['message', seq, channel, nick, message, botnick])
+
+        timeout = getattr(settings, 'WORKER_TIMEOUT', 30)
+        if timeout:
+            d.addTimeout(timeout, reactor)
+
+        return d
+
+    def frame_received(self, worker, frame):
+        """
+        Handle a frame sent by a worker
+
+        :param worker: the :class:`WorkerProcess` that sent the frame
+        :param frame: the decoded frame
+        """
+        kind = frame[0]
+
+        if kind == 'responses':
+            _, seq, channel, nick, message, responses = frame
+            try:
+                _, d = self.pending.pop(seq)
+            except KeyError:
+                logger.error('Worker %s responded to unknown message %s', worker.index, seq)
+                return
+            d.callback((channel, nick, message, responses))
+
+        elif kind == 'call':
+            _, method, args = frame
+            if method not in PROXIED_METHODS or self.client is None:
+                logger.error('Worker %s attempted unsupported client call %s', worker.index, method)
+                return
+            getattr(self.client, method)(*args)
+
+        elif kind == 'coordinator':
+            _, function, channel, args = frame
+            if function not in COORDINATOR_FUNCTIONS or self.client is None:
+                logger.error('Worker %s attempted unsupported coordinator call %s', worker.index, function)
+                return
+
+            module, name = function.rsplit('.', 1)
+            try:
+                result = getattr(importlib.import_module(module), name)(*args)
+            except Exception:
+                logger.exception('Coordinator call %s from worker %s failed', function, worker.index)
+                return
+
+            if result:
+                self.client.msg(channel, result)
+
+        elif kind == 'plugins':
+            for channel, names in frame[1].iteritems():
+                registry.enabled_plugins[channel] = set(names)
+
+        else:
+            logger.error('Unknown frame type from worker %s: %s', worker.index, kind)
+
+    def worker_ended(self, worker, reason):
+        """
+        Handle a worker process exiting. Any messages still pending on that worker are
+        failed, and the worker is restarted unless the pool is stopping.
+
+        :param worker: the :class:`WorkerProcess` that ended
+        :param reason: a twisted Failure instance
+        """
+        self.workers[worker.index] = None
+
+        for seq, (index, d) in self.pending.items():
+            if index == worker.index:
+                del self.pending[seq]
+                d.errback(reason)
+
+        if not self.running:
+            return
+
+        logger.error('Worker %s exited unexpectedly: %s', worker.index, reason)
+        delay = getattr(settings, 'AUTO_RECONNECT_DELAY', 5)
+        reactor.callLater(delay, self.spawn, worker.index)
+
+
+def start(num_workers):
+    """
+    Create and start a :class:`WorkerPool`. The pool attaches itself to the chat client
+    once it has signed on.
+
+    :param num_workers: the number of worker processes to run
+    :returns: the started :class:`WorkerPool`
+    """
+    pool = WorkerPool(num_workers)
+    pool.start()
+    return pool
+
+
+def call_in_coordinator(client, channel, function, *args):
+    """
+    Run a function in the process holding the chat connection, for plugins that report on or
+    control that process rather than the worker they run in. Outside a worker, the function is
+    simply called and its result returned. In a worker, it is run by the coordinator, which sends
+    its result to the channel, and :exc:`~helga.plugins.ResponseNotReady` is raised. The function
+    must be listed in :data:`COORDINATOR_FUNCTIONS`, and its arguments must be JSON serializable.
+
+    :param client: the chat client given to the plugin
+    :param channel: the channel to send the result to
+    :param function: the function to run
+    :param args: the arguments to call the function with
+    """
+    if not isinstance(client, WorkerClient):
+        return function(*args)
+
+    name = '{0}.{1}'.format(function.__module__, function.__name__)
+    client.worker.send(['coordinator', name, channel, list(args)])
+    raise ResponseNotReady
+
+
+class WorkerClient(BaseClient):
+    """
+    A stand-in chat client given to plugins running in a worker process. Calls to any of
+    :data:`PROXIED_METHODS` are sent to the coordinator to be performed over the real chat
+    connection. The ``nickname`` attribute is kept current with each dispatched message.
+    """
+
+    def __init__(self, worker):
+        super(WorkerClient, self).__init__()
+        self.worker = worker
+        self.nickname = settings.NICK
+
+    def _proxy(self, method, *args):
+        self.worker.send(['call', method, list(args)])
+
+    def msg(self, channel, message):
+        self._proxy('msg', channel, message)
+
+    def me(self, channel, message):
+        self._proxy('me', channel, message)
+
+    def join(self, channel, *args):
+        self._proxy('join', channel, *args)
+
+    def leave(self, channel, *args):
+        self._proxy('leave', channel, *args)
+
+
+class Worker(protocol.Protocol):
+    """
+    The worker side of the coordinator connection. Runs the plugin pipeline for each
+    dispatched message in the order in which they are received.
+    """
+
+    def __init__(self):
+        self.decoder = FrameDecoder()
+        self.client = WorkerClient(self)
+
+        # Channel -> the enabled plugins last known to the coordinator
+        self.synced = {}
+
+    def send(self, frame):
+        """
+        Send a frame to the coordinator
+
+        :param frame: a JSON serializable list
+        """
+        self.transport.write(encode(frame))
+
+    def dataReceived(self, data):
+        for frame in self.decoder.feed(data):
+            try:
+                self.frame_received(frame)
+            except Exception:
+                logger.exception('Failed to handle frame %s', frame[0])
+
+    def frame_received(self, frame):
+        """
+        Handle a frame sent by the coordinator
+
+        :param frame: the decoded frame
+        """
+        kind = frame[0]
+
+        if kind == 'message':
+            _, seq, channel, nick, message, botnick = frame
+            self.client.nickname = botnick
+
+            # The coordinator waits on a response, even if there are none
+            try:
+                channel, nick, message, responses = self.process(channel, nick, message)
+            except Exception:
+                logger.exception('Failed to process message %s on %s', seq, channel)
+                responses = []
+
+            self.send(['responses', seq, channel, nick, message, responses])
+            self.report_plugins(channel)
+
+        elif kind == 'plugins':
+            enabled = defaultdict(lambda: registry.default_channel_plugins)
+            enabled.update((channel, set(names)) for channel, names in frame[1].iteritems())
+            registry.enabled_plugins = enabled
+            self.synced = dict((channel, set(names)) for channel, names in frame[1].iteritems())
+
+        else:
+            logger.error('Unknown frame type from coordinator: %s', kind)
+
+    def report_plugins(self, channel):
+        """
+        Report the enabled plugins of a channel to the coordinator if a plugin has changed them
+
+        :param channel: the channel of the message just processed
+        """
+        enabled = set(registry.enabled_plugins[channel])
+        if enabled != self.synced.get(channel, registry.default_channel_plugins):
+            self.synced[channel] = enabled
+            self.send(['plugins', {channel: sorted(enabled)}])
+
+    def process(self, channel, nick, message):
+        """
+        Run the plugin preprocess and process pipeline for a message
+
+        :param channel: the channel from which the message came
+        :param nick: the nick of the user sending the message
+        :param message: the message received
+        :returns: a four-tuple (channel, nick, message, responses)
+        """
+        try:
+            channel, nick, message = registry.preprocess(self.client, channel, nick, message)
+        except (TypeError, ValueError):
+            pass
+
+        responses = registry.process(self.client, channel, nick, message)
+        if message is not None:
+            self.client.last_message[channel][nick] = message
+            self.client.record_message(channel, nick, message)
+
+        if responses:
+            self.client.record_message(channel, self.client.nickname, u'\n'.join(responses))
+
+        return channel, nick, message, responses
+
+    def connectionLost(self, reason):
+        logger.info('Coordinator connection closed, stopping worker')
+        if reactor.running:
+            reactor.stop()
+
+
+def run():  # pragma: no cover
+    """
+    Run a worker process, serving the coordinator over the pipes it created. Settings must
+    already be configured (see :mod:`helga.bin.worker`).
+    """
+    # Only the coordinator, which writes channel logs, updates the search index
+    from helga import search
+    search.read_only = True
+
+    # Loads plugins
+    smokesignal.emit('started')
+
+    stdio.StandardIO(Worker(), stdin=WORKER_READ_FD, stdout=WORKER_WRITE_FD)
+    reactor.run()
@@ -72,16 +72,19 @@ setup(name=helga.__title__,
       cmdclass={'test': PyTest},
       entry_points=dict(
           helga_plugins=[
-              'help     = helga.plugins.help:help',
-              'manager  = helga.plugins.manager:manager',
-              'operator = helga.plugins.operator:operator',
-              'ping     = helga.plugins.ping:ping',
-              'version  = helga.plugins.version:version',
-              'webhooks = helga.plugins.webhooks:WebhookPlugin',
+              'help      = helga.plugins.help:help',
+              'logsearch = helga.plugins.logsearch:logsearch',
+              'manager   = helga.plugins.manager:manager',
+              'operator  = helga.plugins.operator:operator',
+              'ping      = helga.plugins.ping:ping',
+              'version   = helga.plugins.version:version',
+              'webhooks  = helga.plugins.webhooks:WebhookPlugin',
           ],
           helga_webhooks=[
               'announcements = helga.webhooks.announcements:announce',
-              'logger        = helga.webhooks.logger:logger'
+              'logger        = helga.webhooks.logger:logger',
+              'metrics       = helga.webhooks.metrics:metrics',
+              'profile       = helga.webhooks.profile:profile',
           ],
           console_scripts=[
               'helga = helga.bin.helga:main',